@@ -143,7 +143,38 @@ fi
 if [ -n "${input_file_path:-}" ] ; then
   data_stores="disk $data_stores"
   additional_flags="$additional_flags \
-  --input_file_path ${input_file_path}"
+  --input_file_path ${input_file_path} \
+  --link_mode ${EXTRN_MDL_LINK_MODE:-copy}"
+fi
+
+if [ -n "${EXTRN_MDL_CACHE_DIR:-}" ] ; then
+  mkdir_vrfy -p "${EXTRN_MDL_CACHE_DIR}"
+  additional_flags="$additional_flags \
+  --cache_dir ${EXTRN_MDL_CACHE_DIR} \
+  --cache_max_gb ${EXTRN_MDL_CACHE_MAX_GB:-0}"
+fi
+
+if [ -n "${EXTRN_MDL_HTAR_INDEX_DIR:-}" ] ; then
+  mkdir_vrfy -p "${EXTRN_MDL_HTAR_INDEX_DIR}"
+  additional_flags="$additional_flags \
+  --index_dir ${EXTRN_MDL_HTAR_INDEX_DIR}"
+fi
+
+if [ -n "${EXTRN_MDL_TELEMETRY_FILE:-}" ] ; then
+  mkdir_vrfy -p "$( dirname "${EXTRN_MDL_TELEMETRY_FILE}" )"
+  additional_flags="$additional_flags \
+  --telemetry ${EXTRN_MDL_TELEMETRY_FILE}"
+fi
+
+if [ "${ICS_OR_LBCS}" = "LBCS" ] && \
+   [ "${EXTRN_MDL_FOLLOW_LBCS:-FALSE}" = "TRUE" ] ; then
+  additional_flags="$additional_flags \
+  --follow"
+fi
+
+if [ "${EXTRN_MDL_RACE_DATA_STORES:-0}" -gt 0 ] ; then
+  additional_flags="$additional_flags \
+  --race ${EXTRN_MDL_RACE_DATA_STORES}"
 fi
 
 #
@@ -164,6 +195,7 @@ python3 -u ${USHDIR}/retrieve_data.py \
   --fcst_hrs ${fcst_hrs[@]} \
   --output_path ${extrn_mdl_staging_dir} \
   --summary_file ${EXTRN_MDL_VAR_DEFNS_FN} \
+  --stats \
   $additional_flags"
 
 $cmd || print_err_msg_exit "\
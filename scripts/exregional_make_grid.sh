@@ -395,7 +395,8 @@ res_equiv=${res_equiv//$'\n'/}
 #
 # Set the string CRES that will be comprise the start of the grid file
 # name (and other file names later in other tasks/scripts).  Then set its
-# value in the variable definitions file.
+# value in the global variable definitions file and in the variable defi-
+# nitions files of the tasks that use it.
 #
 #-----------------------------------------------------------------------
 #
@@ -408,7 +409,16 @@ if [ "${GRID_GEN_METHOD}" = "GFDLgrid" ]; then
 elif [ "${GRID_GEN_METHOD}" = "ESGgrid" ]; then
   CRES="C${res_equiv}"
 fi
-set_file_param "${GLOBAL_VAR_DEFNS_FP}" "CRES" "'$CRES'"
+for var_defns_fp in "${EXPTDIR}/${GLOBAL_VAR_DEFNS_FN}" \
+                    "${TASK_VAR_DEFNS_DIR}"/*_"${GLOBAL_VAR_DEFNS_FN}"; do
+  if grep -qs "^CRES=" "${var_defns_fp}"; then
+    set_file_param "${var_defns_fp}" "CRES" "'$CRES'"
+  elif [ -f "${var_defns_fp}" ]; then
+    # Keep the files of the tasks newer than the global one, so that the
+    # tasks keep using them (see load_modules_run_task.sh).
+    touch "${var_defns_fp}"
+  fi
+done
 #
 #-----------------------------------------------------------------------
 #
@@ -6,8 +6,7 @@ import argparse
 
 from python_utils import (
     set_env_var,
-    import_vars,
-    export_vars,
+    ExperimentConfig,
     load_config_file,
     flatten_dict,
 )
@@ -18,58 +17,53 @@ from set_gridparams_GFDLgrid import set_gridparams_GFDLgrid
 
 
 def calculate_cost(config_fn):
-    global PREDEF_GRID_NAME, QUILTING, GRID_GEN_METHOD
-
-    # import all environment variables
-    import_vars()
+    cfg = ExperimentConfig.from_env()
 
     # get grid config parameters (predefined or custom)
-    if PREDEF_GRID_NAME:
-        set_env_var("QUILTING", False)
-        set_predef_grid_params()
-        import_vars()
+    if cfg.get("PREDEF_GRID_NAME"):
+        cfg.QUILTING = False
+        set_predef_grid_params(cfg)
     else:
         cfg_u = load_config_file(config_fn)
-        cfg_u = flatten_dict(cfg_u)
-        import_vars(dictionary=cfg_u)
+        cfg.update(flatten_dict(cfg_u))
 
     # number of gridpoints (nx*ny) depends on grid generation method
-    if GRID_GEN_METHOD == "GFDLgrid":
+    if cfg.GRID_GEN_METHOD == "GFDLgrid":
         grid_params = set_gridparams_GFDLgrid(
-            lon_of_t6_ctr=GFDLgrid_LON_T6_CTR,
-            lat_of_t6_ctr=GFDLgrid_LAT_T6_CTR,
-            res_of_t6g=GFDLgrid_NUM_CELLS,
-            stretch_factor=GFDLgrid_STRETCH_FAC,
-            refine_ratio_t6g_to_t7g=GFDLgrid_REFINE_RATIO,
-            istart_of_t7_on_t6g=GFDLgrid_ISTART_OF_RGNL_DOM_ON_T6G,
-            iend_of_t7_on_t6g=GFDLgrid_IEND_OF_RGNL_DOM_ON_T6G,
-            jstart_of_t7_on_t6g=GFDLgrid_JSTART_OF_RGNL_DOM_ON_T6G,
-            jend_of_t7_on_t6g=GFDLgrid_JEND_OF_RGNL_DOM_ON_T6G,
+            lon_of_t6_ctr=cfg.GFDLgrid_LON_T6_CTR,
+            lat_of_t6_ctr=cfg.GFDLgrid_LAT_T6_CTR,
+            res_of_t6g=cfg.GFDLgrid_NUM_CELLS,
+            stretch_factor=cfg.GFDLgrid_STRETCH_FAC,
+            refine_ratio_t6g_to_t7g=cfg.GFDLgrid_REFINE_RATIO,
+            istart_of_t7_on_t6g=cfg.GFDLgrid_ISTART_OF_RGNL_DOM_ON_T6G,
+            iend_of_t7_on_t6g=cfg.GFDLgrid_IEND_OF_RGNL_DOM_ON_T6G,
+            jstart_of_t7_on_t6g=cfg.GFDLgrid_JSTART_OF_RGNL_DOM_ON_T6G,
+            jend_of_t7_on_t6g=cfg.GFDLgrid_JEND_OF_RGNL_DOM_ON_T6G,
+            cfg=cfg,
         )
 
-    elif GRID_GEN_METHOD == "ESGgrid":
+    elif cfg.GRID_GEN_METHOD == "ESGgrid":
         grid_params = set_gridparams_ESGgrid(
-            lon_ctr=ESGgrid_LON_CTR,
-            lat_ctr=ESGgrid_LAT_CTR,
-            nx=ESGgrid_NX,
-            ny=ESGgrid_NY,
-            pazi=ESGgrid_PAZI,
-            halo_width=ESGgrid_WIDE_HALO_WIDTH,
-            delx=ESGgrid_DELX,
-            dely=ESGgrid_DELY,
+            lon_ctr=cfg.ESGgrid_LON_CTR,
+            lat_ctr=cfg.ESGgrid_LAT_CTR,
+            nx=cfg.ESGgrid_NX,
+            ny=cfg.ESGgrid_NY,
+            pazi=cfg.ESGgrid_PAZI,
+            halo_width=cfg.ESGgrid_WIDE_HALO_WIDTH,
+            delx=cfg.ESGgrid_DELX,
+            dely=cfg.ESGgrid_DELY,
+            cfg=cfg,
         )
 
     NX = grid_params["NX"]
     NY = grid_params["NY"]
-    cost = [DT_ATMOS, NX * NY]
+    cost = [cfg.DT_ATMOS, NX * NY]
 
     # reference grid (6-hour forecast on RRFS_CONUS_25km)
-    PREDEF_GRID_NAME = "RRFS_CONUS_25km"
+    cfg.PREDEF_GRID_NAME = "RRFS_CONUS_25km"
 
-    export_vars()
-    set_predef_grid_params()
-    import_vars()
-    cost.extend([DT_ATMOS, ESGgrid_NX * ESGgrid_NY])
+    set_predef_grid_params(cfg)
+    cost.extend([cfg.DT_ATMOS, cfg.ESGgrid_NX * cfg.ESGgrid_NY])
 
     return cost
 
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import glob
+import argparse
+import unittest
+import subprocess
+import tempfile
+from functools import lru_cache
+
+from python_utils import (
+    print_input_args,
+    print_info_msg,
+    mkdir_vrfy,
+    cfg_to_shell_str,
+    load_config_file,
+    load_shell_config,
+    flatten_dict,
+)
+
+# names of variables, of shell/python scripts and of imported python modules
+VAR_NAME_RE = re.compile(r"[A-Za-z_]\w*")
+SCRIPT_FN_RE = re.compile(r"[\w.-]+\.(?:sh|py)\b")
+PY_IMPORT_RE = re.compile(r"^\s*(?:from|import)\s+(\w+)", re.MULTILINE)
+COMMENT_LINE_RE = re.compile(r"^\s*#.*$", re.MULTILINE)
+
+
+def get_script_index(ushdir, scriptsdir, jobsdir):
+    """Finds the workflow's scripts that tasks may run or source
+
+    Args:
+        ushdir: the ush directory
+        scriptsdir: the directory of the ex-scripts
+        jobsdir: the directory of the J-jobs
+    Returns:
+        dictionary mapping a script file name (or a python module name) to
+        the list of files it stands for
+    """
+
+    index = {}
+    for pattern in [
+        os.path.join(ushdir, "*.sh"),
+        os.path.join(ushdir, "*.py"),
+        os.path.join(ushdir, "bash_utils", "*.sh"),
+        os.path.join(scriptsdir, "*"),
+        os.path.join(jobsdir, "*"),
+    ]:
+        for fp in glob.glob(pattern):
+            index[os.path.basename(fp)] = [fp]
+            if fp.endswith(".py"):
+                index[os.path.basename(fp)[:-3]] = [fp]
+    index["python_utils"] = sorted(
+        glob.glob(os.path.join(ushdir, "python_utils", "*.py"))
+    )
+    return index
+
+
+@lru_cache(maxsize=None)
+def scan_file(fp):
+    """Scans a script for the names of the scripts (and python modules) it
+    refers to, and for the names of variables
+
+    Args:
+        fp: path of the script
+    Returns:
+        tuple of the list of script names and the set of variable names
+    """
+
+    with open(fp) as f:
+        contents = f.read()
+    code = COMMENT_LINE_RE.sub("", contents)
+    script_names = SCRIPT_FN_RE.findall(code)
+    if fp.endswith(".py"):
+        script_names += PY_IMPORT_RE.findall(code)
+    return script_names, set(VAR_NAME_RE.findall(contents))
+
+
+def get_task_files(start_fps, index):
+    """Finds the files a task runs or sources, starting from the given
+    files and following the script names (and python imports) in them
+
+    Args:
+        start_fps: list of files the task starts with
+        index: dictionary returned by get_script_index()
+    Returns:
+        set of file paths
+    """
+
+    task_fps = set()
+    todo = list(start_fps)
+    while todo:
+        fp = todo.pop()
+        if fp in task_fps or not os.path.isfile(fp):
+            continue
+        task_fps.add(fp)
+        for name in scan_file(fp)[0]:
+            todo.extend(index.get(name, []))
+    return task_fps
+
+
+def get_task_vars(task_fps, cfg):
+    """Finds the experiment variables a task's files refer to
+
+    Any name in the files is kept, including names in comments and
+    messages, as well as the names that the values of those variables
+    refer to (e.g. the ones expanded by "eval echo ${RUN_CMD_FCST}").
+
+    Args:
+        task_fps: files returned by get_task_files()
+        cfg: flattened dictionary of experiment variables
+    Returns:
+        set of variable names
+    """
+
+    names = set()
+    for fp in task_fps:
+        names.update(scan_file(fp)[1])
+
+    task_vars = set()
+    todo = list(names & cfg.keys())
+    while todo:
+        k = todo.pop()
+        if k in task_vars:
+            continue
+        task_vars.add(k)
+        todo.extend(set(VAR_NAME_RE.findall(str(cfg[k]))) & cfg.keys())
+    return task_vars
+
+
+def select_vars(cfg, task_vars):
+    """Gets a copy of a (nested) config with only the selected variables,
+    keeping the sections and the order of the variables"""
+
+    selected = {}
+    for k, v in cfg.items():
+        if isinstance(v, dict):
+            v = select_vars(v, task_vars)
+            if v:
+                selected[k] = v
+        elif k in task_vars:
+            selected[k] = v
+    return selected
+
+
+def create_task_var_defns_files(cfg_d, task_var_defns_dir, verbose=False):
+    """Creates a variable definitions file for each J-job, with only the
+    variables that the J-job, the scripts it runs and load_modules_run_task.sh
+    refer to.  Each file sets GLOBAL_VAR_DEFNS_FP to its own path, so that
+    a task that switches to it (see load_modules_run_task.sh) keeps using it.
+
+    Args:
+        cfg_d: dictionary of the global variable definitions file
+        task_var_defns_dir: directory in which to create the files
+        verbose: print the number of variables in each file
+    Returns:
+        dictionary mapping the name of each J-job to the file created for it
+    """
+
+    print_input_args(locals())
+
+    cfg = flatten_dict(cfg_d)
+    ushdir = cfg["USHDIR"]
+    index = get_script_index(ushdir, cfg["SCRIPTSDIR"], cfg["JOBSDIR"])
+    start_fps = [os.path.join(ushdir, "load_modules_run_task.sh")]
+    if cfg.get("MACHINE_FILE"):
+        start_fps.append(cfg["MACHINE_FILE"])
+
+    mkdir_vrfy(f' -p "{task_var_defns_dir}"')
+
+    task_var_defns_fps = {}
+    for jjob_fp in sorted(glob.glob(os.path.join(cfg["JOBSDIR"], "JREGIONAL_*"))):
+        jjob_fn = os.path.basename(jjob_fp)
+        task_var_defns_fp = os.path.join(
+            task_var_defns_dir, f"{jjob_fn}_{cfg['GLOBAL_VAR_DEFNS_FN']}"
+        )
+
+        task_fps = get_task_files(start_fps + [jjob_fp], index)
+        task_vars = get_task_vars(task_fps, cfg)
+        task_vars.add("GLOBAL_VAR_DEFNS_FP")
+        task_cfg_d = select_vars(cfg_d, task_vars)
+        for section in task_cfg_d.values():
+            if isinstance(section, dict) and "GLOBAL_VAR_DEFNS_FP" in section:
+                section["GLOBAL_VAR_DEFNS_FP"] = task_var_defns_fp
+
+        with open(task_var_defns_fp, "w") as f:
+            f.write(cfg_to_shell_str(task_cfg_d))
+        task_var_defns_fps[jjob_fn] = task_var_defns_fp
+
+        print_info_msg(
+            f"""
+            Wrote {len(task_vars)} of {len(cfg)} variables, used by {len(task_fps)}
+            scripts, to the variable definitions file of {jjob_fn}:
+              task_var_defns_fp = \"{task_var_defns_fp}\"""",
+            verbose=verbose,
+        )
+
+    return task_var_defns_fps
+
+
+def parse_args(argv):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Creates a variable definitions file for each task."
+    )
+
+    parser.add_argument(
+        "-p",
+        "--path-to-defns",
+        dest="path_to_defns",
+        required=True,
+        help="Path to var_defns file.",
+    )
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    cfg_d = load_shell_config(args.path_to_defns, return_string=1)
+    create_task_var_defns_files(
+        cfg_d, flatten_dict(cfg_d)["TASK_VAR_DEFNS_DIR"], verbose=True
+    )
+
+
+class Testing(unittest.TestCase):
+    def test_create_task_var_defns_files(self):
+        fps = create_task_var_defns_files(self.cfg_d, self.task_var_defns_dir)
+        self.assertEqual(
+            len(fps), len(glob.glob(os.path.join(self.jobsdir, "JREGIONAL_*")))
+        )
+        fp = fps["JREGIONAL_MAKE_GRID"]
+        cfg = flatten_dict(load_shell_config(fp))
+        # variables of the task, and the ones their values refer to
+        self.assertIn("GRID_GEN_METHOD", cfg)
+        self.assertIn("NNODES_RUN_FCST", cfg)
+        self.assertNotIn("WRTCMP_output_grid", cfg)
+        self.assertEqual(cfg["GLOBAL_VAR_DEFNS_FP"], fp)
+        # the file can be sourced
+        cmd = f". {fp} && echo $GRID_GEN_METHOD"
+        out = subprocess.run(["bash", "-c", cmd], capture_output=True, text=True)
+        self.assertEqual(out.stdout.strip(), "ESGgrid")
+        self.assertLess(os.path.getsize(fp), len(cfg_to_shell_str(self.cfg_d)))
+
+    def setUp(self):
+        USHDIR = os.path.dirname(os.path.abspath(__file__))
+        self.jobsdir = os.path.join(USHDIR, os.pardir, "jobs")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.task_var_defns_dir = os.path.join(self.tmp_dir.name, "task_var_defns")
+        self.cfg_d = load_config_file(os.path.join(USHDIR, "config_defaults.yaml"))
+        self.cfg_d["workflow"]["GRID_GEN_METHOD"] = "ESGgrid"
+        self.cfg_d["platform"]["RUN_CMD_SERIAL"] = "mpirun -n ${NNODES_RUN_FCST}"
+        self.cfg_d["derived"] = {
+            "USHDIR": USHDIR,
+            "SCRIPTSDIR": os.path.join(USHDIR, os.pardir, "scripts"),
+            "JOBSDIR": self.jobsdir,
+            "GLOBAL_VAR_DEFNS_FP": os.path.join(self.tmp_dir.name, "var_defns.sh"),
+        }
@@ -109,10 +109,10 @@ def generate_FV3LAM_wflow():
     #
     # -----------------------------------------------------------------------
     #
-    setup()
+    expt_cfg = setup()
 
-    # import all environment variables
-    import_vars()
+    # import all experiment variables
+    import_vars(dictionary=expt_cfg)
 
     #
     # -----------------------------------------------------------------------
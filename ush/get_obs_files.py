@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Stage the CCPA, NDAS or MRMS observations needed to verify a forecast
+from the daily tarballs on HPSS, in the layout the METplus tasks expect:
+
+    CCPA  proc/YYYYMMDD/ccpa.tHHz.01h.hrap.conus.gb2
+    NDAS  proc/prepbufr.ndas.YYYYMMDDHH
+    MRMS  proc/YYYYMMDD/<product><level>YYYYMMDD-HH0000.grib2
+
+All valid hours of the forecast are planned first, and grouped by the
+tarball that holds them. Each tarball is listed once, through the shared
+index of tarball listings retrieve_data.py keeps, and all of the members
+needed from it are pulled in a single htar call. Several tarballs are
+extracted at the same time. Observations already in place are skipped,
+so an interrupted task can simply be run again.
+
+The members are extracted below raw/, in the directories the tarballs
+hold them in, and then copied to proc/. Both live in the directory given
+by --obs_dir.
+
+Experiments verifying the same dates can share the observations they
+stage through a cache directory given by --cache_dir, keyed by the type,
+product and valid time of each file. Files found there are linked into
+proc/ instead of being staged again, and the files an experiment stages
+are added for the others. The tarballs a task needs are locked while it
+stages them, so concurrent tasks wait for each other instead of reading
+the same tarballs from tape.
+
+To see usage for this script:
+
+    python get_obs_files.py -h
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import datetime as dt
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+
+import mrms_pull_topofhour
+import retrieve_data
+
+# Where the daily tarballs of observations are kept on HPSS
+RUNHISTORY = "/NCEPPROD/hpssprod/runhistory"
+
+# One hour CCPA files in the 00 directory of the tarballs of these days
+# carry the date of the next day, and are shifted back by a day
+CCPA_SHIFT_DAYS = ("20180718", "20210504")
+
+# The MRMS product and level of each field verified
+MRMS_FIELDS = {
+    "REFC": ("MergedReflectivityQCComposite", "_00.50_"),
+    "RETOP": ("EchoTop", "_18_00.50_"),
+}
+
+# The members of a tarball to extract, and where to put them. archives
+# are the candidate tarballs, in order of preference, and pattern is
+# searched for in the normalized paths of their members. The members
+# matched are extracted below raw_dir, and the first of them is copied to
+# target, with its date shifted back a day if shift_day is set. Members
+# are only extracted when target is None. cached holds the (cache key,
+# path) pairs of the files in proc/ that staging the extraction provides.
+Extraction = namedtuple(
+    "Extraction",
+    "archives pattern raw_dir target shift_day cached",
+    defaults=(None, False, ()),
+)
+
+
+def cache_key(product, valid, file_name):
+
+    """Return the key of a file of a product valid at a time in the cache
+    of an observation type. It ends with the name of the file, so that
+    it is linked under that name."""
+
+    return f"{product}/{valid:%Y%m%d%H}/{file_name}"
+
+
+def in_place(target, key, cache=None):
+
+    """Return whether target is in place, linking it from the cache under
+    key if the cache holds it."""
+
+    if os.path.exists(target):
+        logging.info(f"{target} exists. No work to be done.")
+        return True
+    if cache is None:
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return cache.get(key, os.path.dirname(target))
+
+
+def runhistory(day, name):
+
+    """Return the path on HPSS of a tarball of a day, given as YYYYMMDD."""
+
+    return f"{RUNHISTORY}/rh{day[:4]}/{day[:6]}/{day}/{name}"
+
+
+def ccpa_tarball(day):
+
+    """Return the name of the CCPA tarball of a day."""
+
+    if day < "20190812":
+        prefix = "com2_ccpa_prod"
+    elif day <= "20200217":
+        prefix = "gpfs_dell1_nco_ops_com_ccpa_prod"
+    else:
+        prefix = "com_ccpa_prod"
+    return f"{prefix}_ccpa.{day}.tar"
+
+
+def ndas_tarball(valid):
+
+    """Return the name of the NAM prepbufr tarball of a synoptic time."""
+
+    day = f"{valid:%Y%m%d}"
+    if day <= "20190820":
+        prefix = "com2_nam_prod"
+    elif day <= "20200226":
+        prefix = "gpfs_dell1_nco_ops_com_nam_prod"
+    else:
+        prefix = "com_nam_prod"
+    return f"{prefix}_nam.{valid:%Y%m%d%H}.bufr.tar"
+
+
+def mrms_tarballs(day):
+
+    """Return the candidate MRMS tarballs of a day, in order of
+    preference. Until the MRMS files were reorganized, they were kept in
+    the tarball of either of two machines."""
+
+    if day < mrms_pull_topofhour.REORG_DAY:
+        return tuple(
+            runhistory(day, f"ldmdata.{machine}.{day}.tar")
+            for machine in ("gyre", "tide")
+        )
+    return (runhistory(day, "dcom_prod_ldmdata_obs.tar"),)
+
+
+def ccpa_extractions(cycle, fcst_length, obs_dir, accum=1, cache=None):
+
+    """Plan the CCPA files of accumulation accum, in hours, valid at the
+    forecast hours of a cycle that have none in place.
+
+    The files of each 6-hourly period are kept in a directory named for
+    the hour it ends at, in the tarball of the day it ends on, so the
+    ones for 19 to 23Z are in the 00 directory of the next day."""
+
+    extractions = []
+    for fcst_hr in range(accum, fcst_length + 1, accum):
+        valid = cycle + dt.timedelta(hours=fcst_hr)
+        valid_day = f"{valid:%Y%m%d}"
+        file_name = f"ccpa.t{valid:%H}z.{accum:02d}h.hrap.conus.gb2"
+        target = os.path.join(obs_dir, "proc", valid_day, file_name)
+        key = cache_key(f"{accum:02d}h", valid, file_name)
+        if in_place(target, key, cache):
+            continue
+
+        period_end = -(-valid.hour // 6) * 6
+        tar_day = f"{valid + dt.timedelta(days=period_end // 24):%Y%m%d}"
+        subdir = f"{period_end % 24:02d}"
+        extractions.append(
+            Extraction(
+                archives=(runhistory(tar_day, ccpa_tarball(tar_day)),),
+                pattern=rf"(^|/){subdir}/{re.escape(file_name)}$",
+                raw_dir=os.path.join(obs_dir, "raw", tar_day),
+                target=target,
+                shift_day=accum == 1
+                and subdir == "00"
+                and CCPA_SHIFT_DAYS[0] <= valid_day <= CCPA_SHIFT_DAYS[1],
+                cached=((key, target),),
+            )
+        )
+    return extractions
+
+
+def ndas_extractions(cycle, fcst_length, obs_dir, cache=None):
+
+    """Plan the NDAS prepbufr files of the hours of a forecast that have
+    none in place. The tarball of each synoptic time holds the files of
+    it and the five hours before it, as tm00 to tm05."""
+
+    extractions = []
+    for fcst_hr in range(0, fcst_length + 1, 6):
+        valid = cycle + dt.timedelta(hours=fcst_hr)
+        if valid.hour % 6:
+            continue
+        archive = runhistory(f"{valid:%Y%m%d}", ndas_tarball(valid))
+        for offset in range(6):
+            file_valid = valid - dt.timedelta(hours=offset)
+            file_name = f"prepbufr.ndas.{file_valid:%Y%m%d%H}"
+            target = os.path.join(obs_dir, "proc", file_name)
+            key = cache_key("prepbufr", file_valid, file_name)
+            if in_place(target, key, cache):
+                continue
+            extractions.append(
+                Extraction(
+                    archives=(archive,),
+                    pattern=rf"(^|/)nam\.t{valid:%H}z\.prepbufr\.tm{offset:02d}\.nr$",
+                    raw_dir=os.path.join(obs_dir, "raw", f"{valid:%Y%m%d%H}"),
+                    target=target,
+                    cached=((key, target),),
+                )
+            )
+    return extractions
+
+
+def mrms_hours(day, product, level, obs_dir):
+
+    """Return the (cache key, path) pairs of the top of hour files of an
+    MRMS product and level for each hour of a day."""
+
+    start = mrms_pull_topofhour.to_valid_time(f"{day}00")
+    hours = []
+    for hour in range(24):
+        valid = start + dt.timedelta(hours=hour)
+        file_name = f"{product}{level}{valid:%Y%m%d-%H}0000.grib2"
+        hours.append(
+            (
+                cache_key(product + level, valid, file_name),
+                os.path.join(obs_dir, "proc", day, file_name),
+            )
+        )
+    return hours
+
+
+def mrms_extractions(cycle, fcst_length, obs_dir, fields, cache=None):
+
+    """Plan the MRMS files of each field for the days of a forecast that
+    have an hour without a file in place. All of the files of the field
+    for such a day are extracted, to pick the ones closest to the top of
+    each hour from, and the files of every hour of the day are cached.
+
+    Return a dict mapping each Extraction to the day, product and level
+    it is for."""
+
+    extractions = {}
+    for fcst_hr in range(fcst_length + 1):
+        valid = cycle + dt.timedelta(hours=fcst_hr)
+        day = f"{valid:%Y%m%d}"
+        for field in fields:
+            product, level = MRMS_FIELDS[field]
+            hours = mrms_hours(day, product, level, obs_dir)
+            key, target = hours[valid.hour]
+            if in_place(target, key, cache):
+                continue
+            extraction = Extraction(
+                archives=mrms_tarballs(day),
+                pattern=rf"(^|/){re.escape(product + level)}{day}-\d{{6}}\.grib2\.gz$",
+                raw_dir=os.path.join(obs_dir, "raw", day),
+                cached=tuple(hours),
+            )
+            extractions[extraction] = (day, product, level)
+    return extractions
+
+
+def place(source, target, shift_day=False):
+
+    """Copy an extracted file to target, shifting its date back a day with
+    wgrib2 if shift_day is set. The file is written under a temporary
+    name and renamed into place, so a partial file is never left at
+    target. Return whether it was placed."""
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_target = f"{target}.tmp{os.getpid()}"
+    try:
+        if shift_day:
+            cmd = f"wgrib2 {source} -set_date -24hr -grib {tmp_target} -s"
+            logging.info(f"Running command \n {cmd}")
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                check=False,
+                shell=True,
+            )
+            if result.returncode != 0:
+                logging.warning(
+                    f"Command exited with status {result.returncode}: {cmd}"
+                )
+                return False
+        else:
+            logging.info(f"Copying {source} to {target}")
+            shutil.copy(source, tmp_target)
+        os.replace(tmp_target, target)
+    finally:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+    return True
+
+
+def stage_archive(archive, extractions, index, sessions=None):
+
+    """Extract the members a list of extractions need from an archive
+    with a single htar call, and place them.
+
+    Return the list of extractions that could not be staged."""
+
+    members = index.members(archive, sessions=sessions)
+    if members is None:
+        return list(extractions)
+
+    # Members are passed back to htar as it listed them
+    matched = {}
+    targets = {}
+    for extraction in extractions:
+        pattern = re.compile(extraction.pattern)
+        matched[extraction] = sorted(
+            member for member in members if pattern.search(os.path.normpath(member))
+        )
+        for member in matched[extraction]:
+            targets[member] = os.path.join(
+                extraction.raw_dir, os.path.dirname(os.path.normpath(member))
+            )
+
+    unavailable = set()
+    if targets:
+        for directory in set(targets.values()):
+            os.makedirs(directory, exist_ok=True)
+        unavailable = retrieve_data.extract_archive_files(
+            archive, targets, sessions=sessions
+        )
+
+    unstaged = []
+    for extraction in extractions:
+        landed = [
+            os.path.join(targets[member], os.path.basename(member))
+            for member in matched[extraction]
+            if member not in unavailable
+        ]
+        if not landed:
+            logging.warning(f"No member of {archive} matches {extraction.pattern}")
+            unstaged.append(extraction)
+        elif extraction.target and not place(
+            landed[0], extraction.target, extraction.shift_day
+        ):
+            unstaged.append(extraction)
+    return unstaged
+
+
+def stage(extractions, max_hpss_sessions=4, index_dir=None):
+
+    """Stage a list of extractions. The candidate archives of all of them
+    are checked in a single hsi session, the extractions are grouped by
+    the first of their candidates that exists, and the archives are
+    listed and extracted from max_hpss_sessions at a time.
+
+    Return the list of extractions that could not be staged."""
+
+    exists = retrieve_data.hsi_probe(
+        [archive for extraction in extractions for archive in extraction.archives]
+    )
+    by_archive = {}
+    unstaged = []
+    for extraction in extractions:
+        archive = next(
+            (archive for archive in extraction.archives if exists[archive]), None
+        )
+        if archive is None:
+            unstaged.append(extraction)
+        else:
+            by_archive.setdefault(archive, []).append(extraction)
+
+    index = retrieve_data.ArchiveIndex(index_dir or retrieve_data.default_index_dir())
+    sessions = threading.BoundedSemaphore(max(max_hpss_sessions, 1))
+    with ThreadPoolExecutor(max_workers=max(max_hpss_sessions, 1)) as pool:
+        for archive_unstaged in pool.map(
+            lambda item: stage_archive(*item, index, sessions=sessions),
+            by_archive.items(),
+        ):
+            unstaged.extend(archive_unstaged)
+    return unstaged
+
+
+def plan(obtype, cycle, fcst_length, obs_dir, **kwargs):
+
+    """Plan the extractions of the observations of type obtype that are
+    not in place, linking the ones the cache holds.
+
+    Return a dict mapping each Extraction to the day, product and level
+    of MRMS files it is for, or to None."""
+
+    cache = kwargs.get("cache")
+    if obtype == "CCPA":
+        extractions = ccpa_extractions(
+            cycle, fcst_length, obs_dir, accum=kwargs.get("accum", 1), cache=cache
+        )
+    elif obtype == "NDAS":
+        extractions = ndas_extractions(cycle, fcst_length, obs_dir, cache=cache)
+    else:
+        return mrms_extractions(
+            cycle,
+            fcst_length,
+            obs_dir,
+            kwargs.get("fields") or list(MRMS_FIELDS),
+            cache=cache,
+        )
+    return dict.fromkeys(extractions)
+
+
+def stage_planned(extractions, obs_dir, **kwargs):
+
+    """Stage the planned extractions, and pull the MRMS files closest to
+    the top of each hour of the days extracted.
+
+    Return the list of extractions that could not be staged."""
+
+    unstaged = stage(
+        list(extractions),
+        index_dir=kwargs.get("index_dir"),
+        max_hpss_sessions=kwargs.get("max_hpss_sessions", 4),
+    )
+    for extraction, mrms_day in extractions.items():
+        if mrms_day is None or extraction in unstaged:
+            continue
+        day, product, level = mrms_day
+        valid_day = mrms_pull_topofhour.to_valid_time(f"{day}00")
+        mrms_pull_topofhour.pull_top_of_hour(
+            valid_day,
+            valid_day + dt.timedelta(hours=23),
+            os.path.join(obs_dir, "proc"),
+            os.path.join(obs_dir, "raw"),
+            product,
+            level,
+        )
+    return unstaged
+
+
+def get_obs(obtype, cycle, fcst_length, obs_dir, **kwargs):
+
+    """Stage the observations of type obtype (CCPA, NDAS or MRMS) needed
+    to verify the forecast of a cycle out to fcst_length hours in obs_dir.
+
+    Keyword args:
+      accum              accumulation of CCPA files, in hours (default 1)
+      cache              a retrieve_data.FileCache shared by experiments
+      fields             the MRMS fields to stage (default REFC and RETOP)
+      index_dir          the directory of the listings of tarballs
+      max_hpss_sessions  the number of tarballs handled at the same time
+
+    Return the list of extractions that could not be staged."""
+
+    cache = kwargs.get("cache")
+    extractions = plan(obtype, cycle, fcst_length, obs_dir, **kwargs)
+    if cache is None or not extractions:
+        return stage_planned(extractions, obs_dir, **kwargs)
+
+    # The tarballs are locked in a fixed order, so that tasks needing
+    # some of the same ones never wait for each other in a cycle.
+    archives = sorted(
+        {archive for extraction in extractions for archive in extraction.archives}
+    )
+    with contextlib.ExitStack() as locks:
+        for archive in archives:
+            locks.enter_context(cache.lock(archive))
+
+        # Another task may have cached some of them while we waited
+        extractions = plan(obtype, cycle, fcst_length, obs_dir, **kwargs)
+        unstaged = stage_planned(extractions, obs_dir, **kwargs)
+        for extraction in extractions:
+            if extraction in unstaged:
+                continue
+            for key, path in extraction.cached:
+                entry = cache.entry_path(key)
+                if os.path.exists(path) and not (
+                    os.path.exists(entry) and os.path.samefile(path, entry)
+                ):
+                    cache.put(key, path)
+    cache.evict()
+    return unstaged
+
+
+def parse_args(argv):
+
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(
+        description="Stage the observations needed to verify a forecast from HPSS."
+    )
+    parser.add_argument(
+        "--obtype",
+        choices=("CCPA", "NDAS", "MRMS"),
+        help="The type of observations to stage.",
+        required=True,
+    )
+    parser.add_argument(
+        "--cycle_date",
+        help="The cycle date of the forecast in YYYYMMDDHH format.",
+        required=True,
+        type=retrieve_data.to_datetime,
+    )
+    parser.add_argument(
+        "--fcst_length",
+        help="The last forecast hour to stage observations for.",
+        required=True,
+        type=int,
+    )
+    parser.add_argument(
+        "--obs_dir",
+        help="The directory holding the raw and proc directories of the \
+        observations.",
+        required=True,
+    )
+    parser.add_argument(
+        "--accum",
+        default=1,
+        help="The accumulation of CCPA files, in hours.",
+        type=int,
+    )
+    parser.add_argument(
+        "--fields",
+        choices=list(MRMS_FIELDS),
+        help="The MRMS fields to stage.",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--index_dir",
+        help="The directory the listings of tarballs on HPSS are kept in. \
+        Defaults to the one retrieve_data.py uses.",
+    )
+    parser.add_argument(
+        "--max_hpss_sessions",
+        default=4,
+        help="The number of tarballs to list and extract from at the same time.",
+        type=int,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Path to a directory shared across experiments in which staged \
+        observations are cached. Files found there are linked into the \
+        proc directory instead of being staged again.",
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--cache_max_gb",
+        default=0,
+        help="Size limit of the cache directory in GB. The least recently \
+        used files are removed to stay under it. No limit by default.",
+        type=float,
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Print debug messages",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv):
+
+    """Stage the observations, and exit with a non-zero status when some
+    of them could not be staged."""
+
+    cla = vars(parse_args(argv))
+    retrieve_data.setup_logging(cla.pop("debug"))
+    obtype = cla.pop("obtype")
+    cache_dir = cla.pop("cache_dir")
+    max_bytes = int(cla.pop("cache_max_gb") * 1024**3)
+    if cache_dir:
+        cla["cache"] = retrieve_data.FileCache(
+            cache_dir, "obs", obtype, max_bytes=max_bytes
+        )
+    print(
+        f"Staging {obtype} observations for the {cla['fcst_length']}-hour "
+        f"forecast of {cla['cycle_date']:%Y%m%d%H} in {cla['obs_dir']}"
+    )
+    unstaged = get_obs(
+        obtype, cla.pop("cycle_date"), cla.pop("fcst_length"), cla.pop("obs_dir"), **cla
+    )
+    if unstaged:
+        for extraction in unstaged:
+            logging.error(
+                f"Could not stage {extraction.target or extraction.pattern} "
+                f"from {' or '.join(extraction.archives)}"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,7 +7,7 @@ import argparse
 import glob
 
 from python_utils import (
-    import_vars,
+    ExperimentConfig,
     set_env_var,
     print_input_args,
     print_info_msg,
@@ -23,11 +23,12 @@ from python_utils import (
 )
 
 
-def link_fix(verbose, file_group):
+def link_fix(verbose, file_group, cfg=None):
     """This file defines a function that ...
     Args:
         verbose: True or False
         file_group: could be on of ["grid", "orog", "sfc_climo"]
+        cfg: ExperimentConfig, or None, in which case the environment is used
     Returns:
         a string: resolution
     """
@@ -37,8 +38,8 @@ def link_fix(verbose, file_group):
     valid_vals_file_group = ["grid", "orog", "sfc_climo"]
     check_var_valid_value(file_group, valid_vals_file_group)
 
-    # import all environement variables
-    import_vars()
+    if cfg is None:
+        cfg = ExperimentConfig.from_env()
 
     #
     # -----------------------------------------------------------------------
@@ -166,42 +167,46 @@ def link_fix(verbose, file_group):
     #
     if file_group == "grid":
         fns = [
-            f"C*{DOT_OR_USCORE}mosaic.halo{NHW}.nc",
-            f"C*{DOT_OR_USCORE}mosaic.halo{NH4}.nc",
-            f"C*{DOT_OR_USCORE}mosaic.halo{NH3}.nc",
-            f"C*{DOT_OR_USCORE}grid.tile{TILE_RGNL}.halo{NHW}.nc",
-            f"C*{DOT_OR_USCORE}grid.tile{TILE_RGNL}.halo{NH3}.nc",
-            f"C*{DOT_OR_USCORE}grid.tile{TILE_RGNL}.halo{NH4}.nc",
+            f"C*{cfg.DOT_OR_USCORE}mosaic.halo{cfg.NHW}.nc",
+            f"C*{cfg.DOT_OR_USCORE}mosaic.halo{cfg.NH4}.nc",
+            f"C*{cfg.DOT_OR_USCORE}mosaic.halo{cfg.NH3}.nc",
+            f"C*{cfg.DOT_OR_USCORE}grid.tile{cfg.TILE_RGNL}.halo{cfg.NHW}.nc",
+            f"C*{cfg.DOT_OR_USCORE}grid.tile{cfg.TILE_RGNL}.halo{cfg.NH3}.nc",
+            f"C*{cfg.DOT_OR_USCORE}grid.tile{cfg.TILE_RGNL}.halo{cfg.NH4}.nc",
         ]
-        fps = [os.path.join(GRID_DIR, itm) for itm in fns]
-        run_task = f"{RUN_TASK_MAKE_GRID}"
+        fps = [os.path.join(cfg.GRID_DIR, itm) for itm in fns]
+        run_task = f"{cfg.RUN_TASK_MAKE_GRID}"
     #
     elif file_group == "orog":
         fns = [
-            f"C*{DOT_OR_USCORE}oro_data.tile{TILE_RGNL}.halo{NH0}.nc",
-            f"C*{DOT_OR_USCORE}oro_data.tile{TILE_RGNL}.halo{NH4}.nc",
+            f"C*{cfg.DOT_OR_USCORE}oro_data.tile{cfg.TILE_RGNL}.halo{cfg.NH0}.nc",
+            f"C*{cfg.DOT_OR_USCORE}oro_data.tile{cfg.TILE_RGNL}.halo{cfg.NH4}.nc",
         ]
-        if CCPP_PHYS_SUITE == "FV3_HRRR":
+        if cfg.CCPP_PHYS_SUITE == "FV3_HRRR":
             fns += [
-                f"C*{DOT_OR_USCORE}oro_data_ss.tile{TILE_RGNL}.halo{NH0}.nc",
-                f"C*{DOT_OR_USCORE}oro_data_ls.tile{TILE_RGNL}.halo{NH0}.nc",
+                f"C*{cfg.DOT_OR_USCORE}oro_data_ss.tile{cfg.TILE_RGNL}.halo{cfg.NH0}.nc",
+                f"C*{cfg.DOT_OR_USCORE}oro_data_ls.tile{cfg.TILE_RGNL}.halo{cfg.NH0}.nc",
             ]
-        fps = [os.path.join(OROG_DIR, itm) for itm in fns]
-        run_task = f"{RUN_TASK_MAKE_OROG}"
+        fps = [os.path.join(cfg.OROG_DIR, itm) for itm in fns]
+        run_task = f"{cfg.RUN_TASK_MAKE_OROG}"
     #
     # The following list of symlinks (which have the same names as their
     # target files) need to be created made in order for the make_ics and
     # make_lbcs tasks (i.e. tasks involving chgres_cube) to work.
     #
     elif file_group == "sfc_climo":
-        num_fields = len(SFC_CLIMO_FIELDS)
+        num_fields = len(cfg.SFC_CLIMO_FIELDS)
         fns = [None] * (2 * num_fields)
         for i in range(num_fields):
             ii = 2 * i
-            fns[ii] = f"C*.{SFC_CLIMO_FIELDS[i]}.tile{TILE_RGNL}.halo{NH0}.nc"
-            fns[ii + 1] = f"C*.{SFC_CLIMO_FIELDS[i]}.tile{TILE_RGNL}.halo{NH4}.nc"
-        fps = [os.path.join(SFC_CLIMO_DIR, itm) for itm in fns]
-        run_task = f"{RUN_TASK_MAKE_SFC_CLIMO}"
+            fns[
+                ii
+            ] = f"C*.{cfg.SFC_CLIMO_FIELDS[i]}.tile{cfg.TILE_RGNL}.halo{cfg.NH0}.nc"
+            fns[
+                ii + 1
+            ] = f"C*.{cfg.SFC_CLIMO_FIELDS[i]}.tile{cfg.TILE_RGNL}.halo{cfg.NH4}.nc"
+        fps = [os.path.join(cfg.SFC_CLIMO_DIR, itm) for itm in fns]
+        run_task = f"{cfg.RUN_TASK_MAKE_SFC_CLIMO}"
     #
 
     #
@@ -271,7 +276,7 @@ def link_fix(verbose, file_group):
     # -----------------------------------------------------------------------
     #
     SAVE_DIR = os.getcwd()
-    cd_vrfy(FIXLAM)
+    cd_vrfy(cfg.FIXLAM)
     #
     # -----------------------------------------------------------------------
     #
@@ -319,8 +324,8 @@ def link_fix(verbose, file_group):
     # -----------------------------------------------------------------------
     #
     if file_group == "grid":
-        target = f"{cres}{DOT_OR_USCORE}grid.tile{TILE_RGNL}.halo{NH4}.nc"
-        symlink = f"{cres}{DOT_OR_USCORE}grid.tile{TILE_RGNL}.nc"
+        target = f"{cres}{cfg.DOT_OR_USCORE}grid.tile{cfg.TILE_RGNL}.halo{cfg.NH4}.nc"
+        symlink = f"{cres}{cfg.DOT_OR_USCORE}grid.tile{cfg.TILE_RGNL}.nc"
         create_symlink_to_file(target, symlink, True)
     #
     # -----------------------------------------------------------------------
@@ -333,11 +338,11 @@ def link_fix(verbose, file_group):
     #
     if file_group == "sfc_climo":
 
-        tmp = [f"{cres}.{itm}" for itm in SFC_CLIMO_FIELDS]
+        tmp = [f"{cres}.{itm}" for itm in cfg.SFC_CLIMO_FIELDS]
         fns_sfc_climo_with_halo_in_fn = [
-            f"{itm}.tile{TILE_RGNL}.halo{NH4}.nc" for itm in tmp
+            f"{itm}.tile{cfg.TILE_RGNL}.halo{cfg.NH4}.nc" for itm in tmp
         ]
-        fns_sfc_climo_no_halo_in_fn = [f"{itm}.tile{TILE_RGNL}.nc" for itm in tmp]
+        fns_sfc_climo_no_halo_in_fn = [f"{itm}.tile{cfg.TILE_RGNL}.nc" for itm in tmp]
 
         for i in range(num_fields):
             target = f"{fns_sfc_climo_with_halo_in_fn[i]}"
@@ -350,9 +355,9 @@ def link_fix(verbose, file_group):
         # its name (and no "halo") and which points to the corresponding "tile7.halo0"
         # file.
         #
-        tmp = [f"{cres}.{itm}" for itm in SFC_CLIMO_FIELDS]
+        tmp = [f"{cres}.{itm}" for itm in cfg.SFC_CLIMO_FIELDS]
         fns_sfc_climo_tile7_halo0_in_fn = [
-            f"{itm}.tile{TILE_RGNL}.halo{NH0}.nc" for itm in tmp
+            f"{itm}.tile{cfg.TILE_RGNL}.halo{cfg.NH0}.nc" for itm in tmp
         ]
         fns_sfc_climo_tile1_no_halo_in_fn = [f"{itm}.tile1.nc" for itm in tmp]
 
@@ -400,9 +405,8 @@ def parse_args(argv):
 if __name__ == "__main__":
     args = parse_args(sys.argv[1:])
     cfg = load_shell_config(args.path_to_defns)
-    cfg = flatten_dict(cfg)
-    import_vars(dictionary=cfg)
-    link_fix(VERBOSE, args.file_group)
+    cfg = ExperimentConfig(flatten_dict(cfg))
+    link_fix(cfg.VERBOSE, args.file_group, cfg)
 
 
 class Testing(unittest.TestCase):
@@ -1,5 +1,24 @@
 #!/bin/bash
 
+#
+#-----------------------------------------------------------------------
+#
+# If the experiment generation created a variable definitions file with
+# only the variables used by this task's J-job (and the scripts it runs)
+# in TASK_VAR_DEFNS_DIR, use it instead of the global one.  Exporting
+# GLOBAL_VAR_DEFNS_FP makes the J-job and the scripts it calls source (or
+# read) the same file.  The global file is used whenever it is newer than
+# the task's file, so that changes made to it by hand are not ignored.
+#
+#-----------------------------------------------------------------------
+#
+task_var_defns_dir=$( sed -n "s/^TASK_VAR_DEFNS_DIR=[\"']\(.*\)[\"']$/\1/p" \
+                      "${GLOBAL_VAR_DEFNS_FP}" )
+task_var_defns_fp="${task_var_defns_dir}/${2##*/}_${GLOBAL_VAR_DEFNS_FP##*/}"
+if [ -n "${task_var_defns_dir}" ] && \
+   [ "${task_var_defns_fp}" -nt "${GLOBAL_VAR_DEFNS_FP}" ]; then
+  export GLOBAL_VAR_DEFNS_FP="${task_var_defns_fp}"
+fi
 #
 #-----------------------------------------------------------------------
 #
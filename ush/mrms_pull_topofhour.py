@@ -1,169 +1,313 @@
-import sys, os, shutil, subprocess
-import datetime
-import re, csv, glob
+#!/usr/bin/env python3
+"""
+Copy and unzip the MRMS files closest to the top of the hour, and name
+them for the top of the hour, so that METplus finds a file for each
+valid time it verifies. Only files within 15 minutes of the top of the
+hour are used.
+
+The files of a product and level are looked up in a sorted index of the
+timestamps in their names, which is built once for each day, so a range
+of valid hours can be pulled in a single run. The files are decompressed
+in-process, several at a time. Hours whose file is already in place are
+skipped, so a backfill can simply be run again.
+
+For a single valid hour, as is done every hour on a 20-minute lag:
+
+    python mrms_pull_topofhour.py YYYYMMDDHH DATA_HEAD MRMS_PROD_DIR \\
+        MRMS_PRODUCT LEVEL
+
+To backfill a range of valid hours, add --valid_end YYYYMMDDHH.
+"""
+
+import argparse
 import bisect
-import numpy as np
+import datetime
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-if __name__ == "__main__":
-    # Copy and unzip MRMS files that are closest to top of hour
-    # Done every hour on a 20-minute lag
-
-    # Include option to define valid time on command line
-    # Used to backfill verification
-    # try:
-    valid_time = str(sys.argv[1])
-
-    YYYY = int(valid_time[0:4])
-    MM = int(valid_time[4:6])
-    DD = int(valid_time[6:8])
-    HH = int(valid_time[8:19])
-
-    valid = datetime.datetime(YYYY, MM, DD, HH, 0, 0)
-
-    # except IndexError:
-    #    valid_time = None
-
-    # Default to current hour if not defined on command line
-    # if valid_time is None:
-    #    now  = datetime.datetime.utcnow()
-    #    YYYY = int(now.strftime('%Y'))
-    #    MM   = int(now.strftime('%m'))
-    #    DD   = int(now.strftime('%d'))
-    #    HH   = int(now.strftime('%H'))
-
-    #    valid = datetime.datetime(YYYY,MM,DD,HH,0,0)
-    #   valid_time = valid.strftime('%Y%m%d%H')
-
-    print("Pulling " + valid_time + " MRMS data")
-
-    # Set up working directory
-    DATA_HEAD = str(sys.argv[2])
-    MRMS_PROD_DIR = str(sys.argv[3])
-    MRMS_PRODUCT = str(sys.argv[4])
-    level = str(sys.argv[5])
-
-    VALID_DIR = os.path.join(DATA_HEAD, valid.strftime("%Y%m%d"))
-    if not os.path.exists(VALID_DIR):
-        os.makedirs(VALID_DIR)
-    os.chdir(DATA_HEAD)
-
-    # Sort list of files for each MRMS product
-    print(valid.strftime("%Y%m%d"))
-    if valid.strftime("%Y%m%d") < "20200303":
-        search_path = (
-            MRMS_PROD_DIR
-            + "/"
-            + valid.strftime("%Y%m%d")
-            + "/dcom/us007003/ldmdata/obs/upperair/mrms/conus/"
-            + MRMS_PRODUCT
-            + "/"
-            + MRMS_PRODUCT
-            + "*.gz"
-        )
-    elif valid.strftime("%Y%m%d") >= "20200303":
-        search_path = (
-            MRMS_PROD_DIR
-            + "/"
-            + valid.strftime("%Y%m%d")
-            + "/upperair/mrms/conus/"
-            + MRMS_PRODUCT
-            + "/"
-            + MRMS_PRODUCT
-            + "*.gz"
-        )
-    file_list = [f for f in glob.glob(search_path)]
-    time_list = [file_list[x][-24:-9] for x in range(len(file_list))]
-    int_list = [
-        int(time_list[x][0:8] + time_list[x][9:15]) for x in range(len(time_list))
-    ]
-    int_list.sort()
-    datetime_list = [
-        datetime.datetime.strptime(str(x), "%Y%m%d%H%M%S") for x in int_list
-    ]
-
-    # Find the MRMS file closest to the valid time
-    i = bisect.bisect_left(datetime_list, valid)
-    closest_timestamp = min(
-        datetime_list[max(0, i - 1) : i + 2], key=lambda date: abs(valid - date)
+# MRMS files were moved to a new directory layout on this day
+REORG_DAY = "20200303"
+
+# The furthest from the top of the hour a file may be to be used
+MAX_OFFSET = datetime.timedelta(minutes=15)
+
+# The timestamp at the end of the name of an MRMS file
+TIMESTAMP_RE = re.compile(r"(\d{8}-\d{6})\.grib2\.gz$")
+
+
+def to_valid_time(arg):
+    """Return the datetime of a YYYYMMDDHH string. The hour may have a
+    single digit."""
+
+    return datetime.datetime(
+        int(arg[0:4]), int(arg[4:6]), int(arg[6:8]), int(arg[8:] or 0)
     )
 
-    # Check to make sure closest file is within +/- 15 mins of top of the hour
-    # Copy and rename the file for future ease
-    difference = abs(closest_timestamp - valid)
-    if difference.total_seconds() <= 900:
-        filename1 = (
-            MRMS_PRODUCT
-            + level
-            + closest_timestamp.strftime("%Y%m%d-%H%M%S")
-            + ".grib2.gz"
+
+def product_dir(mrms_prod_dir, day, product):
+    """Return the directory holding the files of a product for a day,
+    given as YYYYMMDD."""
+
+    if day < REORG_DAY:
+        return os.path.join(
+            mrms_prod_dir,
+            day,
+            "dcom/us007003/ldmdata/obs/upperair/mrms/conus",
+            product,
         )
-        filename2 = MRMS_PRODUCT + level + valid.strftime("%Y%m%d-%H") + "0000.grib2.gz"
-
-        if valid.strftime("%Y%m%d") < "20200303":
-            print(
-                "cp "
-                + MRMS_PROD_DIR
-                + "/"
-                + valid.strftime("%Y%m%d")
-                + "/dcom/us007003/ldmdata/obs/upperair/mrms/conus/"
-                + MRMS_PRODUCT
-                + "/"
-                + filename1
-                + " "
-                + VALID_DIR
-                + "/"
-                + filename2
-            )
+    return os.path.join(mrms_prod_dir, day, "upperair/mrms/conus", product)
 
-            os.system(
-                "cp "
-                + MRMS_PROD_DIR
-                + "/"
-                + valid.strftime("%Y%m%d")
-                + "/dcom/us007003/ldmdata/obs/upperair/mrms/conus/"
-                + MRMS_PRODUCT
-                + "/"
-                + filename1
-                + " "
-                + VALID_DIR
-                + "/"
-                + filename2
-            )
-            os.system("gunzip " + VALID_DIR + "/" + filename2)
-        elif valid.strftime("%Y%m%d") >= "20200303":
-            print(
-                "cp "
-                + MRMS_PROD_DIR
-                + "/"
-                + valid.strftime("%Y%m%d")
-                + "/upperair/mrms/conus/"
-                + MRMS_PRODUCT
-                + "/"
-                + filename1
-                + " "
-                + VALID_DIR
-                + "/"
-                + filename2
-            )
 
-            os.system(
-                "cp "
-                + MRMS_PROD_DIR
-                + "/"
-                + valid.strftime("%Y%m%d")
-                + "/upperair/mrms/conus/"
-                + MRMS_PRODUCT
-                + "/"
-                + filename1
-                + " "
-                + VALID_DIR
-                + "/"
-                + filename2
+class MRMSCatalog:
+    """The files of an MRMS product and level, indexed by the timestamps
+    in their names. The index of a day's directory is built the first
+    time it is asked for, and kept for the other hours of the day."""
+
+    def __init__(self, mrms_prod_dir, product, level):
+        self.mrms_prod_dir = mrms_prod_dir
+        self.prefix = f"{product}{level}"
+        self.product = product
+        self._days = {}
+
+    def index(self, day):
+        """Return the sorted timestamps of the files of a day, given as
+        YYYYMMDD, and the paths of the files in the same order."""
+
+        if day not in self._days:
+            directory = product_dir(self.mrms_prod_dir, day, self.product)
+            files = []
+            if os.path.isdir(directory):
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        match = TIMESTAMP_RE.search(entry.name)
+                        if match and entry.name.startswith(self.prefix):
+                            timestamp = datetime.datetime.strptime(
+                                match.group(1), "%Y%m%d-%H%M%S"
+                            )
+                            files.append((timestamp, entry.path))
+            files.sort()
+            self._days[day] = (
+                [timestamp for timestamp, _ in files],
+                [path for _, path in files],
             )
-            os.system("gunzip " + VALID_DIR + "/" + filename2)
+        return self._days[day]
+
+    def closest(self, valid):
+        """Return the path of the file of the valid day closest to the
+        valid time, or None if none is within MAX_OFFSET of it."""
+
+        timestamps, paths = self.index(valid.strftime("%Y%m%d"))
+        i = bisect.bisect_left(timestamps, valid)
+        candidates = range(max(0, i - 1), min(i + 1, len(timestamps) - 1) + 1)
+        best = min(candidates, key=lambda j: abs(valid - timestamps[j]), default=None)
+        if best is None or abs(valid - timestamps[best]) > MAX_OFFSET:
+            return None
+        return paths[best]
+
+
+def gunzip(source, target):
+    """Decompress the gzipped source file into target. The file is
+    written under a temporary name and renamed into place, so a partial
+    file is never left at target."""
+
+    tmp_target = f"{target}.tmp{os.getpid()}"
+    try:
+        with gzip.open(source, "rb") as src, open(tmp_target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_target, target)
+    finally:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+    return target
+
+
+def pull_top_of_hour(
+    valid_start,
+    valid_end,
+    data_head,
+    mrms_prod_dir,
+    product,
+    level,
+    max_workers=4,
+):
+    """Copy and unzip the file of an MRMS product and level closest to
+    the top of each hour from valid_start to valid_end, inclusive, into
+    a directory for its day in data_head, named for the top of the hour.
+    Hours whose file is already there are skipped. The files are
+    decompressed max_workers at a time.
+
+    Return a dict mapping each valid time to the path of its file, for
+    the hours that have one."""
+
+    catalog = MRMSCatalog(mrms_prod_dir, product, level)
+    pulled = {}
+    jobs = []
+    valid = valid_start
+    while valid <= valid_end:
+        valid_dir = os.path.join(data_head, valid.strftime("%Y%m%d"))
+        target = os.path.join(valid_dir, f"{product}{level}{valid:%Y%m%d-%H}0000.grib2")
+        if os.path.exists(target):
+            print(f"{target} exists. No work to be done.")
+            pulled[valid] = target
+        else:
+            source = catalog.closest(valid)
+            if source is None:
+                print(f"No {product}{level} file within {MAX_OFFSET} of {valid}")
+            else:
+                os.makedirs(valid_dir, exist_ok=True)
+                print(f"Unzipping {source} to {target}")
+                jobs.append((valid, source, target))
+        valid += datetime.timedelta(hours=1)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        for valid, target in zip(
+            [job[0] for job in jobs],
+            pool.map(lambda job: gunzip(*job[1:]), jobs),
+        ):
+            pulled[valid] = target
+    return pulled
+
+
+def parse_args(argv):
+    """Parse command line arguments."""
+
+    parser = argparse.ArgumentParser(
+        description="Copy and unzip the MRMS files closest to the top of the hour."
+    )
+    parser.add_argument(
+        "valid_time",
+        help="Valid time in YYYYMMDDHH format, or the first of a range of them.",
+        type=to_valid_time,
+    )
+    parser.add_argument(
+        "data_head",
+        help="Directory in which a directory for each day of unzipped files is made.",
+    )
+    parser.add_argument(
+        "mrms_prod_dir",
+        help="Directory holding the MRMS files extracted from HPSS, by day.",
+    )
+    parser.add_argument("mrms_product", help="MRMS product, e.g. EchoTop.")
+    parser.add_argument("level", help="MRMS level, e.g. _18_00.50_.")
+    parser.add_argument(
+        "--valid_end",
+        help="Last valid time of a range of hours to pull, in YYYYMMDDHH format.",
+        type=to_valid_time,
+    )
+    parser.add_argument(
+        "--max_workers",
+        default=4,
+        help="The number of files to unzip at the same time.",
+        type=int,
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    valid_end = args.valid_end or args.valid_time
+    print(f"Pulling {args.valid_time:%Y%m%d%H} to {valid_end:%Y%m%d%H} MRMS data")
+    pull_top_of_hour(
+        args.valid_time,
+        valid_end,
+        args.data_head,
+        args.mrms_prod_dir,
+        args.mrms_product,
+        args.level,
+        max_workers=args.max_workers,
+    )
+
 
-# dummy unittest
 class Testing(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.raw = os.path.join(self.tmp_dir.name, "raw")
+        self.proc = os.path.join(self.tmp_dir.name, "proc")
+        self.product = "EchoTop"
+        self.level = "_18_00.50_"
+
+    def add_file(self, timestamp, level=None, day=None):
+        """Put a gzipped MRMS file in the raw directory, and return its
+        content."""
+
+        day = day or timestamp[:8]
+        directory = product_dir(self.raw, day, self.product)
+        os.makedirs(directory, exist_ok=True)
+        content = f"{self.product}{timestamp}".encode()
+        name = f"{self.product}{level or self.level}{timestamp}.grib2.gz"
+        with gzip.open(os.path.join(directory, name), "wb") as file:
+            file.write(content)
+        return content
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
     def test_mrms_pull_topfhour(self):
-        pass
+        closest = self.add_file("20220625-115800")
+        self.add_file("20220625-121000")
+        self.add_file("20220625-120000", level="_00.50_")
+        pulled = pull_top_of_hour(
+            to_valid_time("2022062512"),
+            to_valid_time("2022062512"),
+            self.proc,
+            self.raw,
+            self.product,
+            self.level,
+        )
+        target = os.path.join(
+            self.proc, "20220625", "EchoTop_18_00.50_20220625-120000.grib2"
+        )
+        self.assertEqual(pulled, {to_valid_time("2022062512"): target})
+        self.assertEqual(self.read(target), closest)
+
+    def test_backfill_range(self):
+        """A range of hours across days and directory layouts is pulled
+        in one run, indexing each day once. Hours without a file within
+        15 minutes are left out, and files already there are kept."""
+
+        expected = {
+            "2020030223": self.add_file("20200302-230500"),
+            "2020030300": self.add_file("20200303-000700"),
+            "2020030301": self.add_file("20200303-011400"),
+        }
+        self.add_file("20200303-022000")
+        args = (self.proc, self.raw, self.product, self.level)
+
+        with mock.patch("os.scandir", side_effect=os.scandir) as scandir:
+            pull_top_of_hour(
+                to_valid_time("2020030223"), to_valid_time("2020030223"), *args
+            )
+            pulled = pull_top_of_hour(
+                to_valid_time("2020030223"),
+                to_valid_time("2020030302"),
+                *args,
+                max_workers=2,
+            )
+
+        self.assertEqual(
+            sorted(f"{valid:%Y%m%d%H}" for valid in pulled), sorted(expected)
+        )
+        for valid, content in expected.items():
+            self.assertEqual(self.read(pulled[to_valid_time(valid)]), content)
+        # The first run scans the first day, and the second one only the
+        # second day, since the hour of the first day is already there
+        self.assertEqual(
+            [
+                call.args[0]
+                for call in scandir.call_args_list
+                if call.args and str(call.args[0]).startswith(self.raw)
+            ],
+            [
+                product_dir(self.raw, "20200302", self.product),
+                product_dir(self.raw, "20200303", self.product),
+            ],
+        )
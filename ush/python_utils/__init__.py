@@ -16,6 +16,7 @@ from .environment import (
     import_vars,
     export_vars,
 )
+from .experiment_config import ExperimentConfig
 from .filesys_cmds_vrfy import (
     cmd_vrfy,
     cp_vrfy,
@@ -52,4 +53,6 @@ from .config_parser import (
     load_config_file,
     load_yaml_config,
     cfg_to_yaml_str,
+    load_cached_config,
+    config_cache_summary,
 )
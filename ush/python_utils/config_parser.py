@@ -12,6 +12,11 @@ Supported formats include:
 Typical usage involves first loading the config file, then using the dictionary
 returnded by load_config to make queries.
 
+YAML files loaded with load_config_file are parsed once per content: the result
+is kept in memory for the rest of the process. Set REGIONAL_WORKFLOW_CONFIG_CACHE
+to a directory private to the user to also keep results there, as JSON, for
+later processes. Nothing removes old results from that directory.
+
 """
 
 import argparse
@@ -27,9 +32,11 @@ except ModuleNotFoundError:
     pass
 # The rest of the formats: JSON/SHELL/INI/XML do not need
 # external pakcages
+import hashlib
 import json
 import os
 import re
+import time
 from textwrap import dedent
 import configparser
 import xml.etree.ElementTree as ET
@@ -408,11 +415,130 @@ def check_structure_dict(dict_o, dict_t):
     return True
 
 
+##################
+# CONFIG cache
+##################
+
+# Bump whenever the result of parsing a config file changes for the same
+# content, e.g. with a new custom yaml tag, so that old results are not used
+CONFIG_LOADER_VERSION = 1
+
+# Results of parsing config files, as JSON, by the digest of their content
+_CONFIG_CACHE = {}
+
+# Loads of config files through the cache, and the time they took
+CONFIG_CACHE_STATS = {"memory_hits": 0, "disk_hits": 0, "parsed": 0, "seconds": 0.0}
+
+
+def config_cache_dir():
+    """Return the directory parsed config files are kept in, given by
+    REGIONAL_WORKFLOW_CONFIG_CACHE, or None if they are only kept in memory"""
+
+    return os.environ.get("REGIONAL_WORKFLOW_CONFIG_CACHE") or None
+
+
+def is_private(path):
+    """Return whether a path is owned by the user, and not writable by
+    anyone else, so that no one else could have written its content"""
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def load_cached_config(file_name, loader, return_outcome=False):
+    """Load a config file with loader, reusing the result of an earlier
+    load of the same content by the same loader.
+
+    Results are kept in memory and in config_cache_dir(), as JSON, keyed by
+    a digest of the content of the file, the loader and CONFIG_LOADER_VERSION,
+    so a changed file is parsed again. Entries on disk are only read when
+    both they and the directory are private to the user (see is_private).
+    Results that do not survive a trip through JSON unchanged, e.g. with
+    dates in them, are parsed every time. Each call returns its own copy
+    of the result, which the caller is free to modify.
+
+    Args:
+        file_name: path to config file
+        loader: function parsing the config file at a path
+        return_outcome: also return how the result was obtained
+    Returns:
+        dictionary of the config file, and if return_outcome is set, one of
+        "memory_hits", "disk_hits" or "parsed"
+    """
+
+    start = time.perf_counter()
+    with open(file_name, "rb") as f:
+        digest = hashlib.sha256(
+            f"{loader.__name__}:{CONFIG_LOADER_VERSION}:".encode() + f.read()
+        ).hexdigest()
+
+    cache_dir = config_cache_dir()
+    entry = os.path.join(cache_dir, f"{digest}.json") if cache_dir else None
+    cfg = None
+    if digest in _CONFIG_CACHE:
+        outcome = "memory_hits"
+    elif entry and is_private(cache_dir) and is_private(entry):
+        with open(entry, "r") as f:
+            _CONFIG_CACHE[digest] = f.read()
+        outcome = "disk_hits"
+    else:
+        cfg = loader(file_name)
+        outcome = "parsed"
+        try:
+            cached = json.dumps(cfg)
+        except (TypeError, ValueError):
+            cached = None
+        if cached is not None and json.loads(cached) == cfg:
+            _CONFIG_CACHE[digest] = cached
+        else:
+            entry = None
+        if entry:
+            # Renamed into place so that a partial entry is never read.
+            # Results are only kept in memory when the directory is not
+            # writable.
+            tmp_entry = f"{entry}.tmp{os.getpid()}"
+            try:
+                os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+                fd = os.open(tmp_entry, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    f.write(cached)
+                os.replace(tmp_entry, entry)
+            except OSError:
+                if os.path.exists(tmp_entry):
+                    os.remove(tmp_entry)
+
+    if digest in _CONFIG_CACHE:
+        cfg = json.loads(_CONFIG_CACHE[digest])
+    CONFIG_CACHE_STATS[outcome] += 1
+    CONFIG_CACHE_STATS["seconds"] += time.perf_counter() - start
+    if return_outcome:
+        return cfg, outcome
+    return cfg
+
+
+def config_cache_summary():
+    """Return a line summarizing the loads of config files through the
+    cache, their hit rate and the time they took"""
+
+    stats = CONFIG_CACHE_STATS
+    loads = stats["memory_hits"] + stats["disk_hits"] + stats["parsed"]
+    hit_rate = 100 * (loads - stats["parsed"]) / loads if loads else 0
+    return (
+        f"Loaded {loads} config files in {stats['seconds']:.3f} s: "
+        f"{stats['memory_hits']} from memory, {stats['disk_hits']} from disk, "
+        f"{stats['parsed']} parsed ({hit_rate:.0f}% hit rate)"
+    )
+
+
 ##################
 # CONFIG loader
 ##################
 def load_config_file(file_name, return_string=0):
-    """Load config file based on file name extension"""
+    """Load config file based on file name extension. Parsed YAML files are
+    cached, see load_cached_config."""
 
     ext = os.path.splitext(file_name)[1][1:]
     if ext == "sh":
@@ -422,7 +548,7 @@ def load_config_file(file_name, return_string=0):
     if ext == "json":
         return load_json_config(file_name)
     if ext in ["yaml", "yml"]:
-        return load_yaml_config(file_name)
+        return load_cached_config(file_name, load_yaml_config)
     if ext == "xml":
         return load_xml_config(file_name, return_string)
     return None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+from collections.abc import MutableMapping
+from types import ModuleType
+
+from .environment import list_to_str, str_to_list
+
+
+def is_config_var(name, value):
+    """Check if a name/value pair is an experiment variable, rather than
+    a function, module or private name. These are the same names that
+    export_vars() skips.
+
+    Args:
+        name: the variable name
+        value: its value
+    Returns:
+        Boolean
+    """
+
+    if callable(value) or isinstance(value, ModuleType):
+        return False
+    return bool(name) and name[0] != "_"
+
+
+class ExperimentConfig(MutableMapping):
+    """Experiment/workflow variables, with attribute access
+
+        cfg = ExperimentConfig.from_env()
+        if cfg.QUILTING:
+            cfg.WRTCMP_nx = 1799
+
+    The values are kept as python types (bool, int, float, datetime, list
+    or string) in a dictionary, which may be a module's globals(), so that
+    code using bare global variable names and code using the config object
+    share the same values without exporting them to the environment and
+    importing them back.  Values read from the environment are kept as
+    strings until they are first used, when they are converted the same way
+    import_vars() converts them.
+
+    The environment is only written to by export_env(), which should be
+    called where the variables have to be handed over to another process.
+    """
+
+    def __init__(self, values=None):
+        """Create a config using values as its backing dictionary
+
+        Args:
+            values: dictionary of variables (default=a new dictionary)
+        Returns:
+            None
+        """
+
+        object.__setattr__(self, "_values", {} if values is None else values)
+        object.__setattr__(self, "_raw", {})
+
+    @classmethod
+    def from_env(cls, env_vars=None):
+        """Create a config from environment variables
+
+        Args:
+            env_vars: list of selected environment variables, or None, in
+            which case all environment variables are used
+        Returns:
+            ExperimentConfig
+        """
+
+        cfg = cls()
+        if env_vars is None:
+            cfg._raw.update(os.environ)
+        else:
+            for k in env_vars:
+                cfg._raw[k] = os.environ.get(k)
+        return cfg
+
+    def export_env(self, env_vars=None):
+        """Export all (or select few) variables to the environment
+
+        Args:
+            env_vars: list of selected variables to export, or None, in
+            which case all variables are exported
+        Returns:
+            None
+        """
+
+        if env_vars is None:
+            env_vars = list(self)
+        for k in env_vars:
+            if k in self._raw and self._raw[k] is not None:
+                os.environ[k] = self._raw[k]
+            else:
+                os.environ[k] = list_to_str(self.get(k))
+
+    def _keys(self):
+        return [k for k, v in self._values.items() if is_config_var(k, v)]
+
+    def __getitem__(self, key):
+        if key in self._raw:
+            self._values[key] = str_to_list(self._raw.pop(key))
+        if key not in self._values or not is_config_var(key, self._values[key]):
+            raise KeyError(key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._raw.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._raw:
+            del self._raw[key]
+            self._values.pop(key, None)
+        else:
+            del self._values[key]
+
+    def __iter__(self):
+        return iter(list(self._raw) + [k for k in self._keys() if k not in self._raw])
+
+    def __len__(self):
+        return len(self._raw) + sum(k not in self._raw for k in self._keys())
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f"ExperimentConfig({len(self)} variables)"
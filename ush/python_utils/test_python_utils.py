@@ -6,6 +6,10 @@ Unit tests for python utilities.
 To run them, issue the following command from the ush directory:
     python3 -m unittest -b python_utils/test_python_utils.py
 
+The benchmark, which compares elapsed times, is skipped unless
+PYTHON_UTILS_BENCHMARK is set:
+    PYTHON_UTILS_BENCHMARK=1 python3 -m unittest python_utils/test_python_utils.py
+
 All modules needed to build and run the regional_workflow need to be
 loaded first before executing unit tests.
 
@@ -14,8 +18,11 @@ loaded first before executing unit tests.
 import unittest
 import glob
 import os
+import tempfile
+import time
 
 from python_utils import *
+from python_utils import config_parser
 
 
 class Testing(unittest.TestCase):
@@ -140,6 +147,67 @@ class Testing(unittest.TestCase):
         v = str_to_list(shell_str)
         self.assertFalse(isinstance(v, list))
 
+    def test_experiment_config(self):
+        # environment values are converted when first used
+        set_env_var("MYLIST", ["1", "a b"])
+        set_env_var("MYFLAG", "TRUE")
+        cfg = ExperimentConfig.from_env(["MYLIST", "MYFLAG", "MYUNSET"])
+        self.assertEqual(cfg.MYLIST, [1, "a b"])
+        self.assertIs(cfg["MYFLAG"], True)
+        self.assertIsNone(cfg.MYUNSET)
+        with self.assertRaises(AttributeError):
+            cfg.MYOTHER
+        # a backing dictionary shares its values, without functions
+        values = {"NX": 10, "uppercase": uppercase, "_private": 1}
+        cfg = ExperimentConfig(values)
+        cfg.NX += 1
+        cfg.NY = 2
+        self.assertEqual(values["NX"], 11)
+        self.assertEqual(dict(cfg), {"NX": 11, "NY": 2})
+        # nothing reaches the environment until it is exported
+        self.assertNotIn("NY", os.environ)
+        self.addCleanup(os.environ.pop, "NX", None)
+        self.addCleanup(os.environ.pop, "NY", None)
+        cfg.export_env()
+        self.assertEqual((os.environ["NX"], os.environ["NY"]), ("11", "2"))
+
+    @unittest.skipUnless(
+        os.environ.get("PYTHON_UTILS_BENCHMARK"),
+        "Set PYTHON_UTILS_BENCHMARK to run the benchmark",
+    )
+    def test_experiment_config_benchmark(self):
+        """Compare handing the default experiment variables to a helper
+        through the environment, the way setup() did, with handing it an
+        ExperimentConfig."""
+
+        env = dict(os.environ)
+        self.addCleanup(os.environ.update, env)
+        self.addCleanup(os.environ.clear)
+        cfg_d = load_config_file(f"{self.PATH}/../config_defaults.yaml")
+        namespace = {}
+        import_vars(dictionary=flatten_dict(cfg_d), target_dict=namespace)
+
+        start = time.perf_counter()
+        for _ in range(5):
+            export_vars(source_dict=namespace)
+            helper = {}
+            import_vars(target_dict=helper)
+            import_vars(target_dict=namespace)
+        env_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(5):
+            cfg = ExperimentConfig(namespace)
+            cfg.PREDEF_GRID_NAME = cfg.PREDEF_GRID_NAME
+        cfg_seconds = time.perf_counter() - start
+
+        print(
+            f"{len(cfg)} variables handed over 5 times: "
+            f"{env_seconds:.4f} s through the environment, "
+            f"{cfg_seconds:.4f} s through ExperimentConfig"
+        )
+        self.assertLess(cfg_seconds, env_seconds)
+
     def test_config_parser(self):
         cfg = {"HRS": ["1", "2"]}
         shell_str = cfg_to_shell_str(cfg)
@@ -150,6 +218,34 @@ class Testing(unittest.TestCase):
             "regional_workflow", get_ini_value(cfg, "regional_workflow", "repo_url")
         )
 
+    def test_config_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "config_cache")
+        set_env_var("REGIONAL_WORKFLOW_CONFIG_CACHE", cache_dir)
+        self.addCleanup(os.environ.pop, "REGIONAL_WORKFLOW_CONFIG_CACHE", None)
+        config_parser._CONFIG_CACHE.clear()
+        for key in config_parser.CONFIG_CACHE_STATS:
+            config_parser.CONFIG_CACHE_STATS[key] = 0
+        config_fn = os.path.join(self.tmp_dir.name, "config.yaml")
+        with open(config_fn, "w") as f:
+            f.write("a:\n  B: !join_str ['x', 1]\n")
+        # parsed, then loaded from memory, and from disk by a new process
+        cfg = load_config_file(config_fn)
+        self.assertEqual(cfg, {"a": {"B": "x1"}})
+        cfg["a"].clear()
+        self.assertEqual(load_config_file(config_fn), {"a": {"B": "x1"}})
+        config_parser._CONFIG_CACHE.clear()
+        self.assertEqual(load_config_file(config_fn), {"a": {"B": "x1"}})
+        # parsed again when it changes
+        with open(config_fn, "a") as f:
+            f.write("C: 2\n")
+        self.assertEqual(load_config_file(config_fn)["C"], 2)
+        self.assertIn("Loaded 4 config files in ", config_cache_summary())
+        self.assertIn(
+            "1 from memory, 1 from disk, 2 parsed (50% hit rate)",
+            config_cache_summary(),
+        )
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
     def test_print_msg(self):
         self.assertEqual(print_info_msg("Hello World!", verbose=False), False)
 
@@ -161,6 +257,8 @@ class Testing(unittest.TestCase):
         define_macos_utilities()
         set_env_var("DEBUG", "FALSE")
         self.PATH = os.path.dirname(__file__)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
 
 
 if __name__ == "__main__":
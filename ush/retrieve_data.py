@@ -18,6 +18,42 @@ default, or can be user-supplied via the --file_name flag. That flag
 takes a YAML-formatted string that follows the same conventions outlined
 in the ush/templates/data_locations.yml file for naming files.
 
+To retrieve the data for many cycles at once, for example for a
+retrospective period, provide a list or range of cycles with the
+--cycle_dates flag instead of --cycle_date, and include a cycle date
+template like {yyyymmddhh} in the --output_path. The files of all the
+cycles are planned first, so each archive on HPSS is opened only once,
+and a summary file is written for each cycle. The listings of tar
+archives on HPSS are kept in a shared index (see --index_dir), so that
+later tasks extract each file only from the archive that holds it
+without listing the archive again.
+
+Each retrieved file is recorded in a hidden manifest file in its output
+path. A rerun into the same output path skips the files that are still
+as they were recorded and retrieves only the missing or damaged ones, so
+an interrupted retrieval can simply be started again.
+
+In real time, use --follow to deliver each forecast hour as soon as it
+is published upstream. A hidden ready marker is written to the output
+path for each hour, so later tasks can start on the early hours while
+the later ones are still being produced.
+
+Data stores are tried in the order given by --data_stores. With --race,
+the leading data stores are probed at the same time instead, and the
+files are retrieved from the one estimated to deliver them fastest.
+
+The retrieval can also be driven from other Python code, without
+running this script, by describing it with a RetrievalPlan and passing
+that to fetch in an asyncio event loop, or to retrieve outside of one.
+Both report progress as files land, and raise a RetrievalError instead
+of exiting when the files cannot be retrieved.
+
+The time, bytes and outcome of each file, transfer, retry, probe and
+HPSS call are recorded as events. Use --telemetry to append them as JSON
+lines to a file, and --stats to print their totals by data store and by
+host at exit. From Python, call TELEMETRY.open with the path of the
+file, and TELEMETRY.summary for the totals.
+
 To see usage for this script:
 
     python retrieve_data.py -h
@@ -26,56 +62,189 @@ Also see the parse_args function below.
 """
 
 import argparse
+import asyncio
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import copy
 import datetime as dt
+import fcntl
+import functools
+import hashlib
+import http.client
+import io
+import itertools
+import json
 import logging
 import os
+import random
+import re
 import shutil
+import signal
+import socket
+import ssl
+import string
 import subprocess
 import sys
+import tempfile
 from textwrap import dedent
+import threading
 import time
+from urllib.parse import urljoin, urlparse
+import urllib.request
+import zipfile
 
 import yaml
 
+from python_utils.config_parser import load_cached_config
+
+# Settings for the Python download backend that mirror the wget flags
+# used by the wget backend: -T 30 -t 3
+HTTP_TIMEOUT = 30
+HTTP_TRIES = 3
+HTTP_CHUNK_SIZE = 4 * 1024 * 1024
+HTTP_MAX_REDIRECTS = 5
+
+# Seconds of the first and the longest backoff after a data store signals
+# that it is throttling requests. Backoffs double with each consecutive
+# signal, with random jitter.
+HTTP_BACKOFF_BASE = 1.0
+HTTP_MAX_BACKOFF = 60.0
+
+# The number of throttled responses a request may get before they count
+# against HTTP_TRIES
+HTTP_MAX_BACKOFFS = 8
+
+# Files of at least this size are downloaded in several byte ranges at
+# the same time, when the server supports byte ranges, and the number of
+# ranges they are split into by default
+HTTP_MULTIPART_MIN_BYTES = 256 * 1024**2
+HTTP_PARTS = 8
+
+
+class Telemetry:
+
+    """Structured events of the retrievals made by this process: each
+    file retrieved, skipped or missing, each transfer, retry and backoff,
+    each probe of a data store, each htar and hsi call, and the data
+    store and location that delivered the files of each cycle.
+
+    Each event is a dict of its name, the time, and its fields. Events
+    are appended as JSON lines to the file given to open(), if any, so
+    the events of many tasks and cycles can be aggregated. They are also
+    totaled by data store and by host for summary()."""
+
+    # How each kind of event is totaled: by which of its fields, under
+    # which count, and which of its fields are summed along with it
+    TOTALS = {
+        "cache_hit": ("data_store", "cache_hits", ()),
+        "config": ("config", "{outcome}", ("seconds",)),
+        "cycle": ("data_store", "cycles", ()),
+        "file": ("data_store", "files_{outcome}", ("bytes", "seconds")),
+        "hpss": ("host", "{command}", ("seconds",)),
+        "location": ("data_store", "locations", ()),
+        "probe": ("data_store", "probes", ("seconds",)),
+        "retry": ("host", "retries", ("backoff_seconds",)),
+        "transfer": ("host", "transfers", ("bytes", "seconds")),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.log_file = None
+        self.totals = {}
+
+    def open(self, path):
+
+        """Append events to the JSON lines file at path."""
+
+        log_file = open(path, "a", buffering=1)  # pylint: disable=consider-using-with
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = log_file
+
+    def close(self):
+
+        """Stop writing events to a file."""
+
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = None
+
+    def reset(self):
+
+        """Forget the totals of the events recorded so far."""
+
+        with self.lock:
+            self.totals = {}
+
+    def record(self, event, **fields):
+
+        """Record an event with the given fields."""
+
+        entry = {
+            "time": dt.datetime.now(dt.timezone.utc).isoformat(timespec="milliseconds"),
+            "event": event,
+            **fields,
+        }
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            if event in self.TOTALS:
+                scope, count, summed = self.TOTALS[event]
+                totals = self.totals.setdefault((scope, str(fields.get(scope))), {})
+                count = count.format(**fields)
+                totals[count] = totals.get(count, 0) + 1
+                for field in summed:
+                    key = f"{count}_{field}"
+                    totals[key] = totals.get(key, 0) + (fields.get(field) or 0)
+            if self.log_file is not None:
+                self.log_file.write(f"{line}\n")
+
+    def summary(self):
+
+        """Return a summary of the totals by data store and by host, with
+        the throughput of each total of bytes and seconds."""
+
+        lines = ["Retrieval statistics:"]
+        for (scope, name), totals in sorted(self.totals.items()):
+            fields = []
+            for key, value in sorted(totals.items()):
+                if key.endswith("_bytes"):
+                    fields.append(f"{key[:-6]}_MB={value / 1024**2:.1f}")
+                    seconds = totals.get(f"{key[:-6]}_seconds")
+                    if seconds:
+                        fields.append(
+                            f"{key[:-6]}_MB/s={value / 1024**2 / seconds:.1f}"
+                        )
+                elif isinstance(value, float):
+                    fields.append(f"{key}={value:.2f}")
+                else:
+                    fields.append(f"{key}={value}")
+            lines.append(f"  {scope.replace('_', ' ')} {name}: {' '.join(fields)}")
+        return "\n".join(lines)
 
-def clean_up_output_dir(expected_subdir, local_archive, output_path, source_paths):
-
-    """Remove expected sub-directories and existing_archive files on
-    disk once all files have been extracted and put into the specified
-    output location."""
-
-    unavailable = {}
-    # Check to make sure the files exist on disk
-    for file_path in source_paths:
-        local_file_path = os.path.join(output_path, file_path.lstrip("/"))
-        if not os.path.exists(local_file_path):
-            logging.info(f"File does not exist: {local_file_path}")
-            unavailable["hpss"] = source_paths
-        else:
-            file_name = os.path.basename(file_path)
-            expected_output_loc = os.path.join(output_path, file_name)
-            if not local_file_path == expected_output_loc:
-                logging.info(f"Moving {local_file_path} to " f"{expected_output_loc}")
-                shutil.move(local_file_path, expected_output_loc)
-
-    # Clean up directories from inside archive, if they exist
-    if os.path.exists(expected_subdir) and expected_subdir != "./":
-        logging.info(f"Removing {expected_subdir}")
-        os.removedirs(expected_subdir)
-
-    # If an archive exists on disk, remove it
-    if os.path.exists(local_archive):
-        os.remove(local_archive)
 
-    return unavailable
+# The events of all retrievals in this process
+TELEMETRY = Telemetry()
 
 
-def copy_file(source, destination):
+def copy_file(source, destination, link_mode="copy"):
 
     """
     Copy a file from a source and place it in the destination location.
     Return a boolean value reflecting the state of the copy.
 
+    The link_mode chooses how the file is placed there:
+
+      copy      copy the file contents
+      hardlink  hardlink the file, or copy it if that is not possible
+      reflink   clone the file contents on a copy-on-write file system,
+                or copy it if that is not possible
+      symlink   symlink to the file
+      auto      the cheapest of reflink, hardlink, or copy that works for
+                this file
+
     Assumes destination exists.
     """
 
@@ -83,23 +252,58 @@ def copy_file(source, destination):
         logging.info(f"File does not exist on disk \n {source}")
         return False
 
-    # Using subprocess here because system copy is much faster than
-    # python copy options.
-    cmd = f"cp {source} {destination}"
-    logging.info(f"Running command: \n {cmd}")
+    source = os.path.abspath(source)
+    file_path = os.path.join(destination, os.path.basename(source))
+
+    modes = {
+        "auto": ("reflink", "hardlink", "copy"),
+        "hardlink": ("hardlink", "copy"),
+        "reflink": ("reflink", "copy"),
+    }.get(link_mode, (link_mode,))
+
+    for mode in modes:
+        logging.info(f"Placing {source} in {destination} with {mode}")
+        try:
+            _place_file(source, file_path, mode)
+        except OSError as err:
+            logging.info(f"Could not {mode} {source}: {err}")
+            continue
+        return True
+    return False
+
+
+# The Linux ioctl that clones the contents of one file into another
+FICLONE = 0x40049409
+
+
+def _place_file(source, file_path, mode):
+
+    """Place source at file_path with one of the copy_file link modes,
+    replacing any file already there. The file is placed under a
+    temporary name first so that a failure leaves nothing behind."""
+
+    tmp_path = f"{file_path}.tmp{os.getpid()}.{threading.get_ident()}"
     try:
-        subprocess.run(
-            cmd,
-            check=True,
-            shell=True,
-        )
-    except subprocess.CalledProcessError as err:
-        logging.info(err)
-        return False
-    return True
+        if mode == "copy":
+            shutil.copyfile(source, tmp_path)
+            shutil.copymode(source, tmp_path)
+        elif mode == "hardlink":
+            os.link(source, tmp_path)
+        elif mode == "symlink":
+            os.symlink(source, tmp_path)
+        elif mode == "reflink":
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copymode(source, tmp_path)
+        else:
+            raise ValueError(f"Unknown link mode: {mode}")
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
 
 
-def download_file(url):
+def download_file(url, target_path=None, backend="python", grib2_filter=None, parts=1):
 
     """
     Download a file from a url source, and place it in a target location
@@ -107,16 +311,38 @@ def download_file(url):
 
     Arguments:
       url          url to file to be downloaded
+      target_path  directory where the file is placed. Defaults to the
+                   current working directory.
+      backend      python to use the shared pool of persistent HTTP
+                   connections, or wget to fork a wget process
+      grib2_filter dict with optional variables and levels lists. When
+                   provided, only the matching GRIB2 records are
+                   downloaded, always with the python backend.
+      parts        the number of byte ranges to download at the same time
+                   for files of at least HTTP_MULTIPART_MIN_BYTES, with
+                   the python backend
 
     Return:
       boolean value reflecting state of download.
     """
 
+    if grib2_filter:
+        return download_grib2_subset(url, target_path, grib2_filter)
+
+    if backend == "python":
+        return get_http_pool().download(url, target_path, parts=parts) is not None
+
+    # wget does its own retries, but still honors the rate limit of the host
+    get_http_pool().throttle(url).acquire()
+
     # wget flags:
     # -c continue previous attempt
     # -T timeout seconds
     # -t number of tries
+    # -P directory prefix
     cmd = f"wget -q -c -T 30 -t 3 {url}"
+    if target_path is not None:
+        cmd = f"{cmd} -P {target_path}"
     logging.info(f"Running command: \n {cmd}")
     try:
         subprocess.run(
@@ -134,6 +360,826 @@ def download_file(url):
     return True
 
 
+Transfer = namedtuple("Transfer", ["url", "file_path", "nbytes", "seconds"])
+
+
+class HTTPStatusError(http.client.HTTPException):
+
+    """An HTTP response status that will not change on retry."""
+
+
+class HTTPRetryableError(http.client.HTTPException):
+
+    """An HTTP response status that may succeed on retry, e.g. a
+    throttled or temporarily unavailable server."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ProbeCancelled(Exception):
+
+    """The race a data store was being probed for has been decided, so
+    the probe was given up."""
+
+
+def is_throttling(err):
+
+    """Return whether an error signals that the server is throttling
+    requests: a 429 or 503 status, or a timeout."""
+
+    if isinstance(err, HTTPRetryableError):
+        return err.status in (429, 503)
+    return isinstance(err, (socket.timeout, TimeoutError))
+
+
+class HostThrottle:
+
+    """Paces the requests made to a single host. A token bucket limits
+    them to a steady rate with bursts, when a rate is set. Throttling
+    signals from the host pause all requests to it for an exponential
+    backoff with jitter, which doubles with each consecutive signal and
+    resets once a request succeeds.
+
+    Counts of requests, of requests that had to wait, and of backoffs,
+    along with the time spent waiting and backing off, are kept in
+    stats."""
+
+    def __init__(self, rate=None, burst=1, max_backoff=HTTP_MAX_BACKOFF):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_backoff = max_backoff
+        self.stats = dict(
+            requests=0,
+            waits=0,
+            wait_seconds=0.0,
+            backoffs=0,
+            backoff_seconds=0.0,
+        )
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, burst=1, max_backoff=None):
+
+        """Change the rate limit, and the longest backoff when given."""
+
+        with self._lock:
+            self.rate = rate
+            self.burst = max(burst, 1)
+            self._tokens = self.burst
+            if max_backoff is not None:
+                self.max_backoff = max_backoff
+
+    def acquire(self):
+
+        """Wait until a request may be sent to the host."""
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._resume_at - now
+                if wait <= 0 and self.rate:
+                    elapsed = now - self._updated
+                    self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                    self._updated = now
+                    wait = (1 - self._tokens) / self.rate
+                if wait <= 0:
+                    if self.rate:
+                        self._tokens -= 1
+                    self.stats["requests"] += 1
+                    if waited:
+                        self.stats["waits"] += 1
+                        self.stats["wait_seconds"] += waited
+                    return
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, retry_after=None):
+
+        """Record a throttling signal and pause requests to the host. A
+        Retry-After given by the server is a lower bound on the pause.
+        Return the number of seconds paused."""
+
+        with self._lock:
+            self._failures += 1
+            delay = min(self.max_backoff, HTTP_BACKOFF_BASE * 2 ** (self._failures - 1))
+            delay = random.uniform(delay / 2, delay)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_backoff))
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            self.stats["backoffs"] += 1
+            self.stats["backoff_seconds"] += delay
+        return delay
+
+    def succeeded(self):
+
+        """Reset the backoff after a successful request."""
+
+        with self._lock:
+            self._failures = 0
+
+
+class HTTPConnectionPool:
+
+    """A thread-safe pool of persistent HTTP(S) connections, keyed by
+    scheme, host, and port, so that consecutive requests to the same data
+    store reuse one TCP/TLS session instead of paying a new handshake per
+    file.
+
+    Connections are handed out to one thread at a time and returned to
+    the pool once their response has been read in full."""
+
+    def __init__(self, timeout=HTTP_TIMEOUT, tries=HTTP_TRIES, max_idle=8):
+        self.timeout = timeout
+        self.tries = tries
+        self.max_idle = max_idle
+        self.transfers = []
+        self.throttles = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def _new_connection(self, scheme, netloc):
+
+        """Open a new connection to netloc, going through a proxy when
+        one is set in the environment. Plain HTTP proxies expect the
+        absolute url in the request line, so that is flagged on the
+        connection."""
+
+        proxy = urllib.request.getproxies().get(scheme)
+        if proxy and urllib.request.proxy_bypass(netloc):
+            proxy = None
+
+        host = (urlparse(proxy).netloc or proxy) if proxy else netloc
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, timeout=self.timeout, context=self._ssl_context
+            )
+            if proxy:
+                conn.set_tunnel(netloc)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=self.timeout)
+        conn.absolute_urls = bool(proxy) and scheme == "http"
+        return conn
+
+    def _acquire(self, key):
+
+        """Return an idle connection for key, or a new one, along with
+        whether it was reused."""
+
+        with self._lock:
+            idle = self._idle.get(key, [])
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(*key), False
+
+    def _release(self, key, conn):
+
+        """Put a connection back in the pool for the next request."""
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def throttle(self, url):
+
+        """Return the HostThrottle of the host of url."""
+
+        netloc = urlparse(url).netloc
+        with self._lock:
+            if netloc not in self.throttles:
+                self.throttles[netloc] = HostThrottle()
+            return self.throttles[netloc]
+
+    def limit_hosts(self, urls, requests_per_second=None, burst=1, max_backoff=None):
+
+        """Set the rate limit and the longest backoff for the hosts of a
+        list of urls, e.g. the urls of a data store."""
+
+        for url in urls:
+            self.throttle(url).configure(requests_per_second, burst, max_backoff)
+
+    def throttle_stats(self):
+
+        """Return a dict of the request and backoff counts of each host."""
+
+        with self._lock:
+            return {
+                netloc: dict(throttle.stats)
+                for netloc, throttle in self.throttles.items()
+            }
+
+    def _retry(self, url, err, failures, backoffs):
+
+        """Log a failed attempt, and back off before the next one when the
+        server is throttling requests. Throttled responses do not count
+        as failures, up to HTTP_MAX_BACKOFFS of them. Return the updated
+        counts of failures and backoffs."""
+
+        logging.info(f"Attempt at {url} failed: {err}")
+        if isinstance(err, HTTPRetryableError) and is_throttling(err):
+            if backoffs < HTTP_MAX_BACKOFFS:
+                backoffs += 1
+            else:
+                failures += 1
+        else:
+            failures += 1
+
+        delay = 0.0
+        if is_throttling(err) and failures < self.tries:
+            delay = self.throttle(url).backoff(getattr(err, "retry_after", None))
+            logging.info(f"Backing off {delay:.2f} s from {urlparse(url).netloc}")
+        TELEMETRY.record(
+            "retry",
+            url=url,
+            host=urlparse(url).netloc,
+            error=str(err) or type(err).__name__,
+            backoff_seconds=delay,
+        )
+        return failures, backoffs
+
+    def close(self):
+
+        """Close all idle connections."""
+
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+    @contextlib.contextmanager
+    def open(self, url, method="GET", headers=None):
+
+        """Send a request and yield the response, following redirects. Each
+        request, including one to the target of a redirect, is paced by
+        the HostThrottle of the host it is sent to. The connection goes
+        back to the pool if the response is read in full and the server
+        keeps the connection alive."""
+
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            self.throttle(url).acquire()
+            parsed = urlparse(url)
+            key = (parsed.scheme, parsed.netloc)
+            response, conn = self._request(key, parsed, method, headers or {})
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                self._release(key, conn)
+                url = urljoin(url, response.getheader("Location"))
+                logging.debug(f"Redirected to {url}")
+                continue
+
+            try:
+                yield response
+            except:
+                conn.close()
+                raise
+            if response.isclosed() and not response.will_close:
+                self._release(key, conn)
+            else:
+                conn.close()
+            return
+
+        raise HTTPStatusError(f"Too many redirects for {url}")
+
+    def _request(self, key, parsed, method, headers):
+
+        """Send one request on a pooled connection. A reused connection
+        that the server has since closed is replaced once."""
+
+        path = parsed.path or "/"
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+
+        conn, reused = self._acquire(key)
+        while True:
+            target = parsed.geturl() if conn.absolute_urls else path
+            try:
+                conn.request(method, target, headers=headers)
+                return conn.getresponse(), conn
+            except (http.client.RemoteDisconnected, ConnectionError):
+                conn.close()
+                if not reused:
+                    raise
+            except:
+                conn.close()
+                raise
+            conn, reused = self._new_connection(*key), False
+
+    def read(self, url):
+
+        """Return the body of a small document, such as an index file, or
+        None if it could not be retrieved."""
+
+        response = self._read(url)
+        return response[1] if response is not None else None
+
+    def read_range(self, url, first, last):
+
+        """Return the bytes first to last of url, as a tuple of the offset
+        of the bytes returned and the bytes, or None if they could not be
+        retrieved. Servers that do not support byte ranges send the whole
+        file, which is returned with an offset of 0."""
+
+        start = time.perf_counter()
+        response = self._read(url, {"Range": f"bytes={first}-{last}"})
+        if response is None:
+            return None
+        status, body = response
+        TELEMETRY.record(
+            "transfer",
+            url=url,
+            host=urlparse(url).netloc,
+            bytes=len(body),
+            seconds=time.perf_counter() - start,
+            byte_range=[first, last],
+        )
+        if status == 200:
+            logging.warning(
+                f"Byte ranges are not supported for {url}. Got the whole file."
+            )
+            return 0, body
+        return first, body
+
+    def _read(self, url, headers=None):
+
+        """Return the status and body of a response to a request for url,
+        or None if it could not be retrieved."""
+
+        failures = backoffs = 0
+        while failures < self.tries:
+            try:
+                with self.open(url, headers=headers) as response:
+                    self._check_status(response)
+                    body = response.read()
+            except HTTPStatusError as err:
+                logging.info(f"Could not read {url}: {err}")
+                return None
+            except (OSError, http.client.HTTPException) as err:
+                failures, backoffs = self._retry(url, err, failures, backoffs)
+                continue
+            self.throttle(url).succeeded()
+            return response.status, body
+        return None
+
+    def probe(self, url, sample_bytes=0, cancel=None):
+
+        """Check that url is available without retrieving it, with a HEAD
+        request, or by reading its first sample_bytes to time the
+        transfer.
+
+        Raise ProbeCancelled instead of making another request once the
+        cancel event, if any, is set.
+
+        Return the size of the file, the number of bytes read, and the
+        time the request took, or None if the file is unavailable."""
+
+        headers = {"Range": f"bytes=0-{sample_bytes - 1}"} if sample_bytes else {}
+        failures = backoffs = 0
+        while failures < self.tries:
+            if cancel is not None and cancel.is_set():
+                raise ProbeCancelled(url)
+            start = time.perf_counter()
+            try:
+                with self.open(
+                    url, "GET" if sample_bytes else "HEAD", headers
+                ) as response:
+                    self._check_status(response)
+                    size = response.getheader("Content-Length")
+                    content_range = response.getheader("Content-Range", "")
+                    if "/" in content_range:
+                        size = content_range.rpartition("/")[2]
+                    received = len(response.read(sample_bytes)) if sample_bytes else 0
+            except HTTPStatusError as err:
+                logging.info(f"Could not find {url}: {err}")
+                return None
+            except (OSError, http.client.HTTPException) as err:
+                failures, backoffs = self._retry(url, err, failures, backoffs)
+                continue
+            self.throttle(url).succeeded()
+            size = int(size) if size and size.isdigit() else 0
+            return size, received, time.perf_counter() - start
+        return None
+
+    def download(self, url, target_path=None, byte_ranges=None, parts=1):
+
+        """Stream url into a file of the same name in target_path,
+        resuming any partial file already there with a Range request, the
+        same way wget -c does.
+
+        When parts is greater than 1 and the server reports a file of at
+        least HTTP_MULTIPART_MIN_BYTES that supports byte ranges, the file
+        is split into that many byte ranges that are retrieved at the
+        same time instead; see _fetch_parts.
+
+        When a list of (first, last) byte_ranges is given, only those
+        ranges are retrieved and concatenated, in order, into the file. A
+        last byte of None reads to the end of the file.
+
+        Return a Transfer with the bytes received and the elapsed time, or
+        None if the file could not be retrieved."""
+
+        file_name = os.path.basename(urlparse(url).path)
+        file_path = os.path.join(target_path or os.getcwd(), file_name)
+
+        start = time.perf_counter()
+        nbytes = 0
+        failures = backoffs = 0
+        while failures < self.tries:
+            try:
+                if byte_ranges is None:
+                    received, complete = self._fetch(url, file_path, parts)
+                else:
+                    received, complete = self._fetch_ranges(url, file_path, byte_ranges)
+            except HTTPStatusError as err:
+                logging.info(f"Could not download {url}: {err}")
+                return None
+            except (OSError, http.client.HTTPException) as err:
+                failures, backoffs = self._retry(url, err, failures, backoffs)
+                continue
+
+            self.throttle(url).succeeded()
+            nbytes += received
+            if complete:
+                seconds = time.perf_counter() - start
+                transfer = Transfer(url, file_path, nbytes, seconds)
+                with self._lock:
+                    self.transfers.append(transfer)
+                TELEMETRY.record(
+                    "transfer",
+                    url=url,
+                    host=urlparse(url).netloc,
+                    bytes=nbytes,
+                    seconds=seconds,
+                    failures=failures,
+                    backoffs=backoffs,
+                )
+                logging.info(
+                    f"Downloaded {nbytes} bytes in {seconds:.2f} s "
+                    f"({nbytes / max(seconds, 1e-6) / 1024**2:.2f} MB/s): {url}"
+                )
+                return transfer
+            failures += 1
+
+        logging.info(f"Giving up on {url} after {self.tries} tries")
+        TELEMETRY.record(
+            "transfer_failed", url=url, host=urlparse(url).netloc, failures=failures
+        )
+        return None
+
+    @staticmethod
+    def _check_status(response):
+
+        """Raise an error for any response that does not carry content,
+        after draining its body so the connection can be reused."""
+
+        if response.status in (200, 206):
+            return
+        response.read()
+        if response.status == 429 or response.status >= 500:
+            retry_after = response.getheader("Retry-After", "")
+            raise HTTPRetryableError(
+                f"{response.status} {response.reason}",
+                status=response.status,
+                retry_after=int(retry_after) if retry_after.isdigit() else None,
+            )
+        raise HTTPStatusError(f"{response.status} {response.reason}")
+
+    @staticmethod
+    def _stream(response, local_file):
+
+        """Copy a response body into an open file in large chunks. Return
+        the number of bytes written and whether that matches the
+        Content-Length the server promised."""
+
+        received = 0
+        while True:
+            chunk = response.read(HTTP_CHUNK_SIZE)
+            if not chunk:
+                break
+            local_file.write(chunk)
+            received += len(chunk)
+
+        expected = response.getheader("Content-Length")
+        return received, expected is None or received == int(expected)
+
+    def _fetch(self, url, file_path, parts=1):
+
+        """Make a single attempt to retrieve url into file_path, in parts
+        byte ranges at the same time if it is large enough. Return the
+        number of bytes received and whether the file is complete."""
+
+        # Carry on with the ranges of an earlier attempt
+        state = self._parts_state(file_path)
+        if parts > 1 and state is not None:
+            return self._fetch_parts(url, file_path, state["size"], parts)
+
+        offset = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.open(url, headers=headers) as response:
+            if response.status == 416 and offset:
+                # Nothing left to get. The file is already complete.
+                response.read()
+                return 0, True
+            self._check_status(response)
+
+            size = response.getheader("Content-Length", "")
+            if (
+                parts > 1
+                and response.status == 200
+                and size.isdigit()
+                and int(size) >= HTTP_MULTIPART_MIN_BYTES
+                and response.getheader("Accept-Ranges", "").lower() == "bytes"
+            ):
+                return self._fetch_parts(url, file_path, int(size), parts, response)
+
+            mode = "ab" if response.status == 206 else "wb"
+            with open(file_path, mode) as local_file:
+                received, complete = self._stream(response, local_file)
+
+        if not complete:
+            logging.info(f"Received only {received} bytes from {url}")
+        return received, complete
+
+    @staticmethod
+    def _parts_state(file_path):
+
+        """Return the record of the byte ranges of file_path received by
+        an earlier attempt of _fetch_parts, or None."""
+
+        try:
+            with open(f"{file_path}.part.json") as state_file:
+                state = json.load(state_file)
+            if os.path.getsize(f"{file_path}.part") == state["size"]:
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _fetch_parts(self, url, file_path, size, parts, response=None):
+
+        # pylint: disable=too-many-arguments, too-many-locals
+
+        """Make a single attempt to retrieve url, of size bytes, into
+        file_path in parts byte ranges at the same time. response, when
+        given, is an open response with the whole file, which is read for
+        the first range. The rest of it is left unread, so its connection
+        is closed rather than reused.
+
+        The ranges are written in place, with os.pwrite, into a file of
+        the full size, file_path.part, which replaces file_path once all
+        of them have arrived and its size has been checked. The bytes
+        received of each range are recorded in file_path.part.json, so a
+        later attempt retrieves only what is missing of each range.
+
+        Return the number of bytes received and whether the file is
+        complete. Raise the first error of any range, once the others
+        are done, so it can be retried."""
+
+        part_path = f"{file_path}.part"
+        state_path = f"{part_path}.json"
+        part_size = -(-size // parts)
+        ranges = [
+            (first, min(first + part_size, size) - 1)
+            for first in range(0, size, part_size)
+        ]
+
+        state = self._parts_state(file_path)
+        received = [0] * len(ranges)
+        if state is not None and state["size"] == size:
+            if len(state["received"]) == len(ranges):
+                received = state["received"]
+        before = sum(received)
+
+        def fetch_range(index, fd, response=None):
+            first, last = ranges[index]
+            offset = first + received[index]
+            if offset > last:
+                return
+            request = (
+                self.open(url, headers={"Range": f"bytes={offset}-{last}"})
+                if response is None
+                else contextlib.nullcontext(response)
+            )
+            with request as part:
+                if response is None:
+                    self._check_status(part)
+                    if part.status != 206:
+                        part.close()
+                        raise http.client.HTTPException(
+                            f"Received status {part.status} for a byte range"
+                        )
+                while offset <= last:
+                    chunk = part.read(min(HTTP_CHUNK_SIZE, last - offset + 1))
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    received[index] += len(chunk)
+
+        errors = []
+
+        def attempt(index, fd, response=None):
+            try:
+                fetch_range(index, fd, response)
+            except (OSError, http.client.HTTPException) as err:
+                logging.info(f"Byte range {ranges[index]} of {url} failed: {err}")
+                errors.append(err)
+
+        logging.info(f"Downloading {url} in {len(ranges)} byte ranges")
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                if hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError:
+                        pass
+
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [
+                    pool.submit(attempt, index, fd)
+                    for index in range(0 if response is None else 1, len(ranges))
+                ]
+                if response is not None:
+                    attempt(0, fd, response)
+                for future in futures:
+                    future.result()
+            if sum(received) == size:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        complete = sum(received) == size and os.path.getsize(part_path) == size
+        if complete:
+            os.replace(part_path, file_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+        else:
+            with open(state_path, "w") as state_file:
+                json.dump({"size": size, "received": received}, state_file)
+            if errors:
+                raise errors[0]
+            logging.info(f"Received only {sum(received)} of {size} bytes of {url}")
+        return sum(received) - before, complete
+
+    def _fetch_ranges(self, url, file_path, byte_ranges):
+
+        """Make a single attempt to retrieve a list of byte ranges of url
+        into file_path. The ranges are gathered in a temporary file that
+        replaces file_path only once all of them have arrived. Return the
+        number of bytes received and whether the file is complete."""
+
+        tmp_path = f"{file_path}.part"
+        received = 0
+        with open(tmp_path, "wb") as local_file:
+            for first, last in byte_ranges:
+                last = "" if last is None else last
+                headers = {"Range": f"bytes={first}-{last}"}
+                with self.open(url, headers=headers) as response:
+                    self._check_status(response)
+                    if response.status == 200:
+                        logging.warning(
+                            f"Byte ranges are not supported for {url}. "
+                            "Getting the whole file."
+                        )
+                        local_file.seek(0)
+                        local_file.truncate()
+                        nbytes, complete = self._stream(response, local_file)
+                        received += nbytes
+                        break
+                    nbytes, complete = self._stream(response, local_file)
+                received += nbytes
+                if not complete:
+                    logging.info(f"Received only {nbytes} bytes of {headers}")
+                    return received, False
+
+        os.replace(tmp_path, file_path)
+        return received, True
+
+
+_HTTP_POOL = None
+_HTTP_POOL_LOCK = threading.Lock()
+
+
+def get_http_pool():
+
+    """Return the connection pool shared by all downloads in this
+    process."""
+
+    global _HTTP_POOL  # pylint: disable=global-statement
+    with _HTTP_POOL_LOCK:
+        if _HTTP_POOL is None:
+            _HTTP_POOL = HTTPConnectionPool()
+        return _HTTP_POOL
+
+
+def parse_grib2_index(index):
+
+    """Parse a wgrib2-style GRIB2 inventory (.idx file) into a list of
+    (offset, variable, level) tuples, one per record, in file order.
+
+    Each inventory line looks like:
+
+      1:0:d=2022062512:PRMSL:mean sea level:anl:
+
+    Sub-messages are numbered like 3.1, 3.2 and share the byte offset of
+    the message that contains them."""
+
+    if isinstance(index, bytes):
+        index = index.decode("utf-8", errors="replace")
+
+    records = []
+    for line in index.splitlines():
+        fields = line.split(":")
+        if len(fields) < 5:
+            continue
+        records.append((int(fields[1]), fields[3], fields[4]))
+    return records
+
+
+def grib2_byte_ranges(records, variables=None, levels=None):
+
+    """Given the records of a GRIB2 inventory, return the list of
+    (first, last) byte ranges of the messages that match the variables
+    and levels. Each entry of variables and levels is a regular
+    expression that must match the whole field. An empty list matches
+    everything.
+
+    Ranges of adjacent messages are merged. The last byte of a range
+    that runs to the end of the file is None."""
+
+    variables = [re.compile(variable) for variable in variables or []]
+    levels = [re.compile(str(level)) for level in levels or []]
+
+    def matches(patterns, field):
+        return not patterns or any(p.fullmatch(field) for p in patterns)
+
+    offsets = sorted({offset for offset, _, _ in records})
+    next_offsets = dict(zip(offsets, offsets[1:] + [None]))
+
+    selected = sorted(
+        {
+            offset
+            for offset, variable, level in records
+            if matches(variables, variable) and matches(levels, level)
+        }
+    )
+
+    byte_ranges = []
+    for offset in selected:
+        next_offset = next_offsets[offset]
+        last = None if next_offset is None else next_offset - 1
+        if byte_ranges and byte_ranges[-1][1] == offset - 1:
+            byte_ranges[-1] = (byte_ranges[-1][0], last)
+        else:
+            byte_ranges.append((offset, last))
+    return byte_ranges
+
+
+def download_grib2_subset(url, target_path, grib2_filter):
+
+    """Download only the GRIB2 messages of url that match the variables
+    and levels in grib2_filter, using the byte offsets listed in the
+    url's .idx inventory. The messages are concatenated into a GRIB2 file
+    of the same name in target_path.
+
+    Without an inventory, the whole file is downloaded.
+
+    Return:
+      boolean value reflecting state of download.
+    """
+
+    pool = get_http_pool()
+    index = pool.read(f"{url}.idx")
+    if index is None:
+        logging.info(f"No inventory found for {url}. Getting the whole file.")
+        return pool.download(url, target_path) is not None
+
+    byte_ranges = grib2_byte_ranges(
+        parse_grib2_index(index),
+        variables=grib2_filter.get("variables"),
+        levels=grib2_filter.get("levels"),
+    )
+    if not byte_ranges:
+        logging.error(f"No records in {url} match {grib2_filter}")
+        return False
+
+    logging.info(f"Getting {len(byte_ranges)} byte ranges of {url}")
+    return pool.download(url, target_path, byte_ranges=byte_ranges) is not None
+
+
 def arg_list_to_range(args):
 
     """
@@ -160,34 +1206,60 @@ def arg_list_to_range(args):
     return args
 
 
-def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
+def arg_list_to_dates(args):
 
-    """Fill in the provided template string with date time information,
-    and return the resulting string.
+    """
+    Given the argparse list of cycle dates, return the list of datetime
+    objects to process.
 
-    Arguments:
-      template_str    a string containing Python templates
-      cycle_date      a datetime object that will be used to fill in
-                      date and time information
-      templates_only  boolean value. When True, this function will only
-                      return the templates available.
+    The length of the list will determine what dates are returned:
 
-    Keyword Args:
-      ens_group       a number associated with a bin where ensemble
-                      members are stored in archive files
-      fcst_hr         an integer forecast hour. string formatting should
-                      be included in the template_str
-      mem             a single ensemble member. should be a positive integer value
+      Length = 1:   A single cycle date is to be processed
+      Length = 2:   Every hour from start to stop
+      Length = 3:   From start to stop, with an increment in hours
+      Length > 3:   List as is
 
-    Return:
-      filled template string
+    Dates are given as strings like YYYYMMDDHH.
     """
 
-    # Parse keyword args
-    ens_group = kwargs.get("ens_group")
-    fcst_hr = kwargs.get("fcst_hr", 0)
-    mem = kwargs.get("mem", "")
-    # -----
+    if len(args) in (2, 3):
+        start, stop = to_datetime(args[0]), to_datetime(args[1])
+        increment = dt.timedelta(hours=int(args[2]) if len(args) == 3 else 1)
+        dates = []
+        while start <= stop:
+            dates.append(start)
+            start += increment
+        return dates
+
+    return [to_datetime(arg) for arg in args]
+
+
+# The fields a template may use. Those of the cycle date are worked out
+# once per cycle date; the others are passed in when it is filled.
+TEMPLATE_FIELDS = (
+    "bin6",
+    "ens_group",
+    "fcst_hr",
+    "dd",
+    "hh",
+    "hh_even",
+    "jjj",
+    "mem",
+    "mm",
+    "yy",
+    "yyyy",
+    "yyyymm",
+    "yyyymmdd",
+    "yyyymmddhh",
+)
+DATE_FIELDS = frozenset(TEMPLATE_FIELDS) - {"ens_group", "fcst_hr", "mem"}
+
+
+@functools.lru_cache(maxsize=4096)
+def date_fields(cycle_date):
+
+    """Return a dict of the values of the date fields of templates for a
+    cycle date."""
 
     cycle_hour = cycle_date.strftime("%H")
 
@@ -203,15 +1275,12 @@ def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
     # Integer division is intentional here.
     hh_even = f"{int(cycle_hour) // 2 * 2:02d}"
 
-    format_values = dict(
+    return dict(
         bin6=bin6,
-        ens_group=ens_group,
-        fcst_hr=fcst_hr,
         dd=cycle_date.strftime("%d"),
         hh=cycle_hour,
         hh_even=hh_even,
         jjj=cycle_date.strftime("%j"),
-        mem=mem,
         mm=cycle_date.strftime("%m"),
         yy=cycle_date.strftime("%y"),
         yyyy=cycle_date.strftime("%Y"),
@@ -220,9 +1289,107 @@ def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
         yyyymmddhh=cycle_date.strftime("%Y%m%d%H"),
     )
 
+
+class FileTemplate:
+
+    """A path, url, or file name template that is parsed once, so that
+    it can be filled for many cycle dates, forecast hours, and members
+    without rebuilding the values of the fields it does not use."""
+
+    def __init__(self, template_str):
+        self.template_str = template_str
+        self.fields = frozenset(
+            re.split(r"[.\[]", field_name)[0]
+            for _, field_name, _, _ in string.Formatter().parse(template_str)
+            if field_name
+        )
+        self.uses_date = bool(self.fields & DATE_FIELDS)
+
+    def fill(self, cycle_date, fcst_hr=0, mem="", ens_group=None):
+
+        """Return the template filled in for one cycle date, forecast
+        hour, member, and ensemble group."""
+
+        if not self.fields:
+            return self.template_str
+        values = dict(fcst_hr=fcst_hr, mem=mem, ens_group=ens_group)
+        if self.uses_date:
+            values.update(date_fields(cycle_date))
+        return self.template_str.format_map(values)
+
+    def expand(self, cycle_dates, fcst_hrs=(0,), mems=("",), ens_groups=(None,)):
+
+        """Fill in the template for every combination of the cycle dates,
+        forecast hours, members, and ensemble groups given. Each distinct
+        string is formatted only once, since the values of fields the
+        template does not use are not iterated over.
+
+        Return a dict mapping each (cycle date, forecast hour, member,
+        ensemble group) to the filled template, in that nested order."""
+
+        cycle_dates = list(cycle_dates)
+        axes = (("fcst_hr", fcst_hrs), ("mem", mems), ("ens_group", ens_groups))
+        used = [num for num, (name, _) in enumerate(axes) if name in self.fields]
+
+        filled = {}
+        values = dict(fcst_hr=0, mem="", ens_group=None)
+        for cycle_date in cycle_dates if self.uses_date else cycle_dates[:1]:
+            if self.uses_date:
+                values.update(date_fields(cycle_date))
+            for combo in itertools.product(*(axes[num][1] for num in used)):
+                values.update((axes[num][0], value) for num, value in zip(used, combo))
+                key = (cycle_date if self.uses_date else None, combo)
+                filled[key] = self.template_str.format_map(values)
+
+        return {
+            key: filled[
+                key[0] if self.uses_date else None,
+                tuple(key[1:][num] for num in used),
+            ]
+            for key in itertools.product(cycle_dates, fcst_hrs, mems, ens_groups)
+        }
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(template_str):
+
+    """Return the FileTemplate of a template string, parsing it only the
+    first time it is asked for."""
+
+    return FileTemplate(template_str)
+
+
+def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
+
+    """Fill in the provided template string with date time information,
+    and return the resulting string.
+
+    Arguments:
+      template_str    a string containing Python templates
+      cycle_date      a datetime object that will be used to fill in
+                      date and time information
+      templates_only  boolean value. When True, this function will only
+                      return the templates available.
+
+    Keyword Args:
+      ens_group       a number associated with a bin where ensemble
+                      members are stored in archive files
+      fcst_hr         an integer forecast hour. string formatting should
+                      be included in the template_str
+      mem             a single ensemble member. should be a positive integer value
+
+    Return:
+      filled template string
+    """
+
     if templates_only:
-        return f'{",".join((format_values.keys()))}'
-    return template_str.format(**format_values)
+        return ",".join(TEMPLATE_FIELDS)
+    return compile_template(template_str).fill(
+        cycle_date,
+        fcst_hr=kwargs.get("fcst_hr", 0),
+        mem=kwargs.get("mem", ""),
+        ens_group=kwargs.get("ens_group"),
+    )
 
 
 def create_target_path(target_path):
@@ -235,33 +1402,53 @@ def create_target_path(target_path):
     return target_path
 
 
-def find_archive_files(paths, file_names, cycle_date, ens_group):
+def archive_candidates(paths, file_names, cycle_date, ens_group):
+
+    """Given an equal-length set of archive paths and archive file
+    names, and a cycle date, return a list with the list of filled-in
+    archive file paths for each item in the set."""
+
+    candidates = []
+    for archive_path, archive_file_names in zip(paths, file_names):
+        if not isinstance(archive_file_names, list):
+            archive_file_names = [archive_file_names]
+        candidates.append(
+            [
+                fill_template(
+                    os.path.join(archive_path, archive_file_name),
+                    cycle_date,
+                    ens_group=ens_group,
+                )
+                for archive_file_name in archive_file_names
+            ]
+        )
+    return candidates
+
+
+def find_archive_files(paths, file_names, cycle_date, ens_group, cancel=None):
 
     """Given an equal-length set of archive paths and archive file
     names, and a cycle date, check HPSS via hsi to make sure at least
     one set exists. Return a dict of the paths of the existing archive, along with
-    the item in set of paths that was found."""
+    the item in set of paths that was found.
 
-    zipped_archive_file_paths = zip(paths, file_names)
-
-    # Narrow down which HPSS files are available for this date
-    for list_item, (archive_path, archive_file_names) in enumerate(
-        zipped_archive_file_paths
-    ):
+    All candidates are checked in a single hsi session, and the results
+    are remembered for the rest of the run. The session is killed once
+    the cancel event, if any, is set; see hsi_probe."""
 
-        existing_archives = {}
-        if not isinstance(archive_file_names, list):
-            archive_file_names = [archive_file_names]
+    candidates = archive_candidates(paths, file_names, cycle_date, ens_group)
+    exists = hsi_probe(
+        [file_path for item in candidates for file_path in item], cancel=cancel
+    )
 
-        for n_fp, archive_file_name in enumerate(archive_file_names):
-            # Only test the first item in the list, it will tell us if this
-            # set exists at this date.
-            file_path = os.path.join(archive_path, archive_file_name)
-            file_path = fill_template(file_path, cycle_date, ens_group=ens_group)
-            file_path = hsi_single_file(file_path)
+    # Narrow down which HPSS files are available for this date
+    for list_item, file_paths in enumerate(candidates):
 
-            if file_path:
-                existing_archives[n_fp] = file_path
+        existing_archives = {
+            n_fp: file_path
+            for n_fp, file_path in enumerate(file_paths)
+            if exists[file_path]
+        }
 
         if existing_archives:
             for existing_archive in existing_archives.values():
@@ -271,6 +1458,29 @@ def find_archive_files(paths, file_names, cycle_date, ens_group):
     return "", 0
 
 
+def get_archive_specs(cla, store_specs):
+
+    """Return the lists of archive paths and archive file names to
+    search on HPSS for the file type and anl_or_fcst requested on the
+    command line. The archive paths of a download data store are its
+    urls."""
+
+    archive_paths = store_specs.get("archive_path", store_specs.get("url"))
+    archive_paths = (
+        archive_paths if isinstance(archive_paths, list) else [archive_paths]
+    )
+
+    # Could be a list of lists
+    archive_file_names = store_specs.get("archive_file_names", {})
+    if cla.file_type is not None:
+        archive_file_names = archive_file_names[cla.file_type]
+
+    if isinstance(archive_file_names, dict):
+        archive_file_names = archive_file_names[cla.anl_or_fcst]
+
+    return archive_paths, archive_file_names
+
+
 def get_file_templates(cla, known_data_info, data_store, use_cla_tmpl=False):
 
     """Returns the file templates requested by user input, either from
@@ -299,10 +1509,28 @@ def get_file_templates(cla, known_data_info, data_store, use_cla_tmpl=False):
     if not file_templates:
         msg = "No file naming convention found. They must be provided \
                 either on the command line or on in a config file."
-        raise argparse.ArgumentTypeError(msg)
+        raise PlanError(msg)
     return file_templates
 
 
+def expand_locations(loc, templates, cycle_dates, fcst_hrs, mems):
+
+    """Return the full path or url of each of a list of file templates
+    at a location, for every cycle date, forecast hour, and member, in a
+    dict keyed by (cycle date, forecast hour, member). A location may be
+    a list with a path or url for each template."""
+
+    input_locs = {}
+    template_loc = loc
+    for tmpl_num, template in enumerate(templates):
+        if isinstance(loc, list) and len(loc) == len(templates):
+            template_loc = loc[tmpl_num]
+        template = compile_template(os.path.join(template_loc, template))
+        for key, input_loc in template.expand(cycle_dates, fcst_hrs, mems).items():
+            input_locs.setdefault(key[:3], []).append(input_loc)
+    return input_locs
+
+
 def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs):
 
     # pylint: disable=too-many-locals
@@ -311,6 +1539,12 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
     or downloads files from a url, depending on the option specified for
     user.
 
+    Every (cycle date, member, forecast hour) set is satisfied by the
+    first location that provides all of its files. The files of all the
+    cycle dates in cla.cycle_dates are planned together. Locations are
+    tried in order, and all files still needed from a location are
+    retrieved concurrently when max_workers is greater than 1.
+
     This function expects that the output directory exists and is
     writeable.
 
@@ -327,15 +1561,46 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
     members        a list integers corresponding to the ensemble members
     check_all      boolean flag that indicates all urls should be
                    checked for all files
+    max_workers    the number of files to retrieve at the same time
+    max_per_host   the number of files to retrieve at the same time from
+                   any one host
+    backend        the download backend, python or wget
+    parts          the number of byte ranges to download at the same
+                   time for large files, with the python backend
+    grib2_filter   dict of variables and levels lists used to download
+                   only matching GRIB2 records
+    cache          a FileCache to consult before downloading
+    manifest       a Manifest of the files already retrieved
+    data_store     the name of the data store recorded in the manifest
+    progress       a callable that is passed a ProgressEvent for each
+                   file retrieved or skipped
+    link_mode      how files are placed in the output path when copying
+                   from disk: copy, hardlink, reflink, symlink, or auto
 
     Returns:
-    unavailable  a list of locations/files that were unretrievable
+    unavailable  a dict mapping each cycle date that is missing files to
+                 a list of the locations/files that were unretrievable
     """
 
     members = kwargs.get("members", "")
     members = members if isinstance(members, list) else [members]
 
     check_all = kwargs.get("check_all", False)
+    max_workers = kwargs.get("max_workers", 1)
+    max_per_host = kwargs.get("max_per_host")
+    retrieve_opts = dict(link_mode=kwargs.get("link_mode", "copy"))
+    if method == "download":
+        retrieve_opts = dict(
+            backend=kwargs.get("backend", "python"),
+            grib2_filter=kwargs.get("grib2_filter"),
+            cache=kwargs.get("cache"),
+            parts=kwargs.get("parts", 1),
+        )
+    retrieve_opts.update(
+        manifest=kwargs.get("manifest"),
+        data_store=kwargs.get("data_store", method),
+        progress=kwargs.get("progress"),
+    )
 
     logging.info(f"Getting files named like {file_templates}")
 
@@ -347,68 +1612,557 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
 
     input_locs = input_locs if isinstance(input_locs, list) else [input_locs]
 
-    orig_path = os.path.dirname(__file__)
-    unavailable = []
+    pending = []
+    for cycle_date in cla.cycle_dates:
+        for mem in members:
+            target_path = fill_template(cla.output_path, cycle_date, mem=mem)
+            target_path = create_target_path(target_path)
+            logging.info(f"Retrieved files will be placed here: \n {target_path}")
+            pending.extend(
+                [(cycle_date, mem, fcst_hr, target_path) for fcst_hr in cla.fcst_hrs]
+            )
 
+    unavailable = {}
+    host_limits = HostLimits(max_per_host)
     locs_files = pair_locs_with_files(input_locs, file_templates, check_all)
-    for mem in members:
-        target_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
-        target_path = create_target_path(target_path)
+    for loc, templates in locs_files:
+
+        # Stop looking once every fcst hour has found its files.
+        if not pending:
+            break
 
-        logging.info(f"Retrieved files will be placed here: \n {target_path}")
-        os.chdir(target_path)
+        templates = templates if isinstance(templates, list) else [templates]
 
-        for fcst_hr in cla.fcst_hrs:
+        logging.debug(f"Looking for files like {templates}")
+        logging.debug(f"They should be here: {loc}")
+
+        # Fill in the templates for all of the groups at once
+        locations = expand_locations(
+            loc, templates, cla.cycle_dates, cla.fcst_hrs, members
+        )
+
+        requests = []
+        for group in pending:
+            cycle_date, mem, fcst_hr, target_path = group
             logging.debug(f"Looking for fhr = {fcst_hr}")
-            for loc, templates in locs_files:
-
-                templates = templates if isinstance(templates, list) else [templates]
-
-                logging.debug(f"Looking for files like {templates}")
-                logging.debug(f"They should be here: {loc}")
-
-                template_loc = loc
-                for tmpl_num, template in enumerate(templates):
-                    if isinstance(loc, list) and len(loc) == len(templates):
-                        template_loc = loc[tmpl_num]
-                    input_loc = os.path.join(template_loc, template)
-                    input_loc = fill_template(
-                        input_loc,
-                        cla.cycle_date,
-                        fcst_hr=fcst_hr,
-                        mem=mem,
+            for input_loc in locations.get((cycle_date, fcst_hr, mem), []):
+                logging.debug(f"Full file path: {input_loc}")
+                requests.append((group, input_loc))
+
+        retrieved = retrieve_files(
+            [(input_loc, group[-1]) for group, input_loc in requests],
+            method=method,
+            max_workers=max_workers,
+            host_limits=host_limits,
+            **retrieve_opts,
+        )
+
+        # Any fcst hour missing a file at this location goes on to the
+        # next location.
+        missing = {}
+        for (group, input_loc), status in zip(requests, retrieved):
+            logging.debug(f"Retrieved status for {input_loc}: {status}")
+            if not status:
+                missing.setdefault(group, []).append(input_loc)
+
+        TELEMETRY.record(
+            "location",
+            data_store=retrieve_opts["data_store"],
+            location=loc,
+            delivered=len(pending) - len(missing),
+            missing=len(missing),
+        )
+        pending = [group for group in pending if group in missing]
+        unavailable = {}
+        for group in pending:
+            unavailable.setdefault(group[0], []).extend(missing[group])
+
+    return unavailable
+
+
+class HostLimits:
+
+    """Hands out a semaphore per host so that the number of concurrent
+    requests made to any one data store can be capped. Disk paths all
+    share a single "localhost" entry."""
+
+    def __init__(self, max_per_host=None):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def __call__(self, location):
+
+        """Return the semaphore guarding the host of the given
+        location."""
+
+        host = urlparse(location).netloc or "localhost"
+        with self._lock:
+            if host not in self._semaphores:
+                if self.max_per_host:
+                    self._semaphores[host] = threading.BoundedSemaphore(
+                        self.max_per_host
                     )
-                    logging.debug(f"Full file path: {input_loc}")
-
-                    if method == "disk":
-                        retrieved = copy_file(input_loc, target_path)
-
-                    if method == "download":
-                        retrieved = download_file(input_loc)
-                        # Wait a bit before trying the next download.
-                        # Seems to reduce the occurrence of timeouts
-                        # when downloading from AWS
-                        time.sleep(15)
-
-                    logging.debug(f"Retrieved status: {retrieved}")
-                    if not retrieved:
-                        unavailable.append(input_loc)
-                        # Go on to the next location if the first file
-                        # isn't found here.
-                        break
+                else:
+                    self._semaphores[host] = _NoLimit()
+            return self._semaphores[host]
+
+
+class _NoLimit:
+
+    """A stand-in for a semaphore when no per-host cap is set."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def retrieve_file(input_loc, target_path, method="disk", cache=None, **kwargs):
+
+    """Copy or download a single file into target_path, depending on the
+    method. When a FileCache is provided, it is consulted first and
+    populated after a successful retrieval. Keyword args are passed on to
+    download_file. Return a boolean value reflecting the state of the
+    retrieval."""
+
+    if cache is not None:
+        # A subset of a GRIB2 file is a different file than the whole
+        source = input_loc
+        if kwargs.get("grib2_filter"):
+            source = f"{input_loc}#{json.dumps(kwargs['grib2_filter'], sort_keys=True)}"
+        return cache.fetch(
+            source,
+            target_path,
+            lambda: retrieve_file(input_loc, target_path, method, **kwargs),
+        )
+
+    if method == "disk":
+        return copy_file(input_loc, target_path, **kwargs)
+
+    if method == "download":
+        return download_file(input_loc, target_path, **kwargs)
+
+    raise ValueError(f"Unknown retrieval method: {method}")
+
+
+def retrieve_files(
+    requests,
+    method="disk",
+    max_workers=1,
+    host_limits=None,
+    manifest=None,
+    progress=None,
+    **kwargs,
+):
+
+    """Retrieve a list of (input_loc, target_path) requests using a pool
+    of at most max_workers threads, each holding its host's semaphore
+    while it works. When a Manifest is provided, files it holds are not
+    retrieved again, and retrieved files are recorded in it under the
+    data_store keyword arg. Each file retrieved or skipped is reported
+    to the progress callback as a ProgressEvent. Other keyword args are
+    passed on to retrieve_file. Return a list of booleans in the same
+    order as the requests."""
+
+    host_limits = host_limits if host_limits is not None else HostLimits()
+    data_store = kwargs.pop("data_store", method)
+
+    def _retrieve(request):
+        input_loc, target_path = request
+        file_path = os.path.join(target_path, os.path.basename(input_loc))
+        if manifest is not None and manifest.is_valid(file_path):
+            TELEMETRY.record(
+                "file",
+                data_store=data_store,
+                source=input_loc,
+                path=file_path,
+                outcome="skipped",
+            )
+            if progress is not None:
+                progress(ProgressEvent("skipped", data_store, file_path))
+            return True
+        start = time.perf_counter()
+        with host_limits(input_loc):
+            retrieved = retrieve_file(input_loc, target_path, method, **kwargs)
+        TELEMETRY.record(
+            "file",
+            data_store=data_store,
+            source=input_loc,
+            path=file_path,
+            outcome="retrieved" if retrieved else "failed",
+            bytes=os.path.getsize(file_path) if os.path.isfile(file_path) else 0,
+            seconds=time.perf_counter() - start,
+        )
+        if retrieved and manifest is not None:
+            manifest.record(file_path, input_loc, data_store)
+        if retrieved and progress is not None:
+            progress(ProgressEvent("retrieved", data_store, file_path))
+        return retrieved
+
+    if max_workers is None or max_workers <= 1 or len(requests) <= 1:
+        return [_retrieve(request) for request in requests]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_retrieve, requests))
+
+
+# Mode of the directories of a FileCache: writable by its group, and
+# passing the group of the cache directory on to new directories, so that
+# all members of that group can add and evict entries
+FILE_CACHE_DIR_MODE = 0o2775
+
+
+class FileCache:
+
+    """A directory of retrieved files shared by all experiments and
+    cycles on a platform. Entries are keyed by the external model, the
+    data store, and the resolved path or url of the file, and are linked
+    into the staging directory of each task that asks for them.
+
+    Entries are added atomically under a per-entry lock, so that
+    concurrent tasks asking for the same file wait for one of them to
+    retrieve it instead of retrieving it twice. When a size limit is set,
+    the least recently used entries are evicted to stay under it.
+
+    The directories of the cache are created with dir_mode whatever the
+    umask, and the lock and last use files of each entry are writable by
+    everyone, so that the cache can be shared by several users."""
+
+    def __init__(
+        self,
+        cache_dir,
+        external_model,
+        data_store,
+        max_bytes=0,
+        dir_mode=FILE_CACHE_DIR_MODE,
+    ):
+        self.cache_dir = cache_dir
+        self.namespace = os.path.join(cache_dir, external_model, data_store)
+        self.data_store = data_store
+        self.max_bytes = max_bytes
+        self.dir_mode = dir_mode
+
+    def entry_path(self, source):
+
+        """Return the path of the cache entry for source."""
+
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        file_name = os.path.basename(source.split("#")[0].rstrip("/"))
+        return os.path.join(self.namespace, digest[:2], digest, file_name)
+
+    def makedirs(self, path):
+
+        """Create the directory path, and any missing parents, with
+        dir_mode."""
+
+        if os.path.isdir(path):
+            return
+        self.makedirs(os.path.dirname(path))
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            return
+        os.chmod(path, self.dir_mode)
+
+    @staticmethod
+    def open_shared(path):
+
+        """Open the file at path for reading, creating it writable by
+        everyone if needed. Return its file descriptor."""
+
+        fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o666)
+        # Only the owner may change the mode, and the umask may have
+        # taken some of it away
+        with contextlib.suppress(OSError):
+            os.fchmod(fd, 0o666)
+        return fd
+
+    @contextlib.contextmanager
+    def lock(self, source):
+
+        """Hold an exclusive lock on the cache entry for source."""
+
+        entry_dir = os.path.dirname(self.entry_path(source))
+        self.makedirs(entry_dir)
+        fd = self.open_shared(os.path.join(entry_dir, ".lock"))
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
 
-                    # If retrieved, reset unavailable
-                    unavailable = []
-                if not unavailable:
-                    # Start on the next fcst hour if all files were
-                    # found from a loc/template combo
+    def get(self, source, target_path):
+
+        """Link the cached copy of source into target_path, and mark it
+        as recently used. Return whether the cache held a copy; an entry
+        evicted meanwhile counts as a miss."""
+
+        entry = self.entry_path(source)
+        try:
+            destination = link_into(entry, target_path)
+        except FileNotFoundError:
+            return False
+
+        # The last use is marked on a file of its own, since only the
+        # owner of an entry may set its times
+        with contextlib.suppress(OSError):
+            fd = self.open_shared(os.path.join(os.path.dirname(entry), ".used"))
+            try:
+                os.utime(fd)
+            finally:
+                os.close(fd)
+
+        logging.info(f"Found {source} in cache: {entry}")
+        TELEMETRY.record(
+            "cache_hit",
+            data_store=self.data_store,
+            source=source,
+            bytes=os.path.getsize(destination),
+        )
+        return True
+
+    def put(self, source, local_file):
+
+        """Add a retrieved file to the cache under source. The file is
+        hardlinked into the cache when possible, or copied otherwise, and
+        renamed into place so that a partial entry is never visible.
+        Copies are made read-only; a hardlink keeps the mode of the file,
+        which is still in use where it was retrieved."""
+
+        entry = self.entry_path(source)
+        self.makedirs(os.path.dirname(entry))
+        tmp_entry = f"{entry}.tmp{os.getpid()}"
+        try:
+            os.link(local_file, tmp_entry)
+        except OSError:
+            shutil.copy2(local_file, tmp_entry)
+            os.chmod(tmp_entry, 0o444)
+        os.replace(tmp_entry, entry)
+        logging.info(f"Added {source} to cache: {entry}")
+
+    def fetch(self, source, target_path, retrieve):
+
+        """Link source into target_path from the cache, or call retrieve()
+        to place it there and add it to the cache. Return a boolean value
+        reflecting the state of the retrieval."""
+
+        if self.get(source, target_path):
+            return True
+
+        with self.lock(source):
+            # Another task may have added it while we waited
+            if self.get(source, target_path):
+                return True
+            if not retrieve():
+                return False
+            self.put(
+                source,
+                os.path.join(target_path, os.path.basename(self.entry_path(source))),
+            )
+
+        self.evict()
+        return True
+
+    def evict(self):
+
+        """Remove the least recently used entries from the whole cache
+        until it fits in max_bytes. Only one process evicts at a time.
+        Files linked from the cache are hardlinks or copies, so removing
+        an entry does not take them away from the tasks using them."""
+
+        if not self.max_bytes:
+            return
+
+        self.makedirs(self.cache_dir)
+        fd = self.open_shared(os.path.join(self.cache_dir, ".evict.lock"))
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            entries = []
+            for root, dir_names, file_names in os.walk(self.cache_dir):
+                dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+                for file_name in file_names:
+                    if file_name.startswith(".") or ".tmp" in file_name:
+                        continue
+                    entry = os.path.join(root, file_name)
+                    try:
+                        stat = os.stat(entry)
+                    except FileNotFoundError:
+                        continue
+                    last_use = stat.st_mtime
+                    with contextlib.suppress(FileNotFoundError):
+                        last_use = max(
+                            last_use, os.path.getmtime(os.path.join(root, ".used"))
+                        )
+                    entries.append((last_use, stat.st_size, entry))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes:
                     break
+                logging.info(f"Evicting {entry} from cache")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry)
+                total -= size
+        finally:
+            os.close(fd)
+
+
+def link_into(source, target_path):
+
+    """Hardlink source into the target_path directory, or copy it when
+    the two are on different file systems, so that the file stays in
+    place whatever happens to source. Any file already there with the
+    same name is replaced."""
+
+    destination = os.path.join(target_path, os.path.basename(source))
+    if os.path.lexists(destination):
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            return destination
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        # A missing source is for the caller to handle
+        raise
+    except OSError:
+        shutil.copyfile(source, destination)
+    return destination
 
-    os.chdir(orig_path)
-    return unavailable
+
+# Name of the manifest written to each output directory
+MANIFEST_FN = ".retrieve_data_manifest.json"
+
+# Leading bytes of the netCDF classic, 64-bit offset, CDF-5, and
+# netCDF-4 (HDF5) formats
+NETCDF_SIGNATURES = (b"CDF\x01", b"CDF\x02", b"CDF\x05", b"\x89HDF\r\n\x1a\n")
+
+
+def check_file_format(file_path):
+
+    """Make a cheap check that a retrieved file is complete. GRIB files
+    must end with the "7777" end marker of their last message, and
+    netCDF files must start with a netCDF or HDF5 signature. Other files
+    only need to be non-empty. Return a boolean value reflecting the
+    result of the check."""
+
+    with open(file_path, "rb") as file:
+        head = file.read(8)
+        if not head:
+            return False
+        if head.startswith(b"GRIB"):
+            file.seek(-4, os.SEEK_END)
+            return file.read(4) == b"7777"
+        if file_path.endswith(".nc"):
+            return head.startswith(NETCDF_SIGNATURES)
+    return True
+
+
+def sha256sum(file_path):
+
+    """Return the hex SHA-256 digest of a file."""
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HTTP_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+
+    """Records the files retrieved into each output directory in a
+    manifest file there, as they land. Each entry holds the size,
+    modification time, source, and data store of a file, and optionally
+    its checksum.
+
+    When a task is rerun, files that still match their entry, and pass a
+    check of their format, are not retrieved again."""
+
+    def __init__(self, checksum=False):
+        self.checksum = checksum
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def _entries(self, output_path):
+
+        """Return the entries of the manifest of output_path, loading it
+        on first use. Call with the lock held."""
+
+        if output_path not in self._manifests:
+            manifest_fp = os.path.join(output_path, MANIFEST_FN)
+            entries = {}
+            if os.path.exists(manifest_fp):
+                try:
+                    with open(manifest_fp, "r") as manifest_file:
+                        entries = json.load(manifest_file).get("files", {})
+                except ValueError:
+                    logging.warning(f"Ignoring unreadable manifest {manifest_fp}")
+            self._manifests[output_path] = entries
+        return self._manifests[output_path]
+
+    def is_valid(self, file_path):
+
+        """Return whether file_path is a complete file recorded in the
+        manifest of its directory. A recorded file that fails the checks
+        is removed, so that it is retrieved whole instead of being resumed
+        like a partial download."""
+
+        output_path, file_name = os.path.split(file_path)
+        with self._lock:
+            entry = self._entries(output_path).get(file_name)
+        if entry is None or not os.path.exists(file_path):
+            return False
+
+        stat = os.stat(file_path)
+        damage = None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            damage = "changed since it was retrieved"
+        elif not check_file_format(file_path):
+            damage = "is incomplete"
+        elif self.checksum and entry.get("sha256"):
+            if sha256sum(file_path) != entry["sha256"]:
+                damage = "does not match its checksum"
+        if damage:
+            logging.info(f"{file_path} {damage}. Retrieving it again.")
+            os.remove(file_path)
+            return False
+
+        logging.info(f"Already retrieved {file_path} from {entry['data_store']}")
+        return True
+
+    def record(self, file_path, source, data_store):
+
+        """Add a retrieved file to the manifest of its directory, and
+        rewrite the manifest file."""
+
+        output_path, file_name = os.path.split(file_path)
+        stat = os.stat(file_path)
+        entry = dict(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            source=source,
+            data_store=data_store,
+        )
+        if self.checksum:
+            entry["sha256"] = sha256sum(file_path)
+
+        with self._lock:
+            entries = self._entries(output_path)
+            entries[file_name] = entry
+            manifest_fp = os.path.join(output_path, MANIFEST_FN)
+            tmp_fp = f"{manifest_fp}.tmp{os.getpid()}"
+            with open(tmp_fp, "w") as manifest_file:
+                json.dump({"files": entries}, manifest_file, indent=2, sort_keys=True)
+            os.replace(tmp_fp, manifest_fp)
 
 
-def hsi_single_file(file_path, mode="ls"):
+def hsi_single_file(file_path, mode="ls", cwd=None):
 
     """Call hsi as a subprocess for Python and return information about
     whether the file_path was found.
@@ -417,6 +2171,8 @@ def hsi_single_file(file_path, mode="ls"):
         file_path    path on HPSS
         mode         the hsi command to run. ls is default. may also
                      pass "get" to retrieve the file path
+        cwd          directory in which to run hsi. Defaults to the
+                     current working directory.
 
     """
     cmd = f"hsi {mode} {file_path}"
@@ -426,165 +2182,1247 @@ def hsi_single_file(file_path, mode="ls"):
         subprocess.run(
             cmd,
             check=True,
+            cwd=cwd,
+            shell=True,
+        )
+    except subprocess.CalledProcessError:
+        logging.warning(f"{file_path} is not available!")
+        return ""
+
+    return file_path
+
+
+# Existence of HPSS paths checked so far in this run
+_HSI_EXISTS = {}
+_HSI_EXISTS_LOCK = threading.Lock()
+_HSI_STAT = {}
+
+# Seconds between checks of whether a running hsi session was cancelled
+HSI_CANCEL_POLL = 0.1
+
+
+def run_hsi(cmd, cancel=None):
+
+    """Run an hsi command in its own process group, and return its
+    output. Once the cancel event, if any, is set, the whole process
+    group is killed and ProbeCancelled is raised."""
+
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=True,
+        start_new_session=True,
+        text=True,
+    ) as proc:
+        while True:
+            try:
+                return proc.communicate(
+                    timeout=None if cancel is None else HSI_CANCEL_POLL
+                )
+            except subprocess.TimeoutExpired:
+                if not cancel.is_set():
+                    continue
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            raise ProbeCancelled(cmd)
+
+
+def hsi_probe(file_paths, cancel=None):
+
+    """Check which of a list of HPSS paths exist by issuing an ls command
+    for each of them in a single hsi session, so that the HPSS login
+    latency is paid only once. Results are remembered for the rest of
+    the run, so paths that have been checked before are not checked
+    again.
+
+    The size and modification time fields listed for each existing path
+    are remembered too, and can be looked up with hsi_stat.
+
+    The session is killed, and ProbeCancelled raised, once the cancel
+    event, if any, is set. The lock on the remembered results is not
+    held while hsi runs, so a session that is still running does not
+    hold up lookups of paths checked before.
+
+    Return a dict mapping each path to a boolean value reflecting its
+    existence."""
+
+    with _HSI_EXISTS_LOCK:
+        unknown = [
+            file_path
+            for file_path in dict.fromkeys(file_paths)
+            if file_path not in _HSI_EXISTS
+        ]
+
+    if unknown:
+        with tempfile.NamedTemporaryFile("w", suffix=".hsi") as cmd_file:
+            cmd_file.write("".join(f"ls -P {path}\n" for path in unknown))
+            cmd_file.flush()
+
+            cmd = f"hsi -P in {cmd_file.name}"
+            logging.info(f"Checking {len(unknown)} paths with command \n {cmd}")
+            start = time.perf_counter()
+            stdout, stderr = run_hsi(cmd, cancel)
+            TELEMETRY.record(
+                "hpss",
+                host="hpss",
+                command="hsi_ls",
+                paths=len(unknown),
+                seconds=time.perf_counter() - start,
+            )
+
+        # Existing files are listed in parseable lines like
+        # FILE <tab> /path/to/file <tab> size ...
+        # Missing files only produce error messages.
+        found = {}
+        for line in (stdout + stderr).splitlines():
+            fields = line.split()
+            if len(fields) > 1 and fields[0] == "FILE":
+                found[os.path.normpath(fields[1])] = tuple(fields[2:])
+
+        with _HSI_EXISTS_LOCK:
+            for file_path in unknown:
+                _HSI_EXISTS[file_path] = os.path.normpath(file_path) in found
+                if not _HSI_EXISTS[file_path]:
+                    logging.warning(f"{file_path} is not available!")
+                    continue
+                _HSI_STAT[file_path] = found[os.path.normpath(file_path)]
+
+    with _HSI_EXISTS_LOCK:
+        return {file_path: _HSI_EXISTS[file_path] for file_path in file_paths}
+
+
+def hsi_stat(file_path):
+
+    """Return the fields hsi lists after the path of an existing file on
+    HPSS, such as its size and modification time, as a tuple. They change
+    whenever the file is rewritten. Return None if the file does not
+    exist."""
+
+    if not hsi_probe([file_path])[file_path]:
+        return None
+    with _HSI_EXISTS_LOCK:
+        return _HSI_STAT.get(file_path)
+
+
+def extract_archive_files(existing_archive, targets, **kwargs):
+
+    """Extract a list of files from an archive on HPSS and place each of
+    them directly in its output path.
+
+    Each call works in its own temporary directory instead of changing
+    the process working directory, so extractions from several archives
+    can run at the same time. Depending on the archive format (zip or
+    tar), it will either pull the entire file and unzip it, or pull
+    individual files from a tar file with htar.
+
+    Arguments:
+      existing_archive  path of the archive on HPSS
+      targets           dict mapping the paths of the files inside the
+                        archive to the directories they are moved to
+
+    Keyword args:
+      archive_format  tar (default) or zip
+      sessions        a semaphore held while talking to HPSS
+
+    Return the set of source paths that were not in the archive.
+    """
+
+    archive_format = kwargs.get("archive_format", "tar")
+    sessions = kwargs.get("sessions") or contextlib.nullcontext()
+    source_paths = list(targets)
+
+    work_dir = tempfile.mkdtemp(prefix=".extract_", dir=next(iter(targets.values())))
+    try:
+        with sessions:
+            if archive_format == "zip":
+
+                # Get the entire file from HPSS
+                existing_archive = hsi_single_file(
+                    existing_archive, mode="get", cwd=work_dir
+                )
+
+                # Grab only the necessary files from the archive
+                cmd = f'unzip -o {os.path.basename(existing_archive)} {" ".join(source_paths)}'
+
+            else:
+                cmd = f'htar -xvf {existing_archive} {" ".join(source_paths)}'
+
+            logging.info(f"Running command \n {cmd}")
+            start = time.perf_counter()
+            result = subprocess.run(
+                cmd,
+                check=False,
+                cwd=work_dir,
+                shell=True,
+            )
+            TELEMETRY.record(
+                "hpss",
+                host="hpss",
+                command=f"{archive_format}_extract",
+                archive=existing_archive,
+                members=len(source_paths),
+                seconds=time.perf_counter() - start,
+                returncode=result.returncode,
+            )
+            if result.returncode != 0:
+                logging.warning(
+                    f"Command exited with status {result.returncode}: {cmd}"
+                )
+
+        # Move the files that were extracted out of the archive's
+        # internal directories.
+        unavailable = set()
+        for source_path, output_path in targets.items():
+            local_file_path = os.path.join(work_dir, source_path.lstrip("/"))
+            if not os.path.exists(local_file_path):
+                logging.info(f"File does not exist: {local_file_path}")
+                unavailable.add(source_path)
+                continue
+            expected_output_loc = os.path.join(
+                output_path, os.path.basename(source_path)
+            )
+            logging.info(f"Moving {local_file_path} to {expected_output_loc}")
+            shutil.move(local_file_path, expected_output_loc)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return unavailable
+
+
+def htar_list(archive, sessions=None):
+
+    """List the files in a tar archive on HPSS with htar -tf.
+
+    Return the set of their paths as htar lists them, so that they can
+    be passed back to htar -xvf, or None if the archive could not be
+    listed."""
+
+    sessions = sessions or contextlib.nullcontext()
+    cmd = f"htar -tf {archive}"
+    logging.info(f"Running command \n {cmd}")
+    with sessions:
+        start = time.perf_counter()
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            check=False,
             shell=True,
+            text=True,
+        )
+    TELEMETRY.record(
+        "hpss",
+        host="hpss",
+        command="tar_list",
+        archive=archive,
+        seconds=time.perf_counter() - start,
+        returncode=result.returncode,
+    )
+    if result.returncode != 0:
+        logging.warning(f"Command exited with status {result.returncode}: {cmd}")
+        return None
+
+    # Files are listed in lines like
+    # HTAR: -rw-r--r--  user/group  size yyyy-mm-dd hh:mm  ./path/to/file
+    # followed by a summary of the listing.
+    members = set()
+    for line in result.stdout.splitlines():
+        fields = line.split(maxsplit=6)
+        if len(fields) == 7 and fields[0] == "HTAR:" and fields[1].startswith("-"):
+            members.add(fields[6])
+    return members
+
+
+class ArchiveIndex:
+
+    """A directory of the listings of tar archives on HPSS, shared by all
+    experiments, cycles and tasks on a platform, so that each archive is
+    listed with htar -tf only once.
+
+    Listings are keyed by the path of the archive, and are only used
+    while the size and modification time hsi reports for the archive
+    match the ones it had when it was listed, and were written in the
+    current FORMAT."""
+
+    # Bumped whenever the way members are recorded changes
+    FORMAT = 2
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+
+    def entry_path(self, archive):
+
+        """Return the path of the listing of archive."""
+
+        digest = hashlib.sha256(archive.encode("utf-8")).hexdigest()
+        return os.path.join(self.index_dir, digest[:2], f"{digest}.json")
+
+    @contextlib.contextmanager
+    def lock(self, archive):
+
+        """Hold an exclusive lock on the listing of archive. Archives are
+        still listed, without being indexed, when the index directory
+        cannot be written to."""
+
+        entry = self.entry_path(archive)
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            lock_file = open(
+                f"{entry}.lock", "w"
+            )  # pylint: disable=consider-using-with
+        except OSError as err:
+            logging.warning(f"Could not lock the listing of {archive}: {err}")
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, archive, stat):
+
+        """Return the listed members of archive if its listing was made
+        when the archive had stat, or None."""
+
+        try:
+            with open(self.entry_path(archive)) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        if (
+            entry.get("format") != self.FORMAT
+            or entry.get("archive") != archive
+            or entry.get("stat") != list(stat)
+        ):
+            return None
+        return set(entry["members"])
+
+    def put(self, archive, stat, members):
+
+        """Store the listing of archive. The listing is renamed into
+        place so that a partial one is never visible."""
+
+        entry = self.entry_path(archive)
+        tmp_entry = f"{entry}.tmp{os.getpid()}"
+        try:
+            with open(tmp_entry, "w") as entry_file:
+                json.dump(
+                    {
+                        "format": self.FORMAT,
+                        "archive": archive,
+                        "stat": list(stat),
+                        "members": sorted(members),
+                    },
+                    entry_file,
+                )
+            os.replace(tmp_entry, entry)
+        except OSError as err:
+            logging.warning(f"Could not store the listing of {archive}: {err}")
+
+    def members(self, archive, sessions=None):
+
+        """Return the set of paths of the files in archive, as htar lists them,
+        listing it with htar only if it has not been listed since it was
+        last changed. Concurrent tasks asking for the same listing wait
+        for one of them to make it. Return None if the archive could not
+        be listed."""
+
+        stat = hsi_stat(archive)
+        if stat is None:
+            return None
+
+        members = self.get(archive, stat)
+        if members is not None:
+            logging.debug(f"Found the listing of {archive} in the index")
+            return members
+
+        with self.lock(archive):
+            # Another task may have listed it while we waited
+            members = self.get(archive, stat)
+            if members is None:
+                members = htar_list(archive, sessions=sessions)
+                if members is not None:
+                    self.put(archive, stat, members)
+        return members
+
+
+def hpss_archive_files(cla, jobs, file_names, existing_archives, **kwargs):
+
+    # pylint: disable=too-many-locals
+
+    """Extract the files of a set of jobs from the existing archives that
+    hold all of them, so that each archive is opened only once. A job is
+    a (cycle date, ensemble member, ensemble group) tuple, with member -1
+    for a deterministic model.
+
+    When an ArchiveIndex is given, the listings of tar archives are used
+    to find the archive and internal directory holding each file, and
+    each archive is extracted from once, with only the files it holds.
+    Files that no listing holds are unavailable without extracting
+    anything. Otherwise, the archive_internal_dirs are tried in order
+    for any files that have not been found yet. Within each, all archives
+    are extracted from at the same time, and a file is only unavailable
+    if none of the archives held it.
+
+    Keyword args:
+      archive_format         tar (default) or zip
+      archive_internal_dirs  list of templates of paths inside the archive
+      cache                  a FileCache to consult before extracting
+      data_store             the name of the data store recorded in the
+                             manifest
+      index                  an ArchiveIndex of the listings of archives
+      manifest               a Manifest of the files already retrieved
+      progress               a callable that is passed a ProgressEvent
+                             for each file extracted or skipped
+      sessions               a semaphore held while talking to HPSS
+
+    Return a list of (cycle date, member, file name) tuples for the files
+    that could not be found.
+    """
+
+    archive_format = kwargs.get("archive_format", "tar")
+    archive_internal_dirs = kwargs.get("archive_internal_dirs", [""])
+    cache = kwargs.get("cache")
+    data_store = kwargs.get("data_store", "hpss")
+    index = kwargs.get("index")
+    manifest = kwargs.get("manifest")
+    progress = kwargs.get("progress")
+
+    output_paths = {}
+    for cycle_date, mem, ens_group in jobs:
+        output_path = fill_template(cla.output_path, cycle_date, mem=mem)
+        output_paths[(cycle_date, mem, ens_group)] = create_target_path(output_path)
+        logging.info(f"Will place files in {output_path}")
+
+    # The paths of the files in the archives, filled in for all of the
+    # jobs at once, by internal directory
+    source_paths = {}
+    for archive_internal_dir in archive_internal_dirs:
+        filled = [
+            compile_template(os.path.join(archive_internal_dir, file_name)).expand(
+                sorted({job[0] for job in jobs}),
+                cla.fcst_hrs,
+                sorted({job[1] for job in jobs}, key=str),
+                sorted({job[2] for job in jobs}, key=str),
+            )
+            for file_name in file_names
+        ]
+        for job in jobs:
+            cycle_date, mem, ens_group = job
+            source_paths[job, archive_internal_dir] = [
+                paths[cycle_date, fcst_hr, mem, ens_group]
+                for fcst_hr in cla.fcst_hrs
+                for paths in filled
+            ]
+
+    # Files in the cache are keyed by the archives they come from. Hold
+    # the lock on each job's files in those archives while extracting so
+    # concurrent tasks don't extract the same files. Locks are taken in
+    # a fixed order so tasks holding several of them can't deadlock.
+    archive_key = "|".join(sorted(existing_archives))
+
+    def cache_key(job, file_name=""):
+        cycle_date, mem, _ = job
+        return f"{archive_key}/{cycle_date:%Y%m%d%H}/mem{mem}/{file_name}"
+
+    def landed(job, file_name, source, kind="retrieved"):
+        file_path = os.path.join(output_paths[job], file_name)
+        TELEMETRY.record(
+            "file",
+            data_store=data_store,
+            source=source,
+            path=file_path,
+            outcome=kind,
+            bytes=os.path.getsize(file_path) if kind == "retrieved" else 0,
+        )
+        if manifest is not None and kind == "retrieved":
+            manifest.record(file_path, source, data_store)
+        if progress is not None:
+            progress(ProgressEvent(kind, data_store, file_path, job[0]))
+
+    with contextlib.ExitStack() as cache_locks:
+        if cache is not None:
+            for key in sorted(cache_key(job) for job in jobs):
+                cache_locks.enter_context(cache.lock(key))
+
+        needed = {
+            (job, os.path.basename(source_path))
+            for job in jobs
+            for source_path in source_paths[job, archive_internal_dirs[0]]
+        }
+        if manifest is not None:
+            present = {
+                (job, file_name)
+                for job, file_name in needed
+                if manifest.is_valid(os.path.join(output_paths[job], file_name))
+            }
+            for job, file_name in present:
+                landed(job, file_name, None, kind="skipped")
+            needed -= present
+        if cache is not None:
+            cached = {
+                (job, file_name)
+                for job, file_name in needed
+                if cache.get(cache_key(job, file_name), output_paths[job])
+            }
+            for job, file_name in cached:
+                landed(job, file_name, cache_key(job, file_name))
+            needed -= cached
+
+        def extract(plan):
+            # Extract the files planned for each archive at the same
+            # time. A file is available if any archive held it.
+            with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+                unavailable = list(
+                    pool.map(
+                        lambda item: extract_archive_files(
+                            item[0],
+                            {
+                                source_path: output_paths[job]
+                                for source_path, job in item[1].items()
+                            },
+                            archive_format=archive_format,
+                            sessions=kwargs.get("sessions"),
+                        ),
+                        plan.items(),
+                    )
+                )
+
+            for (archive, source_jobs), missing in zip(plan.items(), unavailable):
+                for source_path, job in source_jobs.items():
+                    file_name = os.path.basename(source_path)
+                    if source_path in missing or (job, file_name) not in needed:
+                        continue
+                    needed.discard((job, file_name))
+                    landed(job, file_name, f"{archive}:{source_path}")
+                    if cache is not None:
+                        cache.put(
+                            cache_key(job, file_name),
+                            os.path.join(output_paths[job], file_name),
+                        )
+
+        # With the listings of the archives, each file is extracted only
+        # from the archive and internal directory that hold it, in a
+        # single extraction per archive.
+        listings = None
+        if index is not None and archive_format == "tar" and needed:
+            with ThreadPoolExecutor(max_workers=len(existing_archives)) as pool:
+                listings = dict(
+                    zip(
+                        existing_archives,
+                        pool.map(
+                            lambda archive: index.members(
+                                archive, sessions=kwargs.get("sessions")
+                            ),
+                            existing_archives,
+                        ),
+                    )
+                )
+            if any(members is None for members in listings.values()):
+                listings = None
+            else:
+                listings = {
+                    archive: {os.path.normpath(member) for member in members}
+                    for archive, members in listings.items()
+                }
+
+        if listings is not None:
+            plan = {}
+            planned = set()
+            for archive_internal_dir_tmpl in archive_internal_dirs:
+                for job in jobs:
+                    for source_path in source_paths[job, archive_internal_dir_tmpl]:
+                        key = (job, os.path.basename(source_path))
+                        if key not in needed or key in planned:
+                            continue
+                        for archive in existing_archives:
+                            if os.path.normpath(source_path) in listings[archive]:
+                                plan.setdefault(archive, {})[source_path] = job
+                                planned.add(key)
+                                break
+            if plan:
+                extract(plan)
+
+        # Otherwise the archive_internal_dirs are tried in order, from
+        # all of the archives at once.
+        else:
+            for archive_internal_dir_tmpl in archive_internal_dirs:
+                if not needed:
+                    break
+
+                source_jobs = {
+                    source_path: job
+                    for job in jobs
+                    for source_path in source_paths[job, archive_internal_dir_tmpl]
+                    if (job, os.path.basename(source_path)) in needed
+                }
+                extract({archive: source_jobs for archive in existing_archives})
+
+    if cache is not None:
+        cache.evict()
+
+    for job, file_name in needed:
+        TELEMETRY.record(
+            "file",
+            data_store=data_store,
+            path=os.path.join(output_paths[job], file_name),
+            outcome="failed",
+        )
+
+    return sorted((cycle_date, mem, name) for (cycle_date, mem, _), name in needed)
+
+
+def hpss_requested_files(cla, file_names, store_specs, **kwargs):
+
+    # pylint: disable=too-many-locals
+
+    """This function interacts with the "hpss" protocol in a provided
+    data store specs file to download a set of files requested by the
+    user for every cycle in cla.cycle_dates. Depending on the type of
+    archive file (zip or tar), it will either pull the entire file and
+    unzip it, or attempt to pull individual files from a tar file.
+
+    The files of every cycle, ensemble group and member are planned
+    first, and grouped by the archives that hold them, so that each
+    archive is opened only once. The groups are extracted at the same
+    time, and each extraction works in its own temporary directory that
+    is removed once the files have been moved into the output
+    directories.
+
+    This function exepcts that the output directory exists and is
+    writable.
+
+    Keyword args:
+      cache     a FileCache to consult before extracting files. Files it
+                already holds are linked from it instead of being
+                extracted, and extracted files are added to it.
+      data_store  the name of the data store recorded in the manifest
+      index     an ArchiveIndex of the listings of tar archives, used to
+                extract each file only from the archive that holds it
+      manifest  a Manifest of the files already retrieved. Files it
+                holds are not extracted again.
+      progress  a callable that is passed a ProgressEvent for each file
+                extracted or skipped
+      sessions  a semaphore held while talking to HPSS, to limit the
+                number of concurrent HPSS sessions
+
+    Returns:
+      unavailable  a dict mapping each cycle date that is missing files
+                   to a list of the archives or files that could not be
+                   retrieved. Empty when all files were retrieved.
+    """
+
+    archive_paths, archive_file_names = get_archive_specs(cla, store_specs)
+    ens_groups = get_ens_groups(cla.members)
+
+    logging.debug(
+        f"Will try to look for: " f" {list(zip(archive_paths, archive_file_names))}"
+    )
+
+    # Check the archives of every cycle and ensemble group in one hsi
+    # session
+    hsi_probe(
+        [
+            file_path
+            for cycle_date in cla.cycle_dates
+            for ens_group in ens_groups
+            for item in archive_candidates(
+                archive_paths,
+                archive_file_names,
+                cycle_date,
+                ens_group,
+            )
+            for file_path in item
+        ]
+    )
+
+    unavailable = {}
+    plan = {}
+    for cycle_date in cla.cycle_dates:
+        for ens_group, members in ens_groups.items():
+            existing_archives, which_archive = find_archive_files(
+                archive_paths,
+                archive_file_names,
+                cycle_date,
+                ens_group=ens_group,
+            )
+
+            if not existing_archives:
+                logging.warning(
+                    f"No archive files were found for {cycle_date:%Y%m%d%H}!"
+                )
+                unavailable.setdefault(cycle_date, []).extend(
+                    archive
+                    for item in archive_candidates(
+                        archive_paths,
+                        archive_file_names,
+                        cycle_date,
+                        ens_group,
+                    )
+                    for archive in item
+                )
+                continue
+
+            # which_archive matters for choosing the correct file names
+            # within, but we can safely just try all options for the
+            # archive_internal_dir
+            logging.debug(f"Found existing archives: {existing_archives}")
+            logging.debug(f"Checking archive number {which_archive} in list.")
+            plan.setdefault(tuple(existing_archives.values()), []).extend(
+                (cycle_date, mem, ens_group) for mem in members
+            )
+
+    if not plan:
+        return unavailable
+
+    logging.info(f"Files in archive are named: {file_names}")
+
+    archive_internal_dirs = store_specs.get("archive_internal_dir", [""])
+    if isinstance(archive_internal_dirs, dict):
+        archive_internal_dirs = archive_internal_dirs.get(cla.anl_or_fcst, [""])
+
+    with ThreadPoolExecutor(
+        max_workers=min(len(plan), max(cla.max_hpss_sessions, 1))
+    ) as pool:
+        missing = pool.map(
+            lambda item: hpss_archive_files(
+                cla,
+                item[1],
+                file_names,
+                list(item[0]),
+                archive_format=store_specs.get("archive_format", "tar"),
+                archive_internal_dirs=archive_internal_dirs,
+                cache=kwargs.get("cache"),
+                data_store=kwargs.get("data_store", "hpss"),
+                index=kwargs.get("index"),
+                manifest=kwargs.get("manifest"),
+                progress=kwargs.get("progress"),
+                sessions=kwargs.get("sessions"),
+            ),
+            plan.items(),
+        )
+        for cycle_date, mem, file_name in (item for items in missing for item in items):
+            output_path = fill_template(cla.output_path, cycle_date, mem=mem)
+            unavailable.setdefault(cycle_date, []).append(
+                os.path.join(output_path, file_name)
+            )
+
+    for cycle_date, files in unavailable.items():
+        logging.warning(
+            f"Files not found for {cycle_date:%Y%m%d%H}: {sorted(set(files))}"
         )
-    except subprocess.CalledProcessError:
-        logging.warning(f"{file_path} is not available!")
-        return ""
+    return unavailable
 
-    return file_path
 
+# The bytes read from the end of a zip archive to find its central
+# directory: the end of central directory record, with the longest
+# comment allowed, and the zip64 locator and record
+ZIP_TAIL_BYTES = 22 + 65535 + 20 + 56
+
+# The bytes read beyond the size a member of a zip archive is expected to
+# take, in case its local header has a longer extra field than its
+# central directory entry
+ZIP_HEADER_SLACK = 1024
+
+# The bytes read at once when reading outside the prefetched parts of a
+# RangeReader
+RANGE_READAHEAD = 64 * 1024
+
+
+class RangeReader(io.RawIOBase):
+
+    """A read-only, seekable file of a known size whose bytes are read on
+    demand with read_range(first, last). read_range returns a tuple of
+    the offset of the bytes it got and the bytes, which must cover first
+    to last, or None when they are unavailable. It may return more, as
+    when a server sends the whole file instead of a range.
+
+    The bytes read are kept until clear() is called, so reads that fall
+    within them make no more requests. prefetch() reads the spans that
+    are about to be read in a request each."""
+
+    def __init__(self, read_range, size):
+        super().__init__()
+        self.read_range = read_range
+        self.size = size
+        self.position = 0
+        self.requests = 0
+        self.spans = []
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def clear(self):
+
+        """Forget the bytes read so far, to free their memory, unless
+        they are the whole file."""
+
+        self.spans = [
+            (offset, data)
+            for offset, data in self.spans
+            if not offset and len(data) >= self.size
+        ]
+
+    def prefetch(self, first, last):
+
+        """Read the bytes first to last, unless they have been already."""
+
+        last = min(last, self.size - 1)
+        if first > last or self._span(first, last) is not None:
+            return
+        got = self.read_range(first, last)
+        self.requests += 1
+        if got is None:
+            raise OSError(f"Could not read bytes {first}-{last}")
+        offset, data = got
+        if offset > first or offset + len(data) <= last:
+            raise OSError(f"Received a short read of bytes {first}-{last}")
+        self.spans.append((offset, data))
+
+    def _span(self, first, last):
+        for offset, data in self.spans:
+            if offset <= first and last < offset + len(data):
+                return offset, data
+        return None
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        first, last = self.position, self.position + length - 1
+        if self._span(first, last) is None:
+            self.prefetch(first, max(last, first + RANGE_READAHEAD - 1))
+        offset, data = self._span(first, last)
+        buffer[:length] = data[first - offset : last - offset + 1]
+        self.position += length
+        return length
+
+
+def open_zip_url(url):
+
+    """Open a zip archive at url for reading without retrieving all of it.
+    Only its end and its central directory are read up front, with byte
+    range requests.
+
+    Return a ZipFile over a RangeReader, or None if the archive is not
+    available or is not a zip archive."""
+
+    pool = get_http_pool()
+    probed = pool.probe(url)
+    if probed is None or not probed[0]:
+        return None
+    size = probed[0]
+
+    reader = RangeReader(
+        lambda first, last: pool.read_range(url, first, last),
+        size,
+    )
+    try:
+        reader.prefetch(max(size - ZIP_TAIL_BYTES, 0), size - 1)
+        return zipfile.ZipFile(reader)
+    except (OSError, zipfile.BadZipFile) as err:
+        logging.warning(f"Could not open {url} as a zip archive: {err}")
+        return None
 
-def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1):
 
-    # pylint: disable=too-many-locals
+def extract_zip_members(archive, targets):
 
-    """This function interacts with the "hpss" protocol in a provided
-    data store specs file to download a set of files requested by the
-    user. Depending on the type of archive file (zip or tar), it will
-    either pull the entire file and unzip it, or attempt to pull
-    individual files from a tar file.
+    """Extract members of an open ZipFile, placing each of them directly
+    in its output directory. When the archive is read through a
+    RangeReader, each member is read with a single request for its local
+    header and data, and the bytes are dropped once it is extracted.
 
-    It cleans up local disk after files are deemed available to remove
-    any empty subdirectories that may still be present.
+    Arguments:
+      archive  a ZipFile
+      targets  dict mapping the paths of the members inside the archive
+               to the directories they are moved to
 
-    This function exepcts that the output directory exists and is
-    writable.
-    """
-    members = [-1] if members == -1 else members
+    Return the set of member paths that were not in the archive, or
+    could not be extracted."""
 
-    archive_paths = store_specs["archive_path"]
-    archive_paths = (
-        archive_paths if isinstance(archive_paths, list) else [archive_paths]
-    )
+    infos = {os.path.normpath(info.filename): info for info in archive.infolist()}
+    reader = archive.fp if isinstance(archive.fp, RangeReader) else None
 
-    # Could be a list of lists
-    archive_file_names = store_specs.get("archive_file_names", {})
-    if cla.file_type is not None:
-        archive_file_names = archive_file_names[cla.file_type]
+    unavailable = set()
+    for source_path, output_path in sorted(
+        targets.items(),
+        key=lambda item: getattr(
+            infos.get(os.path.normpath(item[0])), "header_offset", -1
+        ),
+    ):
+        info = infos.get(os.path.normpath(source_path))
+        if info is None:
+            logging.info(f"File does not exist: {source_path}")
+            unavailable.add(source_path)
+            continue
+
+        file_path = os.path.join(output_path, os.path.basename(source_path))
+        tmp_path = f"{file_path}.part"
+        try:
+            if reader is not None:
+                reader.prefetch(
+                    info.header_offset,
+                    info.header_offset
+                    + 30
+                    + len(info.orig_filename.encode("utf-8"))
+                    + len(info.extra)
+                    + info.compress_size
+                    + ZIP_HEADER_SLACK,
+                )
+            with archive.open(info) as member, open(tmp_path, "wb") as local_file:
+                shutil.copyfileobj(member, local_file, HTTP_CHUNK_SIZE)
+            os.replace(tmp_path, file_path)
+            logging.info(f"Extracted {source_path} to {file_path}")
+        except (OSError, zipfile.BadZipFile) as err:
+            logging.warning(f"Could not extract {source_path}: {err}")
+            unavailable.add(source_path)
+        finally:
+            if reader is not None:
+                reader.clear()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-    if isinstance(archive_file_names, dict):
-        archive_file_names = archive_file_names[cla.anl_or_fcst]
+    return unavailable
 
-    unavailable = {}
-    existing_archives = {}
 
-    logging.debug(
-        f"Will try to look for: " f" {list(zip(archive_paths, archive_file_names))}"
-    )
+def zip_requested_files(cla, file_names, store_specs, **kwargs):
 
-    existing_archives, which_archive = find_archive_files(
-        archive_paths,
-        archive_file_names,
-        cla.cycle_date,
-        ens_group=ens_group,
-    )
+    # pylint: disable=too-many-locals, too-many-statements
 
-    logging.debug(f"Found existing archives: {existing_archives}")
+    """Retrieve the requested files of every cycle in cla.cycle_dates from
+    zip archives in a download data store, reading only the parts of
+    each archive that hold them with byte range requests: the central
+    directory, and then the requested members. The archive_file_names of
+    the data store are found at its url, and the archive_internal_dirs
+    are tried in order for each file. Cycles are retrieved concurrently
+    when cla.max_workers is greater than 1.
 
-    if not existing_archives:
-        logging.warning("No archive files were found!")
-        unavailable["archive"] = list(zip(archive_paths, archive_file_names))
-        return unavailable
+    This function expects that the output directory exists and is
+    writeable.
 
-    logging.info(f"Files in archive are named: {file_names}")
+    Keyword args:
+      cache       a FileCache to consult before extracting
+      data_store  the name of the data store recorded in the manifest
+      manifest    a Manifest of the files already retrieved
+      progress    a callable that is passed a ProgressEvent for each file
+                  extracted or skipped
+
+    Returns:
+      unavailable  a dict mapping each cycle date that is missing files
+                   to a list of the files that could not be retrieved
+    """
 
+    cache = kwargs.get("cache")
+    data_store = kwargs.get("data_store", "download")
+    manifest = kwargs.get("manifest")
+    progress = kwargs.get("progress")
+
+    archive_urls, archive_file_names = get_archive_specs(cla, store_specs)
     archive_internal_dirs = store_specs.get("archive_internal_dir", [""])
     if isinstance(archive_internal_dirs, dict):
         archive_internal_dirs = archive_internal_dirs.get(cla.anl_or_fcst, [""])
+    file_names = file_names if isinstance(file_names, list) else [file_names]
+    members = cla.members or [""]
+
+    def landed(file_path, cycle_date, source, kind="retrieved"):
+        TELEMETRY.record(
+            "file",
+            data_store=data_store,
+            source=source,
+            path=file_path,
+            outcome=kind,
+            bytes=os.path.getsize(file_path) if kind == "retrieved" else 0,
+        )
+        if manifest is not None and kind == "retrieved":
+            manifest.record(file_path, source, data_store)
+        if progress is not None:
+            progress(ProgressEvent(kind, data_store, file_path, cycle_date))
 
+    def retrieve_cycle(cycle_date):
 
-    # which_archive matters for choosing the correct file names within,
-    # but we can safely just try all options for the
-    # archive_internal_dir
-    logging.debug(f"Checking archive number {which_archive} in list.")
-
-    for archive_internal_dir_tmpl in archive_internal_dirs:
+        # The output path of each file still needed, by its name template
+        # and forecast hour and member
+        needed = {}
         for mem in members:
-            archive_internal_dir = fill_template(
-                archive_internal_dir_tmpl,
-                cla.cycle_date,
-                mem=mem,
+            output_path = create_target_path(
+                fill_template(cla.output_path, cycle_date, mem=mem)
             )
-
-            output_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
-            logging.info(f"Will place files in {os.path.abspath(output_path)}")
-            orig_path = os.path.dirname(__file__)
-            logging.debug(f"CWD: {os.getcwd()}")
-            os.chdir(orig_path)
-
-            if mem != -1:
-                archive_internal_dir = fill_template(
-                    archive_internal_dir_tmpl,
-                    cla.cycle_date,
-                    mem=mem,
-                )
-                output_path = create_target_path(output_path)
-                logging.info(f"Will place files in {os.path.abspath(output_path)}")
-
-            os.chdir(output_path)
-
-            source_paths = []
             for fcst_hr in cla.fcst_hrs:
                 for file_name in file_names:
-                    source_paths.append(
-                        fill_template(
-                            os.path.join(archive_internal_dir, file_name),
-                            cla.cycle_date,
-                            fcst_hr=fcst_hr,
-                            mem=mem,
-                            ens_group=ens_group,
-                        )
+                    file_path = os.path.join(
+                        output_path,
+                        fill_template(file_name, cycle_date, fcst_hr=fcst_hr, mem=mem),
+                    )
+                    if manifest is not None and manifest.is_valid(file_path):
+                        landed(file_path, cycle_date, None, kind="skipped")
+                        continue
+                    needed[file_name, fcst_hr, mem] = file_path
+
+        for archives in archive_candidates(
+            archive_urls, archive_file_names, cycle_date, None
+        ):
+            for archive_url in archives:
+                if not needed:
+                    return []
+
+                # Files in the cache are keyed by the archive they come
+                # from
+                def cache_key(key, file_path, archive_url=archive_url):
+                    return f"{archive_url}/mem{key[2]}/{os.path.basename(file_path)}"
+
+                if cache is not None:
+                    for key, file_path in list(needed.items()):
+                        if cache.get(
+                            cache_key(key, file_path), os.path.dirname(file_path)
+                        ):
+                            landed(file_path, cycle_date, cache_key(key, file_path))
+                            del needed[key]
+                    if not needed:
+                        return []
+
+                archive = open_zip_url(archive_url)
+                if archive is None:
+                    continue
+                with archive:
+                    listed = {os.path.normpath(name) for name in archive.namelist()}
+                    targets = {}
+                    for key, file_path in needed.items():
+                        file_name, fcst_hr, mem = key
+                        for archive_internal_dir in archive_internal_dirs:
+                            member = fill_template(
+                                os.path.join(archive_internal_dir, file_name),
+                                cycle_date,
+                                fcst_hr=fcst_hr,
+                                mem=mem,
+                            )
+                            if os.path.normpath(member) in listed:
+                                targets[member] = (key, file_path)
+                                break
+
+                    missing = extract_zip_members(
+                        archive,
+                        {
+                            member: os.path.dirname(file_path)
+                            for member, (_, file_path) in targets.items()
+                        },
+                    )
+                    logging.info(
+                        f"Read {archive.fp.requests} byte ranges of {archive_url}"
                     )
 
-            expected = set(source_paths)
-            unavailable = {}
-            for existing_archive in existing_archives.values():
-                if store_specs.get("archive_format", "tar") == "zip":
+                for member, (key, file_path) in targets.items():
+                    if member in missing:
+                        continue
+                    del needed[key]
+                    landed(file_path, cycle_date, f"{archive_url}#{member}")
+                    if cache is not None:
+                        cache.put(cache_key(key, file_path), file_path)
+
+        for file_path in needed.values():
+            TELEMETRY.record(
+                "file", data_store=data_store, path=file_path, outcome="failed"
+            )
+        return sorted(needed.values())
+
+    unavailable = {}
+    with ThreadPoolExecutor(max_workers=max(cla.max_workers, 1)) as pool:
+        for cycle_date, missing in zip(
+            cla.cycle_dates, pool.map(retrieve_cycle, cla.cycle_dates)
+        ):
+            if missing:
+                unavailable[cycle_date] = missing
+                logging.warning(f"Files not found for {cycle_date:%Y%m%d%H}: {missing}")
+    return unavailable
 
-                    # Get the entire file from HPSS
-                    existing_archive = hsi_single_file(existing_archive, mode="get")
 
-                    # Grab only the necessary files from the archive
-                    cmd = f'unzip -o {os.path.basename(existing_archive)} {" ".join(source_paths)}'
+# The first bytes of a file read to time a download data store in a race
+RACE_SAMPLE_BYTES = 1024**2
 
-                else:
-                    cmd = f'htar -xvf {existing_archive} {" ".join(source_paths)}'
+# The rate assumed for copying files from the disk data store, in bytes
+# per second
+RACE_DISK_RATE = 500 * 1024**2
 
-                logging.info(f"Running command \n {cmd}")
-                subprocess.run(
-                    cmd,
-                    check=True,
-                    shell=True,
-                )
 
-                # Check that files exist and Remove any data transfer artifacts.
-                # Returns {'hpss': []}, turn that into a new dict of
-                # sets.
-                unavailable[existing_archive] = set(
-                    clean_up_output_dir(
-                        expected_subdir=archive_internal_dir,
-                        local_archive=os.path.basename(existing_archive),
-                        output_path=output_path,
-                        source_paths=source_paths,
-                    ).get("hpss", [])
-                )
+def probe_data_store(cla, known_data_info, data_store, cancel=None):
 
-            # Once we go through all the archives, the union of all
-            # "unavailable" files should equal the "expected" list of
-            # files since clean_up_output_dir only reports on those that
-            # are missing from one of the files attempted. If any
-            # additional files are reported as unavailable, then
-            # something has gone wrong.
-            unavailable = set.union(*unavailable.values())
+    # pylint: disable=too-many-locals
 
-        # Report only the files that are truly unavailable
-        if not expected == unavailable:
-            return unavailable - expected
+    """Check whether a data store holds all of the files of the first
+    cycle and member requested, without retrieving them, and estimate
+    how long it would take to deliver them:
+
+      disk      the files are listed, and copied at RACE_DISK_RATE
+      download  each url is checked with a HEAD request, and the first
+                RACE_SAMPLE_BYTES of the first one are read to time the
+                transfer
+      hpss      the archives are listed with hsi, and each one opened by
+                htar is expected to take as long as that
+
+    Once the cancel event, if any, is set, the probe gives up: hsi is
+    killed, no more requests are made, and ProbeCancelled is raised.
+
+    Return the estimated number of seconds from the start of the probe
+    until the files are delivered, or None if the data store does not
+    have them all."""
+
+    start = time.perf_counter()
+    cycle_date = cla.cycle_dates[0]
+    mem = cla.members[0] if cla.members else ""
+    store_specs = known_data_info.get(data_store, {})
+    protocol = "disk" if data_store == "disk" else store_specs.get("protocol")
+
+    if protocol == "htar":
+        archive_paths, archive_file_names = get_archive_specs(cla, store_specs)
+        ens_group = next(iter(get_ens_groups(cla.members)))
+        existing_archives, _ = find_archive_files(
+            archive_paths, archive_file_names, cycle_date, ens_group, cancel
+        )
+        if not existing_archives:
+            return None
+        return (time.perf_counter() - start) * (1 + len(existing_archives))
+
+    if protocol == "disk":
+        input_locs = cla.input_file_path
+        file_templates = get_file_templates(
+            cla, known_data_info, data_store="hpss", use_cla_tmpl=True
+        )
+    elif protocol == "download":
+        input_locs = store_specs["url"]
+        file_templates = get_file_templates(cla, known_data_info, data_store)
+    else:
+        return None
 
-    os.chdir(orig_path)
+    input_locs = input_locs if isinstance(input_locs, list) else [input_locs]
+    file_templates = (
+        file_templates if isinstance(file_templates, list) else [file_templates]
+    )
+    loc, templates = pair_locs_with_files(
+        input_locs, file_templates, known_data_info.get("check_all", False)
+    )[0]
+    templates = templates if isinstance(templates, list) else [templates]
+    file_locs = [
+        input_loc
+        for input_locs in expand_locations(
+            loc, templates, [cycle_date], cla.fcst_hrs, [mem]
+        ).values()
+        for input_loc in input_locs
+    ]
+
+    if protocol == "disk":
+        if not all(os.path.isfile(file_path) for file_path in file_locs):
+            return None
+        nbytes = sum(os.path.getsize(file_path) for file_path in file_locs)
+        return time.perf_counter() - start + nbytes / RACE_DISK_RATE
+
+    pool = get_http_pool()
+    sample = pool.probe(file_locs[0], sample_bytes=RACE_SAMPLE_BYTES, cancel=cancel)
+    if sample is None:
+        return None
+    nbytes, received, seconds = sample
+    for url in file_locs[1:]:
+        probed = pool.probe(url, cancel=cancel)
+        if probed is None:
+            return None
+        nbytes += probed[0]
+
+    # The sample request pays the latency once, and the other files are
+    # requested max_workers at a time.
+    rate = received / seconds if received else RACE_DISK_RATE
+    rounds = -(-len(file_locs) // max(cla.max_workers or 1, 1))
+    return time.perf_counter() - start + seconds * rounds + nbytes / rate
+
+
+def race_data_stores(cla, known_data_info, data_stores):
+
+    """Probe a list of data stores at the same time, and return them in
+    the order they would be best tried in: the data store estimated to
+    deliver the files fastest first, followed by the others that hold
+    them, fastest first, and then those that do not, in the order given.
+
+    The race is called as soon as one estimate is shorter than the time
+    the others have spent probing, since none of them can beat it any
+    more. Probes still running then are cancelled: their hsi sessions
+    are killed, and they make no more requests."""
+
+    start = time.perf_counter()
+    estimates = {}
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(data_stores))
+    futures = {
+        executor.submit(
+            probe_data_store, cla, known_data_info, data_store, cancel
+        ): data_store
+        for data_store in data_stores
+    }
+    try:
+        running = set(futures)
+        timeout = None
+        while running:
+            done, running = wait(running, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                data_store = futures[future]
+                try:
+                    estimates[data_store] = future.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    logging.warning(f"Could not probe {data_store}: {err}")
+                    estimates[data_store] = None
+                TELEMETRY.record(
+                    "probe",
+                    data_store=data_store,
+                    estimate=estimates[data_store],
+                    seconds=time.perf_counter() - start,
+                )
+                if estimates[data_store] is None:
+                    logging.info(f"{data_store} does not have all of the files")
+                else:
+                    logging.info(
+                        f"{data_store} could deliver the files in "
+                        f"{estimates[data_store]:.2f} s"
+                    )
 
-    return {}
+            # Wait for the others only until the best estimate is up
+            best = min((e for e in estimates.values() if e is not None), default=None)
+            if best is not None:
+                timeout = best - (time.perf_counter() - start)
+                if timeout <= 0:
+                    break
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    ranked = sorted(
+        (
+            data_store
+            for data_store in data_stores
+            if estimates.get(data_store) is not None
+        ),
+        key=estimates.get,
+    )
+    TELEMETRY.record("race", ranked=ranked, estimates=estimates)
+    if ranked:
+        logging.info(f"{ranked[0]} won the race of {data_stores}")
+    else:
+        logging.warning(f"None of {data_stores} has all of the files")
+    return ranked + [
+        data_store for data_store in data_stores if data_store not in ranked
+    ]
 
 
 def load_str(arg):
@@ -593,11 +3431,39 @@ def load_str(arg):
     return yaml.load(arg, Loader=yaml.SafeLoader)
 
 
+def load_yaml_file(path):
+
+    """Load a YAML config file with YAML's safe loader. Return the
+    resulting dict."""
+
+    with open(path, "r") as config_file:
+        return yaml.load(config_file, Loader=yaml.SafeLoader)
+
+
+def load_config(path):
+
+    """Load a YAML config file with load_yaml_file, reusing the result of
+    an earlier load of the same content by this process or another task
+    through the cache of parsed config files of the workflow; see
+    python_utils.config_parser.load_cached_config. Return a copy of the
+    resulting dict that the caller is free to modify."""
+
+    start = time.perf_counter()
+    cfg, outcome = load_cached_config(path, load_yaml_file, return_outcome=True)
+    TELEMETRY.record(
+        "config",
+        config=path,
+        outcome=outcome,
+        seconds=time.perf_counter() - start,
+    )
+    return cfg
+
+
 def config_exists(arg):
 
     """
     Check to ensure that the provided config file exists. If it does,
-    load it with YAML's safe loader and return the resulting dict.
+    load it with load_config and return the resulting dict.
     """
 
     # Check for existence of file
@@ -605,9 +3471,7 @@ def config_exists(arg):
         msg = f"{arg} does not exist!"
         raise argparse.ArgumentTypeError(msg)
 
-    with open(arg, "r") as config_path:
-        cfg = yaml.load(config_path, Loader=yaml.SafeLoader)
-    return cfg
+    return load_config(arg)
 
 
 def pair_locs_with_files(input_locs, file_templates, check_all):
@@ -684,25 +3548,27 @@ def setup_logging(debug=False):
         logging.info("Logging level set to DEBUG")
 
 
-def write_summary_file(cla, data_store, file_templates):
+def write_summary_file(cla, data_store, file_templates, cycle_date=None):
 
     """Given the command line arguments and the data store from which
     the data was retrieved, write a bash summary file that is needed by
-    the workflow elements downstream."""
+    the workflow elements downstream. In batch mode, one is written to
+    the output path of each cycle date."""
+
+    cycle_date = cycle_date or cla.cycle_dates[0]
 
     files = []
     for tmpl in file_templates:
-        files.extend(
-            [fill_template(tmpl, cla.cycle_date, fcst_hr=fh) for fh in cla.fcst_hrs]
-        )
+        files.extend(compile_template(tmpl).expand([cycle_date], cla.fcst_hrs).values())
 
-    summary_fp = os.path.join(cla.output_path, cla.summary_file)
+    output_path = fill_template(cla.output_path, cycle_date)
+    summary_fp = os.path.join(output_path, cla.summary_file)
     logging.info(f"Writing a summary file to {summary_fp}")
     file_contents = dedent(
         f"""
         DATA_SRC={data_store}
-        EXTRN_MDL_CDATE={cla.cycle_date.strftime('%Y%m%d%H')}
-        EXTRN_MDL_STAGING_DIR={cla.output_path}
+        EXTRN_MDL_CDATE={cycle_date.strftime('%Y%m%d%H')}
+        EXTRN_MDL_STAGING_DIR={output_path}
         EXTRN_MDL_FNS=( {' '.join(files)} )
         EXTRN_MDL_FHRS=( {' '.join([str(i) for i in cla.fcst_hrs])} )
         """
@@ -722,51 +3588,202 @@ def to_lower(arg):
     return arg.lower()
 
 
-def main(argv):
-    # pylint: disable=too-many-branches, too-many-statements
-    """
-    Uses known location information to try the known locations and file
-    paths in priority order.
-    """
+class RetrievalError(Exception):
 
-    cla = parse_args(argv)
-    cla.fcst_hrs = arg_list_to_range(cla.fcst_hrs)
+    """Base class of the errors raised when a RetrievalPlan cannot be
+    carried out."""
 
-    if cla.members:
-        cla.members = arg_list_to_range(cla.members)
 
-    setup_logging(cla.debug)
-    print("Running script retrieve_data.py with args:\n", f"{('-' * 80)}\n{('-' * 80)}")
-    for name, val in cla.__dict__.items():
-        if name not in ["config"]:
-            print(f"{name:>15s}: {val}")
-    print(f"{('-' * 80)}\n{('-' * 80)}")
+class PlanError(RetrievalError, argparse.ArgumentTypeError):
 
-    if "disk" in cla.data_stores:
-        # Make sure a path was provided.
-        if not cla.input_file_path:
-            raise argparse.ArgumentTypeError(
-                (
-                    "You must provide an input_file_path when choosing "
-                    " disk as a data store!"
-                )
-            )
+    """The plan asks for something that cannot be done, like writing
+    several cycles to the same output path."""
 
-    if "hpss" in cla.data_stores:
-        # Make sure hpss module is loaded
-        try:
-            subprocess.run(
-                "which hsi",
-                check=True,
-                shell=True,
+
+class DataStoreError(RetrievalError, KeyError):
+
+    """A data store of the plan is not defined for the external model,
+    or cannot be used on this platform."""
+
+    def __str__(self):
+        return str(self.args[0]) if self.args else ""
+
+
+class FilesUnavailableError(RetrievalError):
+
+    """Files of some of the cycles could not be found in any of the data
+    stores. unavailable maps each of those cycle dates to the files or
+    archives that could not be retrieved, and retrieved maps each of the
+    other cycle dates to the data store its files came from."""
+
+    def __init__(self, unavailable, retrieved):
+        cycles = " ".join(f"{cycle_date:%Y%m%d%H}" for cycle_date in unavailable)
+        super().__init__(f"Could not find any of the requested files for: {cycles}")
+        self.unavailable = unavailable
+        self.retrieved = retrieved
+
+
+# An event passed to the progress callback of a retrieval. The kinds are
+#   data_store   the files are about to be looked for in data_store
+#   retrieved    the file at path was retrieved from data_store
+#   skipped      the file at path was already retrieved by an earlier run
+#   unavailable  files of cycle_date are missing from data_store
+#   complete     all of the files of cycle_date are in path, or in the
+#                output paths of the members of an ensemble, when path
+#                is None
+#   ready        in follow mode, the files of one forecast hour of
+#                cycle_date are in the output path of the ready marker
+#                at path
+ProgressEvent = namedtuple(
+    "ProgressEvent",
+    ["kind", "data_store", "path", "cycle_date"],
+    defaults=(None, None),
+)
+
+
+def default_index_dir(cache_dir=None):
+
+    """Return the directory the listings of HPSS archives are kept in when
+    none is given: a hidden directory of the cache directory, which
+    eviction leaves alone, or else one in the user's cache directory."""
+
+    if cache_dir:
+        return os.path.join(cache_dir, ".htar_index")
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "regional_workflow",
+        "htar_index",
+    )
+
+
+class RetrievalPlan:
+
+    # pylint: disable=too-few-public-methods, too-many-instance-attributes
+
+    """The files of an external model to retrieve for a set of cycles,
+    the data stores to look for them in, in priority order, and the
+    path to put them in.
+
+    The arguments match the command line arguments of this script and
+    have the same defaults. cycle_dates is a datetime, or a YYYYMMDDHH
+    string or list of them like --cycle_dates takes. fcst_hrs and members
+    are lists like their flags take. config is the dict of known data
+    stores, or the path to a YAML file of them, and defaults to
+    templates/data_locations.yml in this repository.
+
+    Paths are made absolute when the plan is made, so carrying it out
+    does not depend on the working directory."""
+
+    def __init__(
+        self,
+        external_model,
+        cycle_dates,
+        fcst_hrs,
+        output_path,
+        data_stores,
+        anl_or_fcst="fcst",
+        config=None,
+        **kwargs,
+    ):
+
+        cycle_dates = cycle_dates if isinstance(cycle_dates, list) else [cycle_dates]
+        if all(isinstance(cycle_date, str) for cycle_date in cycle_dates):
+            cycle_dates = arg_list_to_dates(cycle_dates)
+        members = kwargs.get("members")
+
+        if config is None:
+            config = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "templates",
+                "data_locations.yml",
             )
-        except subprocess.CalledProcessError:
-            logging.error(
-                "You requested the hpss data store, but "
-                "the HPSS module isn't loaded. This data store "
-                "is only available on NOAA compute platforms."
+
+        self.anl_or_fcst = anl_or_fcst
+        self.config = config_exists(config) if isinstance(config, str) else config
+        self.cycle_dates = list(cycle_dates)
+        self.data_stores = [data_store.lower() for data_store in data_stores]
+        self.external_model = external_model
+        self.fcst_hrs = arg_list_to_range(list(fcst_hrs))
+        self.output_path = os.path.abspath(output_path)
+        self.cache_dir = kwargs.get("cache_dir")
+        if self.cache_dir:
+            self.cache_dir = os.path.abspath(self.cache_dir)
+        self.index_dir = kwargs.get("index_dir")
+        if not self.index_dir:
+            self.index_dir = default_index_dir(self.cache_dir)
+        self.index_dir = os.path.abspath(self.index_dir)
+        self.cache_max_gb = kwargs.get("cache_max_gb", 0)
+        self.checksum = kwargs.get("checksum", False)
+        self.download_backend = kwargs.get("download_backend", "python")
+        self.download_parts = kwargs.get("download_parts", HTTP_PARTS)
+        self.file_templates = kwargs.get("file_templates")
+        self.file_type = kwargs.get("file_type")
+        self.follow = kwargs.get("follow", False)
+        self.follow_timeout = kwargs.get("follow_timeout", 6 * 3600)
+        self.input_file_path = kwargs.get("input_file_path")
+        self.link_mode = kwargs.get("link_mode", "copy")
+        self.max_hpss_sessions = kwargs.get("max_hpss_sessions", 1)
+        self.max_per_host = kwargs.get("max_per_host")
+        self.max_workers = kwargs.get("max_workers", 1)
+        self.members = arg_list_to_range(list(members)) if members else members
+        self.poll_interval = kwargs.get("poll_interval", 60)
+        self.race = kwargs.get("race")
+        self.summary_file = kwargs.get("summary_file")
+
+        if "disk" in self.data_stores and not self.input_file_path:
+            raise PlanError(
+                "You must provide an input_file_path when choosing "
+                " disk as a data store!"
             )
-            sys.exit(1)
+
+        if len(self.cycle_dates) > 1:
+            # Make sure the cycles don't overwrite each other's files.
+            output_paths = {
+                fill_template(self.output_path, cycle_date, mem=0)
+                for cycle_date in self.cycle_dates
+            }
+            if len(output_paths) < len(self.cycle_dates):
+                raise PlanError(
+                    "The output_path must contain a cycle date template, "
+                    "like {yyyymmddhh}, when retrieving several cycles!"
+                )
+
+
+def retrieve(plan, progress=None):
+
+    # pylint: disable=too-many-branches, too-many-locals, too-many-statements
+
+    """Carry out a RetrievalPlan, trying the data stores of the plan in
+    priority order for the cycles still missing files. progress, when
+    given, is called with a ProgressEvent as each data store is tried,
+    each file is retrieved or skipped, and each cycle is completed or
+    found to be missing files. It is called from worker threads.
+
+    Return a dict mapping each cycle date to the data store its files
+    came from. Raise FilesUnavailableError if files of any cycle could
+    not be found in any of the data stores, DataStoreError for data
+    stores that are not defined or cannot be used, and PlanError for
+    requests the config cannot satisfy.
+
+    When plan.follow is set, the forecast hours are delivered as they
+    are published; see the follow function."""
+
+    if plan.follow:
+        return follow(plan, progress)
+
+    # The plan is not changed, so it can be carried out again
+    cla = copy.copy(plan)
+
+    def report(*args, **kwargs):
+        if progress is not None:
+            progress(ProgressEvent(*args, **kwargs))
+
+    if "hpss" in cla.data_stores and shutil.which("hsi") is None:
+        raise DataStoreError(
+            "You requested the hpss data store, but "
+            "the HPSS module isn't loaded. This data store "
+            "is only available on NOAA compute platforms."
+        )
 
     known_data_info = cla.config.get(cla.external_model, {})
     if not known_data_info:
@@ -776,14 +3793,42 @@ def main(argv):
                location"""
         )
         if cla.input_file_path is None:
-            cla.data_stores = ["disk"]
-            raise KeyError(msg)
+            raise DataStoreError(msg)
         logging.info(msg)
 
+    # Limits the number of htar and hsi sessions running at once
+    hpss_sessions = threading.BoundedSemaphore(cla.max_hpss_sessions)
+
+    # Files already in the output paths from an earlier run are kept
+    manifest = Manifest(checksum=cla.checksum)
+
+    if cla.race is not None:
+        # Try the leading data stores in the order of the race. The
+        # others are still tried after them, in order, if files are
+        # missing.
+        racers = cla.data_stores[: cla.race or None]
+        if len(racers) > 1:
+            cla.data_stores = (
+                race_data_stores(cla, known_data_info, racers)
+                + cla.data_stores[len(racers) :]
+            )
+
+    retrieved = {}
     unavailable = {}
     for data_store in cla.data_stores:
         logging.info(f"Checking {data_store} for {cla.external_model}")
+        report("data_store", data_store)
         store_specs = known_data_info.get(data_store, {})
+        start = time.perf_counter()
+
+        cache = None
+        if cla.cache_dir and data_store != "disk":
+            cache = FileCache(
+                cla.cache_dir,
+                cla.external_model,
+                data_store,
+                max_bytes=int(cla.cache_max_gb * 1024**3),
+            )
 
         if data_store == "disk":
             file_templates = get_file_templates(
@@ -800,11 +3845,17 @@ def main(argv):
                 file_templates=file_templates,
                 input_locs=cla.input_file_path,
                 method="disk",
+                max_workers=cla.max_workers,
+                max_per_host=cla.max_per_host,
+                link_mode=cla.link_mode,
+                manifest=manifest,
+                data_store=data_store,
+                progress=progress,
             )
 
         elif not store_specs:
             msg = f"No information is available for {data_store}."
-            raise KeyError(msg)
+            raise DataStoreError(msg)
 
         else:
 
@@ -815,39 +3866,286 @@ def main(argv):
             )
 
             if store_specs.get("protocol") == "download":
-                unavailable = get_requested_files(
-                    cla,
-                    check_all=known_data_info.get("check_all", False),
-                    file_templates=file_templates,
-                    input_locs=store_specs["url"],
-                    method="download",
-                    members=cla.members,
-                )
+                if store_specs.get("rate_limit"):
+                    urls = store_specs["url"]
+                    urls = urls if isinstance(urls, list) else [urls]
+                    get_http_pool().limit_hosts(
+                        [
+                            url
+                            for item in urls
+                            for url in (item if isinstance(item, list) else [item])
+                        ],
+                        **store_specs["rate_limit"],
+                    )
 
-            if store_specs.get("protocol") == "htar":
-                ens_groups = get_ens_groups(cla.members)
-                for ens_group, members in ens_groups.items():
-                    unavailable = hpss_requested_files(
+                # Subsetting by GRIB2 record only applies to GRIB2 files
+                grib2_filter = None
+                if cla.file_type in (None, "grib2"):
+                    grib2_filter = {
+                        key: store_specs[key]
+                        for key in ("variables", "levels")
+                        if store_specs.get(key)
+                    }
+                if store_specs.get("archive_format") == "zip":
+                    unavailable = zip_requested_files(
                         cla,
                         file_templates,
                         store_specs,
-                        members=members,
-                        ens_group=ens_group,
+                        cache=cache,
+                        manifest=manifest,
+                        data_store=data_store,
+                        progress=progress,
+                    )
+                else:
+                    unavailable = get_requested_files(
+                        cla,
+                        check_all=known_data_info.get("check_all", False),
+                        file_templates=file_templates,
+                        input_locs=store_specs["url"],
+                        method="download",
+                        members=cla.members,
+                        max_workers=cla.max_workers,
+                        max_per_host=cla.max_per_host,
+                        backend=cla.download_backend,
+                        parts=cla.download_parts,
+                        grib2_filter=grib2_filter,
+                        cache=cache,
+                        manifest=manifest,
+                        data_store=data_store,
+                        progress=progress,
                     )
 
+            if store_specs.get("protocol") == "htar":
+                unavailable = hpss_requested_files(
+                    cla,
+                    file_templates,
+                    store_specs,
+                    cache=cache,
+                    index=ArchiveIndex(cla.index_dir),
+                    manifest=manifest,
+                    data_store=data_store,
+                    progress=progress,
+                    sessions=hpss_sessions,
+                )
+
+        # Write a variable definitions file for the data of each cycle
+        # that found all of its files, if requested
+        for cycle_date in cla.cycle_dates:
+            if cycle_date in unavailable:
+                report("unavailable", data_store, cycle_date=cycle_date)
+                continue
+            retrieved[cycle_date] = data_store
+            TELEMETRY.record("cycle", data_store=data_store, cycle_date=cycle_date)
+            if cla.summary_file:
+                write_summary_file(cla, data_store, file_templates, cycle_date)
+            # Each member of an ensemble has its own output path
+            output_path = None
+            if not cla.members:
+                output_path = fill_template(cla.output_path, cycle_date)
+            report("complete", data_store, output_path, cycle_date)
+
+        TELEMETRY.record(
+            "data_store",
+            data_store=data_store,
+            cycles=len(cla.cycle_dates),
+            complete=len(cla.cycle_dates) - len(unavailable),
+            seconds=time.perf_counter() - start,
+        )
+
         if not unavailable:
             # All files are found. Stop looking!
-            # Write a variable definitions file for the data, if requested
-            if cla.summary_file:
-                write_summary_file(cla, data_store, file_templates)
             break
 
+        # Only the cycles that are still missing files are looked for in
+        # the next data store.
+        cla.cycle_dates = [
+            cycle_date for cycle_date in cla.cycle_dates if cycle_date in unavailable
+        ]
+
         logging.debug(f"Some unavailable files: {unavailable}")
         logging.warning(f"Requested files are unavailable from {data_store}")
 
+    for netloc, stats in get_http_pool().throttle_stats().items():
+        TELEMETRY.record("throttle", host=netloc, **stats)
+        logging.info(
+            f"Requests to {netloc}: {stats['requests']}, "
+            f"waited {stats['waits']} times for {stats['wait_seconds']:.1f} s, "
+            f"backed off {stats['backoffs']} times for "
+            f"{stats['backoff_seconds']:.1f} s"
+        )
+
     if unavailable:
-        logging.error("Could not find any of the requested files.")
+        raise FilesUnavailableError(unavailable, retrieved)
+    return retrieved
+
+
+# Name of the marker written to an output directory in follow mode once
+# the files of a forecast hour are all there. It lists their names.
+READY_FN = ".retrieve_data_ready.f{fcst_hr:03d}"
+
+# The poll interval of follow mode grows up to this many times its
+# initial value while no forecast hour appears
+FOLLOW_MAX_BACKOFF = 8
+
+
+def write_ready_marker(output_path, fcst_hr, file_names):
+
+    """Write the ready marker of a forecast hour listing file_names to
+    output_path, atomically, and return its path."""
+
+    marker = os.path.join(output_path, READY_FN.format(fcst_hr=fcst_hr))
+    tmp_marker = f"{marker}.tmp{os.getpid()}"
+    with open(tmp_marker, "w") as marker_file:
+        marker_file.write("".join(f"{file_name}\n" for file_name in sorted(file_names)))
+    os.replace(tmp_marker, marker)
+    logging.info(f"Forecast hour {fcst_hr} is ready: {marker}")
+    return marker
+
+
+def follow(plan, progress=None):
+
+    # pylint: disable=too-many-locals, cell-var-from-loop
+
+    """Carry out a RetrievalPlan whose forecast hours are still being
+    published, delivering each forecast hour as soon as all of its files
+    can be retrieved instead of waiting for all of them.
+
+    The pending forecast hours are retrieved one at a time, in order, in
+    rounds. Models publish their forecast hours in order, so a round
+    stops at the first hour that is not available yet. A ready marker
+    (READY_FN) listing the files of the hour is written to each output
+    path, and a "ready" ProgressEvent is reported, as each hour lands.
+    Rounds are plan.poll_interval seconds apart, and the interval doubles,
+    up to FOLLOW_MAX_BACKOFF times, for as long as no hour lands.
+
+    Once all of the hours have landed, the plan is carried out once more
+    to write the summary files and report the cycles complete; the files
+    are all skipped, as the manifest already holds them. Return what
+    retrieve returns. Raise FilesUnavailableError if some hours have not
+    landed after plan.follow_timeout seconds."""
+
+    def report(*args, **kwargs):
+        if progress is not None:
+            progress(ProgressEvent(*args, **kwargs))
+
+    pending = list(plan.fcst_hrs)
+    deadline = time.monotonic() + plan.follow_timeout
+    interval = plan.poll_interval
+    unavailable = {}
+    while True:
+        delivered = False
+        for fcst_hr in list(pending):
+            hour = copy.copy(plan)
+            hour.fcst_hrs = [fcst_hr]
+            hour.follow = False
+            hour.summary_file = None
+
+            # The files of the hour, by output path
+            landed = {}
+
+            def collect(event):
+                if event.kind not in ("retrieved", "skipped"):
+                    return
+                output_path, file_name = os.path.split(event.path)
+                landed.setdefault(
+                    output_path, (event.cycle_date, event.data_store, set())
+                )[2].add(file_name)
+                if progress is not None:
+                    progress(event)
+
+            try:
+                retrieve(hour, collect)
+            except FilesUnavailableError as err:
+                unavailable = err.unavailable
+                break
+
+            pending.remove(fcst_hr)
+            delivered = True
+            for output_path, (cycle_date, data_store, file_names) in landed.items():
+                marker = write_ready_marker(output_path, fcst_hr, file_names)
+                report("ready", data_store, marker, cycle_date)
+
+        if not pending:
+            break
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.warning(f"Gave up waiting for forecast hours {pending}")
+            raise FilesUnavailableError(unavailable, {})
+
+        interval = (
+            plan.poll_interval
+            if delivered
+            else min(interval * 2, plan.poll_interval * FOLLOW_MAX_BACKOFF)
+        )
+        logging.info(
+            f"Waiting {min(interval, remaining):.0f} s for forecast hours {pending}"
+        )
+        time.sleep(min(interval, remaining))
+
+    def finish(event):
+        if progress is not None and event.kind != "skipped":
+            progress(event)
+
+    final = copy.copy(plan)
+    final.follow = False
+    return retrieve(final, finish)
+
+
+async def fetch(plan, progress=None):
+
+    """Carry out a RetrievalPlan without blocking the running event loop,
+    and return a dict mapping each cycle date to the data store its files
+    came from. The blocking work runs in the default executor of the
+    loop, so several plans can be fetched at once from one event loop.
+
+    progress, when given, is called in the event loop with each
+    ProgressEvent of the retrieval; see the retrieve function. Raises
+    the same RetrievalError exceptions as retrieve."""
+
+    loop = asyncio.get_running_loop()
+
+    def report(event):
+        loop.call_soon_threadsafe(progress, event)
+
+    return await loop.run_in_executor(
+        None, retrieve, plan, report if progress is not None else None
+    )
+
+
+def main(argv):
+
+    """
+    Uses known location information to try the known locations and file
+    paths in priority order. A thin wrapper around fetch that exits with
+    a non-zero status when the files could not be retrieved.
+    """
+
+    cla = vars(parse_args(argv))
+    cycle_date = cla.pop("cycle_date")
+    cycle_dates = cla.pop("cycle_dates")
+    setup_logging(cla.pop("debug"))
+    stats = cla.pop("stats")
+    telemetry = cla.pop("telemetry")
+    plan = RetrievalPlan(cycle_dates=cycle_dates or cycle_date, **cla)
+
+    print("Running script retrieve_data.py with args:\n", f"{('-' * 80)}\n{('-' * 80)}")
+    for name, val in vars(plan).items():
+        if name not in ["config"]:
+            print(f"{name:>15s}: {val}")
+    print(f"{('-' * 80)}\n{('-' * 80)}")
+
+    if telemetry:
+        TELEMETRY.open(telemetry)
+    try:
+        asyncio.run(fetch(plan))
+    except RetrievalError as err:
+        logging.error(err)
         sys.exit(1)
+    finally:
+        if stats:
+            print(TELEMETRY.summary())
+        TELEMETRY.close()
 
 
 def get_ens_groups(members):
@@ -902,13 +4200,23 @@ def parse_args(argv):
         in this repository is in ush/templates/data_locations.yml",
         type=config_exists,
     )
-    parser.add_argument(
+    cycles = parser.add_mutually_exclusive_group(required=True)
+    cycles.add_argument(
         "--cycle_date",
         help="Cycle date of the data to be retrieved in YYYYMMDDHH \
         format.",
-        required=True,
         type=to_datetime,
     )
+    cycles.add_argument(
+        "--cycle_dates",
+        help="A list describing the cycle dates of the data to be \
+        retrieved in a single run, in YYYYMMDDHH format. If 2 or 3 \
+        arguments, a sequence of cycles [start, stop, [increment in \
+        hours]] will be processed. If more than 3 arguments, the list is \
+        processed as-is. The output_path must contain a cycle date \
+        template. A summary file is written for each cycle.",
+        nargs="+",
+    )
     parser.add_argument(
         "--data_stores",
         help="List of priority data_stores. Tries first list item \
@@ -952,11 +4260,50 @@ def parse_args(argv):
     )
 
     # Optional
+    parser.add_argument(
+        "--cache_dir",
+        help="Path to a directory shared across experiments and cycles in \
+        which retrieved files are cached. Files found there are linked \
+        into the output path instead of being retrieved again.",
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--cache_max_gb",
+        default=0,
+        help="Size limit of the cache directory in GB. The least recently \
+        used files are removed to stay under it. No limit by default.",
+        type=float,
+    )
+    parser.add_argument(
+        "--checksum",
+        action="store_true",
+        help="Record the SHA-256 checksum of each retrieved file in the \
+        manifest of the output path, and verify it before skipping a file \
+        that is already there on a rerun.",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
         help="Print debug messages",
     )
+    parser.add_argument(
+        "--download_backend",
+        choices=("python", "wget"),
+        default="python",
+        help="How files are fetched from download data stores. python \
+        reuses persistent connections to each host. wget forks a wget \
+        process per file.",
+    )
+    parser.add_argument(
+        "--download_parts",
+        default=HTTP_PARTS,
+        help=f"The number of byte ranges a file of at least \
+        {HTTP_MULTIPART_MIN_BYTES // 1024**2} MB is split into and \
+        downloaded in at the same time with the python backend, when the \
+        server supports byte ranges. Set to 1 to download every file in a \
+        single stream.",
+        type=int,
+    )
     parser.add_argument(
         "--file_templates",
         help="One or more file template strings defining the naming \
@@ -969,6 +4316,31 @@ def parse_args(argv):
         choices=("grib2", "nemsio", "netcdf"),
         help="External model file format",
     )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Deliver each forecast hour as soon as its files are \
+        published, instead of failing when some are not available yet. \
+        A ready marker listing the files of each hour is written to the \
+        output path as the hour lands, and the summary file once all of \
+        them have.",
+    )
+    parser.add_argument(
+        "--follow_timeout",
+        default=6 * 3600,
+        help="Seconds to wait for all forecast hours to be published in \
+        --follow mode before giving up.",
+        type=float,
+    )
+    parser.add_argument(
+        "--index_dir",
+        help="Path to a directory shared across experiments and cycles in \
+        which the listings of HPSS tar archives are kept, so that each \
+        archive is listed only once and only the archives holding the \
+        requested files are extracted from. Defaults to .htar_index in \
+        the cache directory, or to a directory in ~/.cache.",
+        type=os.path.abspath,
+    )
     parser.add_argument(
         "--input_file_path",
         help="A path to data stored on disk. The path may contain \
@@ -976,6 +4348,38 @@ def parse_args(argv):
         --file_templates flag, or the default naming convention will be \
         taken from the --config file.",
     )
+    parser.add_argument(
+        "--link_mode",
+        choices=("copy", "hardlink", "reflink", "symlink", "auto"),
+        default="copy",
+        help="How files from the disk data store are placed in the output \
+        path. hardlink and reflink fall back to a copy for files on \
+        another file system. auto uses the cheapest of reflink, \
+        hardlink, or copy that works for each file. symlink links to the \
+        files where they are, so they must not be removed before they are \
+        used.",
+    )
+    parser.add_argument(
+        "--max_hpss_sessions",
+        default=1,
+        help="The maximum number of htar or hsi extractions to run at the \
+        same time across ensemble groups and archives. Archives are \
+        extracted one at a time by default.",
+        type=int,
+    )
+    parser.add_argument(
+        "--max_per_host",
+        help="The maximum number of files to retrieve at the same time \
+        from any one host. No limit by default.",
+        type=int,
+    )
+    parser.add_argument(
+        "--max_workers",
+        default=1,
+        help="The maximum number of files to retrieve at the same time. \
+        Files are retrieved one at a time by default.",
+        type=int,
+    )
     parser.add_argument(
         "--members",
         help="A list describing ensemble members.  If one argument, \
@@ -986,11 +4390,44 @@ def parse_args(argv):
         nargs="*",
         type=int,
     )
+    parser.add_argument(
+        "--poll_interval",
+        default=60,
+        help="Seconds between checks for newly published forecast hours in \
+        --follow mode. The interval grows while no new hour appears.",
+        type=float,
+    )
+    parser.add_argument(
+        "--race",
+        const=0,
+        help="Probe the first N data stores at the same time, without \
+        retrieving the files, and retrieve from the one estimated to \
+        deliver them fastest, instead of trying the data stores strictly \
+        in order. All of them are probed when N is not given. The others \
+        are still tried if files are missing.",
+        metavar="N",
+        nargs="?",
+        type=int,
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the number of files, bytes, seconds and throughput of \
+        the retrieval by data store and by host, with the retries, \
+        backoffs, cache hits and HPSS calls made, when the script exits.",
+    )
     parser.add_argument(
         "--summary_file",
         help="Name of the summary file to be written to the output \
         directory",
     )
+    parser.add_argument(
+        "--telemetry",
+        help="Path to a file to which an event is appended as a JSON line \
+        for each file, transfer, retry, probe and HPSS call of the \
+        retrieval, so that the events of many tasks can be aggregated.",
+        type=os.path.abspath,
+    )
     return parser.parse_args(argv)
 
 
@@ -2,22 +2,23 @@
 
 import unittest
 
-from python_utils import import_vars, export_vars, set_env_var, get_env_var
+from python_utils import ExperimentConfig, set_env_var, get_env_var
 
 
-def set_extrn_mdl_params():
+def set_extrn_mdl_params(cfg=None):
     """Sets parameters associated with the external model used for initial
     conditions (ICs) and lateral boundary conditions (LBCs).
     Args:
-        None
+        cfg: ExperimentConfig to set the parameters in, or None, in which
+             case the environment is used
     Returns:
         None
     """
 
-    # import all env variables
-    import_vars()
-
-    global EXTRN_MDL_LBCS_OFFSET_HRS
+    env_vars = ["EXTRN_MDL_LBCS_OFFSET_HRS"]
+    from_env = cfg is None
+    if from_env:
+        cfg = ExperimentConfig.from_env(env_vars + ["EXTRN_MDL_NAME_LBCS"])
 
     #
     # -----------------------------------------------------------------------
@@ -28,14 +29,14 @@ def set_extrn_mdl_params():
     #
     # -----------------------------------------------------------------------
     #
-    if EXTRN_MDL_NAME_LBCS == "RAP":
-        EXTRN_MDL_LBCS_OFFSET_HRS = EXTRN_MDL_LBCS_OFFSET_HRS or "3"
+    if cfg.EXTRN_MDL_NAME_LBCS == "RAP":
+        cfg.EXTRN_MDL_LBCS_OFFSET_HRS = cfg.EXTRN_MDL_LBCS_OFFSET_HRS or 3
     else:
-        EXTRN_MDL_LBCS_OFFSET_HRS = EXTRN_MDL_LBCS_OFFSET_HRS or "0"
+        cfg.EXTRN_MDL_LBCS_OFFSET_HRS = cfg.EXTRN_MDL_LBCS_OFFSET_HRS or 0
 
-    # export values we set above
-    env_vars = ["EXTRN_MDL_LBCS_OFFSET_HRS"]
-    export_vars(env_vars=env_vars)
+    # export values we set above when called on its own
+    if from_env:
+        cfg.export_env(env_vars)
 
 
 class Testing(unittest.TestCase):
@@ -3,10 +3,12 @@
 import unittest
 from datetime import datetime, timedelta
 
-from python_utils import import_vars, set_env_var, print_input_args
+from python_utils import ExperimentConfig, set_env_var, print_input_args
 
 
-def set_gridparams_ESGgrid(lon_ctr, lat_ctr, nx, ny, halo_width, delx, dely, pazi):
+def set_gridparams_ESGgrid(
+    lon_ctr, lat_ctr, nx, ny, halo_width, delx, dely, pazi, cfg=None
+):
     """Sets the parameters for a grid that is to be generated using the "ESGgrid"
     grid generation method (i.e. GRID_GEN_METHOD set to "ESGgrid").
 
@@ -19,15 +21,17 @@ def set_gridparams_ESGgrid(lon_ctr, lat_ctr, nx, ny, halo_width, delx, dely, paz
         delx
         dely
         pazi
+        cfg: ExperimentConfig, or None, in which case the environment is used
     Returns:
         Tuple of inputs, and 4 outputs (see return statement)
     """
 
     print_input_args(locals())
 
-    # get needed environment variables
+    # get needed experiment variables
     IMPORTS = ["RADIUS_EARTH", "DEGS_PER_RADIAN"]
-    import_vars(env_vars=IMPORTS)
+    if cfg is None:
+        cfg = ExperimentConfig.from_env(IMPORTS)
     #
     # -----------------------------------------------------------------------
     #
@@ -61,8 +65,8 @@ def set_gridparams_ESGgrid(lon_ctr, lat_ctr, nx, ny, halo_width, delx, dely, paz
     #
     # -----------------------------------------------------------------------
     #
-    del_angle_x_sg = (delx / (2.0 * RADIUS_EARTH)) * DEGS_PER_RADIAN
-    del_angle_y_sg = (dely / (2.0 * RADIUS_EARTH)) * DEGS_PER_RADIAN
+    del_angle_x_sg = (delx / (2.0 * cfg.RADIUS_EARTH)) * cfg.DEGS_PER_RADIAN
+    del_angle_y_sg = (dely / (2.0 * cfg.RADIUS_EARTH)) * cfg.DEGS_PER_RADIAN
     neg_nx_of_dom_with_wide_halo = -(nx + 2 * halo_width)
     neg_ny_of_dom_with_wide_halo = -(ny + 2 * halo_width)
     #
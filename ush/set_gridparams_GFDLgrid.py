@@ -3,7 +3,7 @@
 import unittest
 
 from python_utils import (
-    import_vars,
+    ExperimentConfig,
     set_env_var,
     print_input_args,
     print_info_msg,
@@ -35,6 +35,7 @@ def set_gridparams_GFDLgrid(
     iend_of_t7_on_t6g,
     jstart_of_t7_on_t6g,
     jend_of_t7_on_t6g,
+    cfg=None,
 ):
     """Sets the parameters for a grid that is to be generated using the "GFDLgrid"
     grid generation method (i.e. GRID_GEN_METHOD set to "ESGgrid").
@@ -48,16 +49,18 @@ def set_gridparams_GFDLgrid(
          istart_of_t7_on_t6g
          iend_of_t7_on_t6g
          jstart_of_t7_on_t6g
-         jend_of_t7_on_t6g):
+         jend_of_t7_on_t6g
+         cfg: ExperimentConfig, or None, in which case the environment is used
     Returns:
         Tuple of inputs and outputs (see return statement)
     """
 
     print_input_args(locals())
 
-    # get needed environment variables
+    # get needed experiment variables
     IMPORTS = ["VERBOSE", "RUN_ENVIR", "NH4"]
-    import_vars(env_vars=IMPORTS)
+    if cfg is None:
+        cfg = ExperimentConfig.from_env(IMPORTS)
 
     #
     # -----------------------------------------------------------------------
@@ -87,7 +90,7 @@ def set_gridparams_GFDLgrid(
 
     # This if-statement can hopefully be removed once EMC agrees to make their
     # GFDLgrid type grids (tile 7) symmetric about tile 6.
-    if RUN_ENVIR != "nco":
+    if cfg.RUN_ENVIR != "nco":
         if num_left_margin_cells_on_t6g != num_right_margin_cells_on_t6g:
             print_err_msg_exit(
                 f"""
@@ -113,7 +116,7 @@ def set_gridparams_GFDLgrid(
 
     # This if-statement can hopefully be removed once EMC agrees to make their
     # GFDLgrid type grids (tile 7) symmetric about tile 6.
-    if RUN_ENVIR != "nco":
+    if cfg.RUN_ENVIR != "nco":
         if num_bot_margin_cells_on_t6g != num_top_margin_cells_on_t6g:
             print_err_msg_exit(
                 f"""
@@ -252,7 +255,7 @@ def set_gridparams_GFDLgrid(
     #
     # -----------------------------------------------------------------------
     #
-    halo_width_on_t7g = NH4 + 1
+    halo_width_on_t7g = cfg.NH4 + 1
     halo_width_on_t6sg = (
         2 * halo_width_on_t7g + refine_ratio_t6g_to_t7g - 1
     ) / refine_ratio_t6g_to_t7g
@@ -328,7 +331,7 @@ def set_gridparams_GFDLgrid(
         tile 7 grid are:
           halo_width_on_t6sg = {halo_width_on_t6sg}
           halo_width_on_t7g  = {halo_width_on_t7g}""",
-        verbose=VERBOSE,
+        verbose=cfg.VERBOSE,
     )
 
     halo_width_on_t6sg = istart_of_t7_on_t6sg - istart_of_t7_with_halo_on_t6sg
@@ -341,7 +344,7 @@ def set_gridparams_GFDLgrid(
         AFTER adjustments are:
           halo_width_on_t6sg = {halo_width_on_t6sg}
           halo_width_on_t7g  = {halo_width_on_t7g}""",
-        verbose=VERBOSE,
+        verbose=cfg.VERBOSE,
     )
     #
     # -----------------------------------------------------------------------
@@ -414,7 +417,7 @@ def set_gridparams_GFDLgrid(
         determining an MPI task layout):
           prime_factors_nx_of_t7_on_t7g: {prime_factors_nx_of_t7_on_t7g}
           prime_factors_ny_of_t7_on_t7g: {prime_factors_ny_of_t7_on_t7g}""",
-        verbose=VERBOSE,
+        verbose=cfg.VERBOSE,
     )
     #
     # -----------------------------------------------------------------------
@@ -443,7 +446,7 @@ def set_gridparams_GFDLgrid(
         nx_of_t7_with_halo_on_t7g = {nx_of_t7_with_halo_on_t7g}
         (istart_of_t7_with_halo_on_t6sg = {istart_of_t7_with_halo_on_t6sg},
         iend_of_t7_with_halo_on_t6sg = {iend_of_t7_with_halo_on_t6sg})""",
-        verbose=VERBOSE,
+        verbose=cfg.VERBOSE,
     )
 
     print_info_msg(
@@ -451,7 +454,7 @@ def set_gridparams_GFDLgrid(
         ny_of_t7_with_halo_on_t7g = {ny_of_t7_with_halo_on_t7g}
         (jstart_of_t7_with_halo_on_t6sg = {jstart_of_t7_with_halo_on_t6sg},
         jend_of_t7_with_halo_on_t6sg = {jend_of_t7_with_halo_on_t6sg})""",
-        verbose=VERBOSE,
+        verbose=cfg.VERBOSE,
     )
     #
     # -----------------------------------------------------------------------
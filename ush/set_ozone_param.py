@@ -5,8 +5,7 @@ import unittest
 from textwrap import dedent
 
 from python_utils import (
-    import_vars,
-    export_vars,
+    ExperimentConfig,
     set_env_var,
     list_to_str,
     print_input_args,
@@ -19,7 +18,7 @@ from python_utils import (
 )
 
 
-def set_ozone_param(ccpp_phys_suite_fp):
+def set_ozone_param(ccpp_phys_suite_fp, cfg=None):
     """Function that does the following:
     (1) Determines the ozone parameterization being used by checking in the
         CCPP physics suite XML.
@@ -43,14 +42,20 @@ def set_ozone_param(ccpp_phys_suite_fp):
 
     Args:
         ccpp_phys_suite_fp: full path to CCPP physics suite
+        cfg: ExperimentConfig holding the arrays to reset, or None, in which
+             case the environment is used
     Returns:
         ozone_param: a string
     """
 
     print_input_args(locals())
 
-    # import all environment variables
-    import_vars()
+    EXPORTS = ["CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING", "FIXgsm_FILES_TO_COPY_TO_FIXam"]
+    from_env = cfg is None
+    if from_env:
+        cfg = ExperimentConfig.from_env(EXPORTS + ["VERBOSE"])
+    FIXgsm_FILES_TO_COPY_TO_FIXam = cfg.FIXgsm_FILES_TO_COPY_TO_FIXam
+    CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING = cfg.CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING
 
     #
     # -----------------------------------------------------------------------
@@ -167,7 +172,7 @@ def set_ozone_param(ccpp_phys_suite_fp):
               CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING = {list_to_str(CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING)}
             """
         )
-        print_info_msg(msg, verbose=VERBOSE)
+        print_info_msg(msg, verbose=cfg.VERBOSE)
 
     else:
 
@@ -179,8 +184,9 @@ def set_ozone_param(ccpp_phys_suite_fp):
               fixgsm_ozone_fn_is_set = \"{fixgsm_ozone_fn_is_set}\"'''
         )
 
-    EXPORTS = ["CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING", "FIXgsm_FILES_TO_COPY_TO_FIXam"]
-    export_vars(env_vars=EXPORTS)
+    # export the arrays to environment when called on its own
+    if from_env:
+        cfg.export_env(EXPORTS)
 
     return ozone_param
 
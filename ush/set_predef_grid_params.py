@@ -5,8 +5,7 @@ import os
 
 from python_utils import (
     process_args,
-    import_vars,
-    export_vars,
+    ExperimentConfig,
     set_env_var,
     get_env_var,
     print_input_args,
@@ -17,15 +16,15 @@ from python_utils import (
 )
 
 
-def set_predef_grid_params():
+def set_predef_grid_params(cfg=None):
     """Sets grid parameters for the specified predfined grid
 
     Args:
-        None
+        cfg: ExperimentConfig to read the grid name from and set the
+             parameters in, or None, in which case the environment is used
     Returns:
-        None
+        Dictionary of the grid parameters
     """
-    # import all environement variables
     IMPORTS = [
         "PREDEF_GRID_NAME",
         "QUILTING",
@@ -34,14 +33,16 @@ def set_predef_grid_params():
         "LAYOUT_Y",
         "BLOCKSIZE",
     ]
-    import_vars(env_vars=IMPORTS)
+    from_env = cfg is None
+    if from_env:
+        cfg = ExperimentConfig.from_env(IMPORTS)
 
     USHDIR = os.path.dirname(os.path.abspath(__file__))
     params_dict = load_config_file(os.path.join(USHDIR, "predef_grid_params.yaml"))
-    params_dict = params_dict[PREDEF_GRID_NAME]
+    params_dict = params_dict[cfg.PREDEF_GRID_NAME]
 
     # if QUILTING = False, remove key
-    if not QUILTING:
+    if not cfg.get("QUILTING"):
         params_dict.pop("QUILTING")
     else:
         params_dict = flatten_dict(params_dict)
@@ -49,11 +50,14 @@ def set_predef_grid_params():
     # take care of special vars
     special_vars = ["DT_ATMOS", "LAYOUT_X", "LAYOUT_Y", "BLOCKSIZE"]
     for var in special_vars:
-        if globals()[var] is not None:
-            params_dict[var] = globals()[var]
+        if cfg.get(var) is not None:
+            params_dict[var] = cfg[var]
 
-    # export variables to environment
-    export_vars(source_dict=params_dict)
+    cfg.update(params_dict)
+
+    # export variables to environment when called on its own
+    if from_env:
+        cfg.export_env(params_dict)
 
     return params_dict
 
@@ -5,8 +5,7 @@ import unittest
 from textwrap import dedent
 
 from python_utils import (
-    import_vars,
-    export_vars,
+    ExperimentConfig,
     set_env_var,
     list_to_str,
     print_input_args,
@@ -18,7 +17,7 @@ from python_utils import (
 )
 
 
-def set_thompson_mp_fix_files(ccpp_phys_suite_fp, thompson_mp_climo_fn):
+def set_thompson_mp_fix_files(ccpp_phys_suite_fp, thompson_mp_climo_fn, cfg=None):
     """Function that first checks whether the Thompson
     microphysics parameterization is being called by the selected physics
     suite.  If not, it sets the output variable whose name is specified by
@@ -32,14 +31,22 @@ def set_thompson_mp_fix_files(ccpp_phys_suite_fp, thompson_mp_climo_fn):
     Args:
         ccpp_phys_suite_fp: full path to CCPP physics suite
         thompson_mp_climo_fn: netcdf file for thompson microphysics
+        cfg: ExperimentConfig holding the arrays to modify, or None, in which
+             case the environment is used
     Returns:
         boolean: sdf_uses_thompson_mp
     """
 
     print_input_args(locals())
 
-    # import all environment variables
-    import_vars()
+    EXPORTS = [
+        "CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING",
+        "FIXgsm_FILES_TO_COPY_TO_FIXam",
+    ]
+    IMPORTS = EXPORTS + ["CCPP_PHYS_SUITE", "EXTRN_MDL_NAME_ICS", "EXTRN_MDL_NAME_LBCS"]
+    from_env = cfg is None
+    if from_env:
+        cfg = ExperimentConfig.from_env(IMPORTS)
 
     #
     # -----------------------------------------------------------------------
@@ -79,16 +86,16 @@ def set_thompson_mp_fix_files(ccpp_phys_suite_fp, thompson_mp_climo_fn):
             "qr_acr_qsV2.dat",
         ]
 
-        if (EXTRN_MDL_NAME_ICS != "HRRR" and EXTRN_MDL_NAME_ICS != "RAP") or (
-            EXTRN_MDL_NAME_LBCS != "HRRR" and EXTRN_MDL_NAME_LBCS != "RAP"
+        if (cfg.EXTRN_MDL_NAME_ICS != "HRRR" and cfg.EXTRN_MDL_NAME_ICS != "RAP") or (
+            cfg.EXTRN_MDL_NAME_LBCS != "HRRR" and cfg.EXTRN_MDL_NAME_LBCS != "RAP"
         ):
             thompson_mp_fix_files.append(thompson_mp_climo_fn)
 
-        FIXgsm_FILES_TO_COPY_TO_FIXam.extend(thompson_mp_fix_files)
+        cfg.FIXgsm_FILES_TO_COPY_TO_FIXam.extend(thompson_mp_fix_files)
 
         for fix_file in thompson_mp_fix_files:
             mapping = f"{fix_file} | {fix_file}"
-            CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING.append(mapping)
+            cfg.CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING.append(mapping)
 
         msg = dedent(
             f"""
@@ -104,23 +111,21 @@ def set_thompson_mp_fix_files(ccpp_phys_suite_fp, thompson_mp_climo_fn):
         )
         msg += dedent(
             f"""
-                CCPP_PHYS_SUITE = \"{CCPP_PHYS_SUITE}\"
+                CCPP_PHYS_SUITE = \"{cfg.CCPP_PHYS_SUITE}\"
 
-                FIXgsm_FILES_TO_COPY_TO_FIXam = {list_to_str(FIXgsm_FILES_TO_COPY_TO_FIXam)}
+                FIXgsm_FILES_TO_COPY_TO_FIXam = {list_to_str(cfg.FIXgsm_FILES_TO_COPY_TO_FIXam)}
             """
         )
         msg += dedent(
             f"""
-                CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING = {list_to_str(CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING)}
+                CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING = {list_to_str(cfg.CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING)}
             """
         )
         print_info_msg(msg)
 
-        EXPORTS = [
-            "CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING",
-            "FIXgsm_FILES_TO_COPY_TO_FIXam",
-        ]
-        export_vars(env_vars=EXPORTS)
+        # export the arrays to environment when called on its own
+        if from_env:
+            cfg.export_env(EXPORTS)
 
     return sdf_uses_thompson_mp
 
@@ -13,14 +13,15 @@ from python_utils import (
     lowercase,
     uppercase,
     check_for_preexist_dir_file,
+    ExperimentConfig,
     flatten_dict,
     update_dict,
     import_vars,
-    export_vars,
     get_env_var,
     print_info_msg,
     print_err_msg_exit,
     load_config_file,
+    config_cache_summary,
     cfg_to_shell_str,
     cfg_to_yaml_str,
     load_shell_config,
@@ -37,6 +38,7 @@ from set_gridparams_GFDLgrid import set_gridparams_GFDLgrid
 from link_fix import link_fix
 from check_ruc_lsm import check_ruc_lsm
 from set_thompson_mp_fix_files import set_thompson_mp_fix_files
+from create_task_var_defns_files import create_task_var_defns_files
 
 
 def setup():
@@ -53,7 +55,7 @@ def setup():
     Args:
       None
     Returns:
-      None
+      ExperimentConfig holding the experiment variables
     """
 
     ushdir = os.path.dirname(os.path.abspath(__file__))
@@ -62,6 +64,11 @@ def setup():
     # import all environment variables
     import_vars()
 
+    # the experiment variables are the globals of this module; the functions
+    # called below read and set them through this config object instead of
+    # through the environment
+    expt_cfg = ExperimentConfig(globals())
+
     # print message
     print_info_msg(
         f"""
@@ -123,13 +130,8 @@ def setup():
     #
     # -----------------------------------------------------------------------
     #
-    # export env vars before calling another module
-    export_vars()
-
     if PREDEF_GRID_NAME:
-        set_predef_grid_params()
-
-    import_vars()
+        set_predef_grid_params(expt_cfg)
 
     #
     # -----------------------------------------------------------------------
@@ -395,6 +397,9 @@ def setup():
     MACHINE_FILE = MACHINE_FILE or os.path.join(
         USHDIR, "machine", f"{lowercase(MACHINE)}.sh"
     )
+
+    # the machine file is sourced by a shell and may use experiment variables
+    expt_cfg.export_env()
     machine_cfg = load_shell_config(MACHINE_FILE)
     import_vars(dictionary=machine_cfg)
 
@@ -1117,14 +1122,9 @@ def setup():
     #
     # -----------------------------------------------------------------------
     #
-
-    # export env vars before calling another module
-    export_vars()
-
-    OZONE_PARAM = set_ozone_param(ccpp_phys_suite_fp=CCPP_PHYS_SUITE_IN_CCPP_FP)
-
-    IMPORTS = ["CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING", "FIXgsm_FILES_TO_COPY_TO_FIXam"]
-    import_vars(env_vars=IMPORTS)
+    OZONE_PARAM = set_ozone_param(
+        ccpp_phys_suite_fp=CCPP_PHYS_SUITE_IN_CCPP_FP, cfg=expt_cfg
+    )
     #
     # -----------------------------------------------------------------------
     #
@@ -1535,14 +1535,7 @@ def setup():
     #
     # -----------------------------------------------------------------------
     #
-
-    # export env vars before calling another module
-    export_vars()
-
-    set_extrn_mdl_params()
-
-    IMPORTS = ["EXTRN_MDL_LBCS_OFFSET_HRS"]
-    import_vars(env_vars=IMPORTS)
+    set_extrn_mdl_params(expt_cfg)
     #
     # -----------------------------------------------------------------------
     #
@@ -1565,6 +1558,7 @@ def setup():
             iend_of_t7_on_t6g=GFDLgrid_IEND_OF_RGNL_DOM_ON_T6G,
             jstart_of_t7_on_t6g=GFDLgrid_JSTART_OF_RGNL_DOM_ON_T6G,
             jend_of_t7_on_t6g=GFDLgrid_JEND_OF_RGNL_DOM_ON_T6G,
+            cfg=expt_cfg,
         )
     #
     # -----------------------------------------------------------------------
@@ -1583,6 +1577,7 @@ def setup():
             halo_width=ESGgrid_WIDE_HALO_WIDTH,
             delx=ESGgrid_DELX,
             dely=ESGgrid_DELY,
+            cfg=expt_cfg,
         )
     #
     # -----------------------------------------------------------------------
@@ -1642,15 +1637,11 @@ def setup():
     #
     # -----------------------------------------------------------------------
     #
-
-    # export env vars
-    export_vars()
-
     # link fix files
     res_in_grid_fns = ""
     if not RUN_TASK_MAKE_GRID:
 
-        res_in_grid_fns = link_fix(verbose=VERBOSE, file_group="grid")
+        res_in_grid_fns = link_fix(verbose=VERBOSE, file_group="grid", cfg=expt_cfg)
 
         RES_IN_FIXLAM_FILENAMES = res_in_grid_fns
     #
@@ -1665,7 +1656,7 @@ def setup():
     res_in_orog_fns = ""
     if not RUN_TASK_MAKE_OROG:
 
-        res_in_orog_fns = link_fix(verbose=VERBOSE, file_group="orog")
+        res_in_orog_fns = link_fix(verbose=VERBOSE, file_group="orog", cfg=expt_cfg)
 
         if not RES_IN_FIXLAM_FILENAMES and (res_in_orog_fns != RES_IN_FIXLAM_FILENAMES):
             print_err_msg_exit(
@@ -1691,7 +1682,9 @@ def setup():
     res_in_sfc_climo_fns = ""
     if not RUN_TASK_MAKE_SFC_CLIMO:
 
-        res_in_sfc_climo_fns = link_fix(verbose=VERBOSE, file_group="sfc_climo")
+        res_in_sfc_climo_fns = link_fix(
+            verbose=VERBOSE, file_group="sfc_climo", cfg=expt_cfg
+        )
 
         if RES_IN_FIXLAM_FILENAMES and res_in_sfc_climo_fns != RES_IN_FIXLAM_FILENAMES:
             print_err_msg_exit(
@@ -1822,11 +1815,9 @@ def setup():
     SDF_USES_THOMPSON_MP = set_thompson_mp_fix_files(
         ccpp_phys_suite_fp=CCPP_PHYS_SUITE_IN_CCPP_FP,
         thompson_mp_climo_fn=THOMPSON_MP_CLIMO_FN,
+        cfg=expt_cfg,
     )
 
-    IMPORTS = ["CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING", "FIXgsm_FILES_TO_COPY_TO_FIXam"]
-    import_vars(env_vars=IMPORTS)
-
     #
     # -----------------------------------------------------------------------
     #
@@ -1852,6 +1843,10 @@ def setup():
     #    perform the various tasks in the workflow (and which source the va-
     #    riable defintions file).
     #
+    # If USE_TASK_VAR_DEFNS_FILES is set, a copy of this file with only the
+    # variables that each J-job uses is then created for that J-job in
+    # TASK_VAR_DEFNS_DIR.
+    #
     # First, set the full path to the variable definitions file and copy the
     # default configuration script into it.
     #
@@ -1859,8 +1854,9 @@ def setup():
     #
 
     # global variable definition file path
-    global GLOBAL_VAR_DEFNS_FP
+    global GLOBAL_VAR_DEFNS_FP, TASK_VAR_DEFNS_DIR
     GLOBAL_VAR_DEFNS_FP = os.path.join(EXPTDIR, GLOBAL_VAR_DEFNS_FN)
+    TASK_VAR_DEFNS_DIR = os.path.join(EXPTDIR, "task_var_defns")
 
     # update dictionary with globals() values
     update_dict(globals(), cfg_d)
@@ -1945,6 +1941,7 @@ def setup():
         # -----------------------------------------------------------------------
         #
         "GLOBAL_VAR_DEFNS_FP": GLOBAL_VAR_DEFNS_FP,
+        "TASK_VAR_DEFNS_DIR": TASK_VAR_DEFNS_DIR,
         "DATA_TABLE_FN": DATA_TABLE_FN,
         "DIAG_TABLE_FN": DIAG_TABLE_FN,
         "FIELD_TABLE_FN": FIELD_TABLE_FN,
@@ -2169,8 +2166,13 @@ def setup():
     with open(GLOBAL_VAR_DEFNS_FP, "a") as f:
         f.write(cfg_to_shell_str(cfg_d))
 
-    # export all global variables back to the environment
-    export_vars()
+    # write the variable definitions files of the tasks
+    if USE_TASK_VAR_DEFNS_FILES:
+        create_task_var_defns_files(cfg_d, TASK_VAR_DEFNS_DIR, verbose=VERBOSE)
+
+    # export all experiment variables to the environment for the scripts
+    # and programs run from here on
+    expt_cfg.export_env()
 
     #
     # -----------------------------------------------------------------------
@@ -2202,6 +2204,7 @@ def setup():
     #
     # -----------------------------------------------------------------------
     #
+    print_info_msg(config_cache_summary(), verbose=VERBOSE)
     print_info_msg(
         f"""
         ========================================================================
@@ -2209,6 +2212,8 @@ def setup():
         ========================================================================"""
     )
 
+    return expt_cfg
+
 
 #
 # -----------------------------------------------------------------------
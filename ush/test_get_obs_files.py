@@ -0,0 +1,299 @@
+'''
+Test suite for staging observations with get_obs_files.py.
+
+The tests run against fake hsi and htar executables backed by local tar
+files standing in for the observation tarballs on HPSS, so they are
+runnable anywhere.
+
+To run the full test suite:
+
+    python -m unittest -b test_get_obs_files.py
+'''
+
+import datetime as dt
+import gzip
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import get_obs_files
+import retrieve_data
+from test_retrieve_data import FakeHPSS
+
+FAKE_WGRIB2 = """#!/bin/sh
+# A stand-in for wgrib2 -set_date that marks the file as shifted
+{ printf 'shifted '; cat "$1"; } > "$5"
+"""
+
+
+class ObsTestCase(unittest.TestCase):
+
+    ''' Stages observations from tarballs on a fake HPSS '''
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.obs_dir = os.path.join(self.tmp_dir, 'obs')
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+        self.hpss = FakeHPSS(self.tmp_dir)
+        self.hpss.__enter__()
+        self.addCleanup(self.hpss.__exit__, None, None, None)
+
+    def htar_calls(self, mode):
+        ''' Return the archives htar was called on in mode, -tf or -xvf '''
+        return [
+            call.split()[1] for call in self.hpss.calls('htar')
+            if call.split()[0] == mode
+        ]
+
+    def read(self, *path):
+        with open(os.path.join(self.obs_dir, *path), 'rb') as fn:
+            return fn.read()
+
+    def add_ccpa_day(self, day):
+        ''' Put a CCPA tarball of a day on the fake HPSS, holding the 1-,
+        3- and 6-hourly files of each 6-hourly period in a directory named
+        for the hour it ends at '''
+        members = {}
+        for hour in range(24):
+            period_end = f'{(-(-hour // 6) * 6) % 24:02d}'
+            for accum in ('01', '03', '06'):
+                name = f'./{period_end}/ccpa.t{hour:02d}z.{accum}h.hrap.conus.gb2'
+                members[name] = f'{day} {name}'.encode()
+        path = get_obs_files.runhistory(day, get_obs_files.ccpa_tarball(day))
+        self.hpss.add_tar(path, members)
+        return path
+
+    def add_ndas(self, valid):
+        ''' Put the NAM prepbufr tarball of a synoptic time on the fake
+        HPSS, and return its path '''
+        valid = retrieve_data.to_datetime(valid)
+        path = get_obs_files.runhistory(
+            f'{valid:%Y%m%d}', get_obs_files.ndas_tarball(valid))
+        self.hpss.add_tar(path, {
+            f'./nam.t{valid:%H}z.{kind}.tm{offset:02d}.nr': f'{valid} {offset}'.encode()
+            for kind in ('prepbufr', 'prepbufr_pre-qc')
+            for offset in range(7)
+        })
+        return path
+
+
+class StagingTesting(ObsTestCase):
+
+    def test_ccpa_one_extraction_per_tarball(self):
+        ''' The 24 hours of a forecast spanning two days are staged by
+        listing and extracting from each daily tarball once '''
+        archives = [self.add_ccpa_day(day) for day in ('20220625', '20220626')]
+        self.add_ccpa_day('20220627')
+
+        unstaged = get_obs_files.get_obs(
+            'CCPA', dt.datetime(2022, 6, 25, 12), 24, self.obs_dir)
+
+        self.assertEqual(unstaged, [])
+        self.assertEqual(sorted(self.htar_calls('-tf')), archives)
+        self.assertEqual(sorted(self.htar_calls('-xvf')), archives)
+        staged = [
+            os.path.join(day, name)
+            for day in os.listdir(os.path.join(self.obs_dir, 'proc'))
+            for name in os.listdir(os.path.join(self.obs_dir, 'proc', day))
+        ]
+        self.assertEqual(len(staged), 24)
+        self.assertEqual(
+            self.read('proc', '20220625', 'ccpa.t13z.01h.hrap.conus.gb2'),
+            b'20220625 ./18/ccpa.t13z.01h.hrap.conus.gb2')
+        self.assertEqual(
+            self.read('proc', '20220625', 'ccpa.t21z.01h.hrap.conus.gb2'),
+            b'20220626 ./00/ccpa.t21z.01h.hrap.conus.gb2')
+        self.assertEqual(
+            self.read('proc', '20220626', 'ccpa.t00z.01h.hrap.conus.gb2'),
+            b'20220626 ./00/ccpa.t00z.01h.hrap.conus.gb2')
+
+    def test_ccpa_shift_day(self):
+        ''' One hour files from the 00 directories of the days with wrong
+        dates are shifted back a day with wgrib2, and others are copied '''
+        for day in ('20200625', '20200626'):
+            self.add_ccpa_day(day)
+        wgrib2 = os.path.join(self.hpss.bin_dir, 'wgrib2')
+        with open(wgrib2, 'w') as fn:
+            fn.write(FAKE_WGRIB2)
+        os.chmod(wgrib2, 0o755)
+
+        unstaged = get_obs_files.get_obs(
+            'CCPA', dt.datetime(2020, 6, 25, 12), 12, self.obs_dir)
+
+        self.assertEqual(unstaged, [])
+        self.assertEqual(
+            self.read('proc', '20200625', 'ccpa.t18z.01h.hrap.conus.gb2'),
+            b'20200625 ./18/ccpa.t18z.01h.hrap.conus.gb2')
+        for day, hour in (('20200625', 19), ('20200626', 0)):
+            self.assertEqual(
+                self.read('proc', day, f'ccpa.t{hour:02d}z.01h.hrap.conus.gb2'),
+                f'shifted 20200626 ./00/ccpa.t{hour:02d}z.01h.hrap.conus.gb2'.encode())
+
+    def test_ndas_rerun(self):
+        ''' Each synoptic tarball is opened once for the six hours it holds,
+        and a rerun finds everything in place without calling htar '''
+        archives = [
+            self.add_ndas(valid) for valid in ('2022062512', '2022062518', '2022062600')
+        ]
+
+        for _ in range(2):
+            unstaged = get_obs_files.get_obs(
+                'NDAS', dt.datetime(2022, 6, 25, 12), 12, self.obs_dir)
+            self.assertEqual(unstaged, [])
+
+        self.assertEqual(sorted(self.htar_calls('-xvf')), sorted(archives))
+        self.assertEqual(len(os.listdir(os.path.join(self.obs_dir, 'proc'))), 18)
+        self.assertEqual(
+            self.read('proc', 'prepbufr.ndas.2022062521'),
+            b'2022-06-26 00:00:00 3')
+
+    def test_mrms_fields_share_extraction(self):
+        ''' The files of both fields for a day are extracted from its
+        tarball at once, and the ones closest to each hour are unzipped.
+        Before the reorganization, the second candidate tarball is used
+        when the first is missing. '''
+        archives = []
+        for day in ('20200302', '20200303'):
+            members = {}
+            for product, level in get_obs_files.MRMS_FIELDS.values():
+                directory = os.path.relpath(
+                    get_obs_files.mrms_pull_topofhour.product_dir('', day, product), day)
+                for hour in range(24):
+                    name = f'{directory}/{product}{level}{day}-{hour:02d}0200.grib2.gz'
+                    members[f'./{name}'] = gzip.compress(name.encode())
+            path = get_obs_files.mrms_tarballs(day)[-1]
+            self.hpss.add_tar(path, members)
+            archives.append(path)
+
+        unstaged = get_obs_files.get_obs(
+            'MRMS', dt.datetime(2020, 3, 2, 12), 24, self.obs_dir)
+
+        self.assertEqual(unstaged, [])
+        self.assertEqual(sorted(self.htar_calls('-xvf')), archives)
+        for day in ('20200302', '20200303'):
+            self.assertEqual(
+                len(os.listdir(os.path.join(self.obs_dir, 'proc', day))), 48)
+        self.assertTrue(self.read(
+            'proc', '20200302', 'EchoTop_18_00.50_20200302-120000.grib2'
+        ).endswith(b'EchoTop_18_00.50_20200302-120200.grib2.gz'))
+
+    def test_missing_tarball_exits(self):
+        ''' The script exits with a non-zero status when a tarball is
+        missing, after staging the hours it can '''
+        valid = dt.datetime(2022, 6, 25, 12)
+        self.hpss.add_tar(
+            get_obs_files.runhistory('20220625', get_obs_files.ndas_tarball(valid)),
+            {f'./nam.t12z.prepbufr.tm{offset:02d}.nr': b'' for offset in range(6)})
+
+        with self.assertRaises(SystemExit) as context:
+            get_obs_files.main([
+                '--obtype', 'NDAS',
+                '--cycle_date', '2022062512',
+                '--fcst_length', '6',
+                '--obs_dir', self.obs_dir,
+            ])
+
+        self.assertEqual(context.exception.code, 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.obs_dir, 'proc'))), 6)
+
+
+class CacheTesting(ObsTestCase):
+
+    ''' Staging observations through a cache shared by experiments '''
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'obs_cache')
+
+    def cache(self, obtype, max_bytes=0):
+        return retrieve_data.FileCache(
+            self.cache_dir, 'obs', obtype, max_bytes=max_bytes)
+
+    def test_cache_shared_across_experiments(self):
+        ''' A second experiment verifying the same hours links them from
+        the cache without calling htar, and only stages the new ones '''
+        archives = [self.add_ndas(valid) for valid in ('2022062512', '2022062518')]
+        first = os.path.join(self.tmp_dir, 'expt1', 'ndas')
+        second = os.path.join(self.tmp_dir, 'expt2', 'ndas')
+
+        get_obs_files.main([
+            '--obtype', 'NDAS',
+            '--cycle_date', '2022062512',
+            '--fcst_length', '6',
+            '--obs_dir', first,
+            '--cache_dir', self.cache_dir,
+        ])
+        self.assertEqual(sorted(self.htar_calls('-xvf')), archives)
+
+        unstaged = get_obs_files.get_obs(
+            'NDAS', dt.datetime(2022, 6, 25, 18), 0, second,
+            cache=self.cache('NDAS'))
+
+        self.assertEqual(unstaged, [])
+        self.assertEqual(sorted(self.htar_calls('-xvf')), archives)
+        staged = sorted(os.listdir(os.path.join(second, 'proc')))
+        self.assertEqual(len(staged), 6)
+        for name in staged:
+            self.assertTrue(os.path.samefile(
+                os.path.join(first, 'proc', name),
+                os.path.join(second, 'proc', name)))
+        self.assertFalse(os.path.exists(os.path.join(second, 'raw')))
+
+    def test_concurrent_experiments_read_tarballs_once(self):
+        ''' Experiments staging the same hours at the same time wait for
+        each other instead of each reading the tarballs '''
+        archives = [self.add_ccpa_day(day) for day in ('20220625', '20220626')]
+        self.hpss.env.stop()
+        self.hpss = FakeHPSS(self.tmp_dir, delay=0.3)
+        self.hpss.__enter__()
+        self.addCleanup(self.hpss.__exit__, None, None, None)
+
+        results = {}
+
+        def experiment(name):
+            results[name] = get_obs_files.get_obs(
+                'CCPA', dt.datetime(2022, 6, 25, 12), 24,
+                os.path.join(self.tmp_dir, name, 'ccpa'), cache=self.cache('CCPA'))
+
+        threads = [
+            threading.Thread(target=experiment, args=(name,))
+            for name in ('expt1', 'expt2', 'expt3')
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {'expt1': [], 'expt2': [], 'expt3': []})
+        self.assertEqual(sorted(self.htar_calls('-xvf')), archives)
+        for name in ('expt1', 'expt2', 'expt3'):
+            self.assertEqual(
+                len(os.listdir(os.path.join(self.tmp_dir, name, 'ccpa', 'proc', '20220625'))),
+                11)
+
+    def test_cache_size_limit(self):
+        ''' The least recently used observations are evicted to keep the
+        cache under its size limit, without touching the staged files '''
+        self.add_ndas('2022062512')
+        size = len(b'2022-06-25 12:00:00 0')
+
+        unstaged = get_obs_files.get_obs(
+            'NDAS', dt.datetime(2022, 6, 25, 12), 0, self.obs_dir,
+            cache=self.cache('NDAS', max_bytes=2 * size))
+
+        self.assertEqual(unstaged, [])
+        self.assertEqual(len(os.listdir(os.path.join(self.obs_dir, 'proc'))), 6)
+        cached = [
+            name
+            for _, dir_names, file_names in os.walk(self.cache_dir)
+            for name in file_names
+            if not name.startswith('.')
+        ]
+        self.assertEqual(len(cached), 2)
@@ -14,14 +14,632 @@ To run the full test suite:
 To run a single test:
 
     python -m unittest -b test_retrieve_data.FunctionalTesting.test_rap_lbcs_from_aws
+
+FunctionalTesting retrieves from the real data stores. StandInFunctionalTesting
+runs the same retrievals against stand-ins for the data stores of
+templates/data_locations.yml: a local HTTP server for the download data
+stores, and fake hsi and htar executables backed by local tar files for
+HPSS, both filled with synthetic files. They are runnable anywhere,
+without a network connection:
+
+    python -m unittest -b test_retrieve_data.StandInFunctionalTesting
+
+The benchmarks run against the same stand-ins, so they are runnable
+anywhere too. They time retrievals and print the results, so they are
+skipped unless RETRIEVE_DATA_BENCHMARK is set:
+
+    RETRIEVE_DATA_BENCHMARK=1 python -m unittest test_retrieve_data.DownloadBenchmark
+    RETRIEVE_DATA_BENCHMARK=1 python -m unittest test_retrieve_data.RetrievalBenchmark
 '''
+import argparse
+import asyncio
+import contextlib
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import functools
 import glob
+import http.server
+import io
+import itertools
+import json
 import os
+import random
+import shutil
+import tarfile
 import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from urllib.parse import urlparse
+import zipfile
 
+import yaml
+
+from python_utils import config_parser
 import retrieve_data
 
+# Run the benchmarks, which compare elapsed times, along with the tests
+BENCHMARK = bool(os.environ.get('RETRIEVE_DATA_BENCHMARK'))
+benchmark = unittest.skipUnless(
+    BENCHMARK, 'Set RETRIEVE_DATA_BENCHMARK to run the benchmarks')
+
+
+def setUpModule():
+
+    ''' Keep the parsed config files of the tests in a temporary
+    directory rather than in one set for real runs. '''
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(tmp_dir.cleanup)
+    config_cache = mock.patch.dict(os.environ, {
+        'REGIONAL_WORKFLOW_CONFIG_CACHE': os.path.join(tmp_dir.name, 'config')})
+    config_cache.start()
+    unittest.addModuleCleanup(config_cache.stop)
+
+
+def data_files(path):
+
+    ''' List the retrieved files in path, leaving out the hidden
+    manifest. '''
+
+    return sorted(f for f in os.listdir(path) if not f.startswith('.'))
+
+
+class StandInServer:
+
+    ''' Serve a local directory over HTTP/1.1 on an ephemeral localhost
+    port, with keep-alive and single byte-range requests. Each request is
+    delayed to mimic the latency of a remote data store. Like a throttling
+    data store, the server answers 429 to the first throttle_first
+    requests, and to any request beyond max_rate in the last second. Each
+    response is sent at no more than stream_rate bytes per second, like a
+    single stream from a remote data store, and the first cut_ranges
+    byte range responses are cut off halfway. With redirect_to set, every
+    request is redirected to the same path below that url instead. The
+    number of connections opened, the paths requested, the Range headers
+    received, the number of 429 responses, and the largest number of
+    requests in progress at once are recorded. Use as a context
+    manager. '''
+
+    def __init__(self, directory, delay=0.0, throttle_first=0, max_rate=None,
+                 retry_after=None, stream_rate=None, cut_ranges=0,
+                 redirect_to=None):
+        self.directory = directory
+        self.delay = delay
+        self.throttle_first = throttle_first
+        self.max_rate = max_rate
+        self.retry_after = retry_after
+        self.stream_rate = stream_rate
+        self.cut_ranges = cut_ranges
+        self.redirect_to = redirect_to
+        self.connections = 0
+        self.requests = []
+        self.ranges = []
+        self.throttled = 0
+        self.arrivals = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        ''' Base url of the running server '''
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        delay = self.delay
+        server = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+
+            ''' Quiet request handler with an artificial delay and Range
+            support '''
+
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                with server.lock:
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    super().do_GET()
+                finally:
+                    with server.lock:
+                        server.active -= 1
+
+            def send_head(self):
+                time.sleep(delay)
+                if server.throttle():
+                    self.send_response(429)
+                    if server.retry_after is not None:
+                        self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return None
+                server.requests.append(self.path)
+                if server.redirect_to is not None:
+                    self.send_response(302)
+                    self.send_header('Location', server.redirect_to + self.path)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return None
+                byte_range = self.headers.get('Range')
+                path = self.translate_path(self.path)
+                if byte_range is None or not os.path.isfile(path):
+                    return super().send_head()
+
+                server.ranges.append(byte_range)
+                size = os.path.getsize(path)
+                first, _, last = byte_range.split('=')[1].partition('-')
+                first = int(first)
+                last = min(int(last), size - 1) if last else size - 1
+                if first >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return None
+
+                with open(path, 'rb') as served:
+                    served.seek(first)
+                    body = served.read(last - first + 1)
+                self.send_response(206)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Range', f'bytes {first}-{last}/{size}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                with server.lock:
+                    cut = server.cut_ranges > 0
+                    server.cut_ranges = max(server.cut_ranges - 1, 0)
+                if cut:
+                    self.close_connection = True
+                    body = body[:len(body) // 2]
+                return io.BytesIO(body)
+
+            def handle(self):
+                # Clients may stop reading a response part way through
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def end_headers(self):
+                self.send_header('Accept-Ranges', 'bytes')
+                super().end_headers()
+
+            def copyfile(self, source, outputfile):
+                while True:
+                    chunk = source.read(64 * 1024)
+                    if not chunk:
+                        break
+                    outputfile.write(chunk)
+                    if server.stream_rate:
+                        time.sleep(len(chunk) / server.stream_rate)
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+
+        handler = functools.partial(Handler, directory=self.directory)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def throttle(self):
+        ''' Record the arrival of a request, and return whether it
+        should be throttled '''
+        with self.lock:
+            now = time.monotonic()
+            self.arrivals = [t for t in self.arrivals if now - t < 1] + [now]
+            throttled = self.throttle_first > 0 or bool(
+                self.max_rate and len(self.arrivals) > self.max_rate)
+            self.throttle_first = max(self.throttle_first - 1, 0)
+            self.throttled += throttled
+            return throttled
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+def write_stand_in_config(path, url, file_names, **store_specs):
+
+    ''' Write a data_locations style config file with a single FV3GFS
+    download data store at the given url. Any other store_specs are added
+    to the data store entry. '''
+
+    config = {
+        'FV3GFS': {
+            'nomads': {
+                'protocol': 'download',
+                'url': url,
+                'file_names': {'grib2': {'fcst': file_names}},
+                **store_specs,
+            },
+        },
+    }
+    with open(path, 'w') as config_file:
+        yaml.dump(config, config_file)
+
+
+def grib2_like(records, cycle_date='2022062512'):
+
+    ''' Make GRIB2-like messages and the lines of their .idx inventory.
+    Each message starts with "GRIB", carries its total length in octets
+    9-16, and ends with "7777", like a real GRIB2 message. records is a
+    list of (variable, level, payload size). Return the list of messages
+    and the list of inventory lines. '''
+
+    messages = []
+    index = []
+    offset = 0
+    for num, (variable, level, size) in enumerate(records, start=1):
+        length = 16 + size + 4
+        message = (b'GRIB\x00\x00\x00\x02' + length.to_bytes(8, 'big')
+                   + os.urandom(size) + b'7777')
+        messages.append(message)
+        index.append(f'{num}:{offset}:d={cycle_date}:{variable}:{level}:anl:')
+        offset += length
+    return messages, index
+
+
+def write_grib2_like(path, records, cycle_date='2022062512'):
+
+    ''' Write a file of GRIB2-like messages and its .idx inventory.
+    Return the list of messages. '''
+
+    messages, index = grib2_like(records, cycle_date)
+    with open(path, 'wb') as grib_file:
+        grib_file.write(b''.join(messages))
+    with open(f'{path}.idx', 'w') as idx_file:
+        idx_file.write('\n'.join(index) + '\n')
+    return messages
+
+
+FAKE_HSI = """#!/usr/bin/env python3
+''' A stand-in for hsi that serves files below FAKE_HPSS_ROOT and logs
+each invocation to FAKE_HPSS_LOG. With FAKE_HSI_DELAY set, it logs its
+process ID to FAKE_HSI_PIDS and waits that many seconds first. '''
+import os
+import shutil
+import sys
+import time
+
+root = os.environ['FAKE_HPSS_ROOT']
+with open(os.environ['FAKE_HPSS_LOG'], 'a') as log:
+    log.write(' '.join(sys.argv) + '\\n')
+if float(os.environ['FAKE_HSI_DELAY']):
+    with open(os.environ['FAKE_HSI_PIDS'], 'a') as pids:
+        pids.write(f'{os.getpid()}\\n')
+    time.sleep(float(os.environ['FAKE_HSI_DELAY']))
+
+def run(command):
+    op, *args = command.split()
+    path = args[-1]
+    local = root + path
+    if not os.path.exists(local):
+        print('*** hpss_Lstat: No such file or directory [-2: HPSS_ENOENT]',
+              file=sys.stderr)
+        print(f'    {path}', file=sys.stderr)
+        return 72
+    if op == 'ls':
+        stat = os.stat(local)
+        print(f'FILE\\t{path}\\t{stat.st_size}\\t{stat.st_mtime}')
+    elif op == 'get':
+        shutil.copy(local, os.path.basename(path))
+    return 0
+
+args = [arg for arg in sys.argv[1:] if arg not in ('-P', '-q')]
+if args[0] == 'in':
+    status = 0
+    with open(args[1]) as commands:
+        for command in commands:
+            if command.strip():
+                status = run(command) or status
+    sys.exit(status)
+sys.exit(run(' '.join(args)))
+"""
+
+FAKE_HTAR = """#!/usr/bin/env python3
+''' A stand-in for htar that lists or extracts members of tar files below
+FAKE_HPSS_ROOT into the working directory, after FAKE_HPSS_DELAY seconds,
+logs each invocation to FAKE_HPSS_LOG, and the times it started and
+ended to FAKE_HPSS_SPANS '''
+import atexit
+import os
+import sys
+import tarfile
+import time
+
+def log_span(start):
+    with open(os.environ['FAKE_HPSS_SPANS'], 'a') as spans:
+        spans.write(f'{start} {time.time()}\\n')
+
+atexit.register(log_span, time.time())
+root = os.environ['FAKE_HPSS_ROOT']
+with open(os.environ['FAKE_HPSS_LOG'], 'a') as log:
+    log.write(' '.join(sys.argv) + '\\n')
+time.sleep(float(os.environ.get('FAKE_HPSS_DELAY', 0)))
+
+mode, archive, *paths = sys.argv[1:]
+if mode == '-tf':
+    with tarfile.open(root + archive) as tar:
+        for member in tar:
+            print(f'HTAR: -rw-r--r--  nwprod/prod  {member.size:>10} '
+                  f'2022-06-25 13:05  {member.name}')
+    print(f'HTAR: Listing complete for {archive}')
+    sys.exit(0)
+
+status = 0
+with tarfile.open(root + archive) as tar:
+    members = {os.path.normpath(member.name): member for member in tar}
+    for path in paths:
+        member = members.get(os.path.normpath(path))
+        if member is None:
+            print(f'ERROR: No such file: {path}', file=sys.stderr)
+            status = 72
+            continue
+        tar.extract(member)
+sys.exit(status)
+"""
+
+
+class FakeHPSS:
+
+    ''' Put a fake hsi executable on PATH that serves files from a local
+    directory standing in for the HPSS namespace. Use as a context
+    manager. '''
+
+    def __init__(self, tmp_dir, delay=0.0, hsi_delay=0.0):
+        self.root = os.path.join(tmp_dir, 'hpss')
+        self.bin_dir = os.path.join(tmp_dir, 'bin')
+        self.log = os.path.join(tmp_dir, 'hpss.log')
+        self.spans = os.path.join(tmp_dir, 'htar_spans.log')
+        self.pids = os.path.join(tmp_dir, 'hsi_pids.log')
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.bin_dir, exist_ok=True)
+        for name, script in (('hsi', FAKE_HSI), ('htar', FAKE_HTAR)):
+            executable = os.path.join(self.bin_dir, name)
+            with open(executable, 'w') as fn:
+                fn.write(script)
+            os.chmod(executable, 0o755)
+        self.env = mock.patch.dict(os.environ, {
+            'PATH': f'{self.bin_dir}{os.pathsep}{os.environ["PATH"]}',
+            'FAKE_HPSS_ROOT': self.root,
+            'FAKE_HPSS_LOG': self.log,
+            'FAKE_HPSS_SPANS': self.spans,
+            'FAKE_HPSS_DELAY': str(delay),
+            'FAKE_HSI_DELAY': str(hsi_delay),
+            'FAKE_HSI_PIDS': self.pids,
+            'XDG_CACHE_HOME': os.path.join(tmp_dir, 'xdg_cache'),
+        })
+
+    def add(self, path, content=b''):
+        ''' Create a file at path in the fake HPSS namespace '''
+        local = self.root + path
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(local, 'wb') as fn:
+            fn.write(content)
+
+    def add_tar(self, path, members):
+        ''' Create a tar file at path in the fake HPSS namespace holding
+        members, a dict of member names and their content '''
+        local = self.root + path
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with tarfile.open(local, 'w') as tar:
+            for name, content in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+
+    def calls(self, program='hsi'):
+        ''' Return the list of arguments of each invocation of program
+        logged so far '''
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as log:
+            return [
+                line.split(maxsplit=1)[1].strip()
+                for line in log
+                if os.path.basename(line.split()[0]) == program
+            ]
+
+    def hsi_pids(self):
+        ''' Return the process IDs of the delayed hsi calls started so
+        far '''
+        if not os.path.exists(self.pids):
+            return []
+        with open(self.pids) as pids:
+            return [int(pid) for pid in pids]
+
+    def max_htar_sessions(self):
+        ''' Return the largest number of htar calls that ran at once, and
+        start counting anew '''
+        if not os.path.exists(self.spans):
+            return 0
+        with open(self.spans) as spans:
+            events = []
+            for line in spans:
+                start, end = map(float, line.split())
+                events += [(start, 1), (end, -1)]
+        os.remove(self.spans)
+        running = peak = 0
+        for _, change in sorted(events):
+            running += change
+            peak = max(peak, running)
+        return peak
+
+    def __enter__(self):
+        self.env.start()
+        return self
+
+    def __exit__(self, *args):
+        self.env.stop()
+
+
+def synthetic_file(file_name, size, cycle_date='2022062512'):
+
+    ''' Make the content of a synthetic file of about size bytes, in
+    the format its name implies: GRIB2-like messages for GRIB2 files, a
+    netCDF signature followed by random bytes for netCDF files, and
+    random bytes otherwise. Return the content, and the lines of the .idx
+    inventory of a GRIB2 file or None. '''
+
+    if 'grib2' in file_name or 'pgrb2' in file_name:
+        messages, index = grib2_like(
+            [(variable, level, max(size // 4 - 20, 1)) for variable, level in (
+                ('TMP', '500 mb'),
+                ('UGRD', '10 m above ground'),
+                ('VGRD', '10 m above ground'),
+                ('PRES', 'surface'),
+            )],
+            cycle_date,
+        )
+        return b''.join(messages), index
+    if file_name.endswith('.nc'):
+        return b'CDF\x01' + os.urandom(max(size - 4, 1)), None
+    return os.urandom(size), None
+
+
+class StandInDataStores:
+
+    ''' Stand-ins for the data stores of a data_locations config. The
+    download data stores are served from a local directory by a
+    StandInServer, and the HPSS data stores by a FakeHPSS. populate puts
+    synthetic files of about file_size bytes where the config says the
+    files of a retrieval are, and the config file written to self.config
+    is a copy of the original with the urls pointing at the server. Other
+    keyword args are passed on to the StandInServer. Use as a context
+    manager. '''
+
+    def __init__(self, tmp_dir, config, file_size=4096, hpss_delay=0.0,
+                 **server_args):
+        with open(config) as config_file:
+            self.known = yaml.load(config_file, Loader=yaml.SafeLoader)
+        self.file_size = file_size
+        self.served = os.path.join(tmp_dir, 'served')
+        os.makedirs(self.served, exist_ok=True)
+        self.server = StandInServer(self.served, **server_args)
+        self.hpss = FakeHPSS(tmp_dir, delay=hpss_delay)
+        self.config = os.path.join(tmp_dir, 'stand_in_locations.yml')
+        self.nbytes = 0
+
+    def stand_in_url(self, url):
+        ''' Return the url, or list of them, on the stand-in server '''
+        if isinstance(url, list):
+            return [self.stand_in_url(item) for item in url]
+        return f'{self.server.url}{urlparse(url).path}'
+
+    def add(self, file_name, cycle_date):
+        ''' Return the content of a synthetic file, and its inventory '''
+        content, index = synthetic_file(
+            os.path.basename(file_name), self.file_size, f'{cycle_date:%Y%m%d%H}')
+        self.nbytes += len(content)
+        return content, index
+
+    def populate(self, args):
+
+        ''' Put synthetic files where the config says the files of the
+        retrieval described by the retrieve_data.py command line args
+        are, in each of its data stores. Return the number of files. '''
+
+        cla = vars(retrieve_data.parse_args(args))
+        cycle_date = cla.pop('cycle_date')
+        cycle_dates = cla.pop('cycle_dates')
+        plan = retrieve_data.RetrievalPlan(
+            cycle_dates=cycle_dates or cycle_date, **cla)
+        known_data_info = plan.config[plan.external_model]
+
+        n_files = 0
+        for data_store in plan.data_stores:
+            store_specs = known_data_info[data_store]
+            file_names = retrieve_data.get_file_templates(
+                plan, known_data_info, data_store)
+            file_names = file_names if isinstance(file_names, list) else [file_names]
+            if store_specs['protocol'] == 'htar':
+                n_files += self.populate_archives(plan, store_specs, file_names)
+                continue
+
+            # The files are put in the first of the locations
+            urls = store_specs['url']
+            urls = urls if isinstance(urls, list) else [urls]
+            loc, templates = retrieve_data.pair_locs_with_files(
+                urls, file_names, known_data_info.get('check_all', False))[0]
+            templates = templates if isinstance(templates, list) else [templates]
+            locations = retrieve_data.expand_locations(
+                loc, templates, plan.cycle_dates, plan.fcst_hrs,
+                plan.members or [''])
+            for (cycle_date, _, _), input_locs in locations.items():
+                for url in input_locs:
+                    local = self.served + urlparse(url).path
+                    os.makedirs(os.path.dirname(local), exist_ok=True)
+                    content, index = self.add(local, cycle_date)
+                    with open(local, 'wb') as fn:
+                        fn.write(content)
+                    if index is not None:
+                        with open(f'{local}.idx', 'w') as fn:
+                            fn.write('\n'.join(index) + '\n')
+                    n_files += 1
+        return n_files
+
+    def populate_archives(self, plan, store_specs, file_names):
+
+        ''' Put the files of a retrieval from HPSS in tar files at the
+        first of the archive paths, in the first archive_internal_dir.
+        When the files are spread over a set of archives, they are dealt
+        out to them in turn. Return the number of files. '''
+
+        archive_paths, archive_file_names = retrieve_data.get_archive_specs(
+            plan, store_specs)
+        internal_dirs = store_specs.get('archive_internal_dir', [''])
+        if isinstance(internal_dirs, dict):
+            internal_dirs = internal_dirs[plan.anl_or_fcst]
+
+        archives = {}
+        for cycle_date in plan.cycle_dates:
+            for ens_group, mems in retrieve_data.get_ens_groups(plan.members).items():
+                candidates = retrieve_data.archive_candidates(
+                    archive_paths, archive_file_names, cycle_date, ens_group)[0]
+                for num, (fcst_hr, mem, file_name) in enumerate(
+                        itertools.product(plan.fcst_hrs, mems, file_names)):
+                    member = retrieve_data.fill_template(
+                        os.path.join(internal_dirs[0], file_name),
+                        cycle_date, fcst_hr=fcst_hr, mem=mem, ens_group=ens_group)
+                    archive = candidates[num % len(candidates)]
+                    archives.setdefault(archive, {})[member] = self.add(
+                        member, cycle_date)[0]
+
+        for archive, members in archives.items():
+            self.hpss.add_tar(archive, members)
+        return sum(len(members) for members in archives.values())
+
+    def __enter__(self):
+        self.server.__enter__()
+        self.hpss.__enter__()
+        known = copy.deepcopy(self.known)
+        for data_stores in known.values():
+            for store_specs in data_stores.values():
+                if isinstance(store_specs, dict) and 'url' in store_specs:
+                    store_specs['url'] = self.stand_in_url(store_specs['url'])
+        with open(self.config, 'w') as config_file:
+            yaml.dump(known, config_file)
+        return self
+
+    def __exit__(self, *args):
+        self.hpss.__exit__(*args)
+        self.server.__exit__(*args)
+
+
 class FunctionalTesting(unittest.TestCase):
 
     ''' Test class for retrieve data '''
@@ -317,3 +935,2954 @@ class FunctionalTesting(unittest.TestCase):
             path = os.path.join(tmp_dir, '*')
             files_on_disk = glob.glob(path)
             self.assertEqual(len(files_on_disk), 5)
+
+
+class StandInFunctionalTesting(unittest.TestCase):
+
+    ''' Test class for retrieve data, with the data stores of the config
+    stood in for locally. '''
+
+    def setUp(self):
+        self.path = os.path.dirname(__file__)
+        self.config = f'{self.path}/templates/data_locations.yml'
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+        self.stores = StandInDataStores(tmp_dir.name, self.config)
+        self.stores.__enter__()
+        self.addCleanup(self.stores.__exit__, None, None, None)
+
+    def retrieve(self, args):
+
+        ''' Run retrieve_data.main with args, against the stand-ins for
+        the data stores. '''
+
+        self.stores.populate(args)
+        args = [self.stores.config if arg == self.config else arg
+                for arg in args]
+        retrieve_data.main(args)
+
+    def test_fv3gfs_grib2_lbcs_from_hpss(self):
+
+        ''' Get FV3GFS grib2 files from HPSS for LBCS, offset by 6 hours
+
+        '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'hpss',
+                '--external_model', 'FV3GFS',
+                '--fcst_hrs', '6', '12', '3',
+                '--output_path', tmp_dir,
+                '--debug',
+                '--file_type', 'grib2',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 3)
+
+    def test_fv3gfs_netcdf_lbcs_from_hpss(self):
+
+        ''' Get FV3GFS netcdf files from HPSS for LBCS. Tests fcst lead
+        times > 40 hours, since they come from a different archive file.
+        '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022060112',
+                '--data_stores', 'hpss',
+                '--external_model', 'FV3GFS',
+                '--fcst_hrs', '24', '48', '24',
+                '--output_path', tmp_dir,
+                '--debug',
+                '--file_type', 'netcdf',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 2)
+
+    # GDAS Tests
+    def test_gdas_ics_from_aws(self):
+
+        ''' In real time, GDAS is used for LBCS with a 6 hour offset.
+        '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+            out_path_tmpl = f'{tmp_dir}/mem{{mem:03d}}'
+
+            args = [
+                '--anl_or_fcst', 'anl',
+                '--config', self.config,
+                '--cycle_date', '2022052512',
+                '--data_stores', 'aws',
+                '--external_model', 'GDAS',
+                '--fcst_hrs', '6', '9', '3',
+                '--output_path', out_path_tmpl,
+                '--debug',
+                '--file_type', 'netcdf',
+                '--members', '9', '10',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            for mem in [9, 10]:
+                files_on_disk = glob.glob(
+                    os.path.join(out_path_tmpl.format(mem=mem), '*')
+                    )
+                self.assertEqual(len(files_on_disk), 2)
+
+
+    # GEFS Tests
+    def test_gefs_grib2_ics_from_aws(self):
+
+        ''' Get GEFS grib2 a & b files for ICS offset by 6 hours.
+
+        '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+            out_path_tmpl = f'{tmp_dir}/mem{{mem:03d}}'
+
+            args = [
+                '--anl_or_fcst', 'anl',
+                '--config', self.config,
+                '--cycle_date', '2022052512',
+                '--data_stores', 'aws',
+                '--external_model', 'GEFS',
+                '--fcst_hrs', '6',
+                '--output_path', out_path_tmpl,
+                '--debug',
+                '--file_type', 'netcdf',
+                '--members', '1', '2',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+            for mem in [1, 2]:
+                files_on_disk = glob.glob(
+                    os.path.join(out_path_tmpl.format(mem=mem), '*')
+                    )
+                self.assertEqual(len(files_on_disk), 2)
+
+
+
+    # HRRR Tests
+    def test_hrrr_ics_from_hpss(self):
+
+        ''' Get HRRR ICS from hpss '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'anl',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'hpss',
+                '--external_model', 'HRRR',
+                '--fcst_hrs', '0',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 1)
+
+    def test_hrrr_lbcs_from_hpss(self):
+
+        ''' Get HRRR LBCS from hpss for 3 hour boundary conditions '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'hpss',
+                '--external_model', 'HRRR',
+                '--fcst_hrs', '3', '24', '3',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 8)
+
+    def test_hrrr_ics_from_aws(self):
+
+        ''' Get HRRR ICS from aws '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'anl',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'aws',
+                '--external_model', 'HRRR',
+                '--fcst_hrs', '0',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 1)
+
+    def test_hrrr_lbcs_from_aws(self):
+
+        ''' Get HRRR LBCS from aws for 3 hour boundary conditions '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'aws',
+                '--external_model', 'HRRR',
+                '--fcst_hrs', '3', '24', '3',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 8)
+
+    # RAP tests
+    def test_rap_ics_from_aws(self):
+
+        ''' Get RAP ICS from aws offset by 3 hours '''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'anl',
+                '--config', self.config,
+                '--cycle_date', '2022062509',
+                '--data_stores', 'aws',
+                '--external_model', 'RAP',
+                '--fcst_hrs', '3',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 1)
+
+    def test_rap_lbcs_from_aws(self):
+
+        ''' Get RAP LBCS from aws for 6 hour boundary conditions offset
+        by 3 hours. Use 09Z start time for longer LBCS.'''
+
+        with tempfile.TemporaryDirectory(dir='.') as tmp_dir:
+
+            args = [
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022062509',
+                '--data_stores', 'aws',
+                '--external_model', 'RAP',
+                '--fcst_hrs', '3', '30', '6',
+                '--output_path', tmp_dir,
+                '--debug',
+            ]
+
+            self.retrieve(args)
+
+            # Verify files exist in temp dir
+
+            os.chdir(os.path.dirname(__file__))
+            path = os.path.join(tmp_dir, '*')
+            files_on_disk = glob.glob(path)
+            self.assertEqual(len(files_on_disk), 5)
+
+
+class DownloadBenchmark(unittest.TestCase):
+
+    ''' Compare serial and concurrent downloads of a 60 hour LBC pull
+    with 3 hourly boundaries from a local stand-in server. Only the
+    throughput comparison is a benchmark; the other tests check how the
+    requests reach the server. '''
+
+    fcst_hrs = ['3', '60', '3']
+    file_size = 512 * 1024
+    delay = 0.1
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+        # Start each benchmark without idle connections
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        data_dir = os.path.join(self.served, 'gfs.20220625', '12', 'atmos')
+        os.makedirs(data_dir)
+        for fcst_hr in range(3, 61, 3):
+            file_name = f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'
+            with open(os.path.join(data_dir, file_name), 'wb') as fn:
+                fn.write(os.urandom(self.file_size))
+        self.n_files = len(range(3, 61, 3))
+
+    def retrieve(self, url, *extra_args):
+
+        ''' Run retrieve_data.main with the stand-in config, and return
+        the elapsed time and the number of files retrieved. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        write_stand_in_config(
+            config,
+            url=f'{url}/gfs.{{yyyymmdd}}/{{hh}}/atmos',
+            file_names=['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}'],
+        )
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        args = [
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062512',
+            '--data_stores', 'nomads',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', *self.fcst_hrs,
+            '--output_path', output_path,
+            '--file_type', 'grib2',
+            *extra_args,
+        ]
+
+        start = time.perf_counter()
+        retrieve_data.main(args)
+        elapsed = time.perf_counter() - start
+
+        return elapsed, len(glob.glob(os.path.join(output_path, '*')))
+
+    def report(self, label, elapsed):
+
+        ''' Print the throughput of a benchmark run '''
+
+        mbytes = self.n_files * self.file_size / 1024**2
+        print(f'{label:>12s}: {elapsed:6.2f} s, {mbytes / elapsed:8.2f} MB/s')
+
+    def test_concurrent_requests(self):
+
+        ''' Serial downloads send one request at a time, and concurrent
+        ones overlap. '''
+
+        with StandInServer(self.served, delay=self.delay) as server:
+            _, n_serial = self.retrieve(server.url)
+            serial_active = server.max_active
+
+            server.max_active = 0
+            _, n_concurrent = self.retrieve(
+                server.url,
+                '--max_workers', '8',
+                '--max_per_host', '8',
+            )
+            concurrent_active = server.max_active
+
+        self.assertEqual(n_serial, self.n_files)
+        self.assertEqual(n_concurrent, self.n_files)
+        self.assertEqual(serial_active, 1)
+        self.assertGreater(concurrent_active, 1)
+        self.assertLessEqual(concurrent_active, 8)
+
+    @benchmark
+    def test_concurrent_download_throughput(self):
+
+        ''' Concurrent downloads should deliver all files faster than
+        serial ones. '''
+
+        with StandInServer(self.served, delay=self.delay) as server:
+            serial, n_serial = self.retrieve(server.url)
+            concurrent, n_concurrent = self.retrieve(
+                server.url,
+                '--max_workers', '8',
+                '--max_per_host', '8',
+            )
+
+        self.report('serial', serial)
+        self.report('concurrent', concurrent)
+        self.assertEqual(n_serial, self.n_files)
+        self.assertEqual(n_concurrent, self.n_files)
+        self.assertLess(concurrent, serial)
+
+    def test_pooled_connection(self):
+
+        ''' The Python backend should reuse one connection for all files,
+        where wget is forked to open one for each. '''
+
+        with StandInServer(self.served) as server:
+            _, n_wget = self.retrieve(server.url, '--download_backend', 'wget')
+            wget_connections = server.connections
+
+            server.connections = 0
+            _, n_pooled = self.retrieve(server.url)
+            pooled_connections = server.connections
+
+        self.assertEqual(n_wget, self.n_files)
+        self.assertEqual(n_pooled, self.n_files)
+        self.assertEqual(wget_connections, self.n_files)
+        self.assertEqual(pooled_connections, 1)
+
+    def test_missing_files_are_unavailable(self):
+
+        ''' A file missing from the only location is reported and causes
+        a non-zero exit, just as in serial mode. '''
+
+        self.fcst_hrs = ['3', '63', '3']
+        with StandInServer(self.served) as server:
+            with self.assertRaises(SystemExit):
+                self.retrieve(server.url, '--max_workers', '4')
+
+
+@benchmark
+class RetrievalBenchmark(unittest.TestCase):
+
+    ''' Time retrieve_data.main for representative FV3GFS, GEFS and
+    HRRR plans against the stand-ins for the data stores of
+    templates/data_locations.yml, with the latency of a remote data store
+    and of an HPSS tape recall, so that regressions in the retrieval path
+    are caught offline. Skipped unless RETRIEVE_DATA_BENCHMARK is set.
+
+    Each plan has to finish within its budget, which is several times
+    what it takes on an idle workstation. Set RETRIEVE_DATA_BENCHMARK_SLACK
+    to scale the budgets on slower machines, and
+    RETRIEVE_DATA_BENCHMARK_LOG to the path of a file to append the
+    results to as JSON lines, to compare them across changes. '''
+
+    file_size = 1024**2
+    delay = 0.05
+    hpss_delay = 0.2
+    slack = float(os.environ.get('RETRIEVE_DATA_BENCHMARK_SLACK', 1))
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+        pool = retrieve_data.HTTPConnectionPool()
+        self.addCleanup(pool.close)
+        patcher = mock.patch('retrieve_data._HTTP_POOL', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config = os.path.join(
+            os.path.dirname(__file__), 'templates', 'data_locations.yml')
+        self.stores = StandInDataStores(
+            self.tmp_dir.name, self.config, file_size=self.file_size,
+            hpss_delay=self.hpss_delay, delay=self.delay)
+        self.stores.__enter__()
+        self.addCleanup(self.stores.__exit__, None, None, None)
+
+    def benchmark(self, label, budget, *args):
+
+        ''' Retrieve the files of a plan from the stand-ins with
+        retrieve_data.main, check that all of them arrived, and report
+        the elapsed time and throughput. '''
+
+        # Each member, if any, has its own output path
+        output_root = os.path.join(self.tmp_dir.name, 'output')
+        args = [
+            '--config', self.config,
+            '--cycle_date', '2022062512',
+            '--output_path', os.path.join(output_root, '{mem}'),
+            *args,
+        ]
+        n_files = self.stores.populate(args)
+        args[1] = self.stores.config
+
+        start = time.perf_counter()
+        retrieve_data.main(args)
+        elapsed = time.perf_counter() - start
+
+        retrieved = [
+            file_name
+            for _, _, file_names in os.walk(output_root)
+            for file_name in file_names
+            if not file_name.startswith('.')
+        ]
+        mbytes = self.stores.nbytes / 1024**2
+        print(f'{label:>28s}: {n_files:3d} files, {elapsed:6.2f} s, '
+              f'{mbytes / elapsed:8.2f} MB/s')
+        log_path = os.environ.get('RETRIEVE_DATA_BENCHMARK_LOG')
+        if log_path:
+            with open(log_path, 'a') as log:
+                log.write(json.dumps({
+                    'plan': label,
+                    'files': n_files,
+                    'bytes': self.stores.nbytes,
+                    'seconds': elapsed,
+                }) + '\n')
+
+        self.assertEqual(len(retrieved), n_files)
+        self.assertLess(elapsed, budget * self.slack)
+
+    def test_fv3gfs_lbcs_from_hpss(self):
+        self.benchmark(
+            'FV3GFS grib2 LBCS, hpss', 5,
+            '--anl_or_fcst', 'fcst',
+            '--data_stores', 'hpss',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '6', '48', '6',
+            '--file_type', 'grib2',
+        )
+
+    def test_fv3gfs_netcdf_lbcs_from_hpss(self):
+        self.benchmark(
+            'FV3GFS netcdf LBCS, hpss', 5,
+            '--anl_or_fcst', 'fcst',
+            '--data_stores', 'hpss',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '6', '48', '6',
+            '--file_type', 'netcdf',
+            '--max_hpss_sessions', '2',
+        )
+
+    def test_fv3gfs_lbcs_from_aws(self):
+        self.benchmark(
+            'FV3GFS grib2 LBCS, aws', 3,
+            '--anl_or_fcst', 'fcst',
+            '--data_stores', 'aws',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '6', '48', '6',
+            '--file_type', 'grib2',
+            '--max_workers', '8',
+        )
+
+    def test_gefs_ics_from_aws(self):
+        self.benchmark(
+            'GEFS ICS 10 members, aws', 3,
+            '--anl_or_fcst', 'anl',
+            '--data_stores', 'aws',
+            '--external_model', 'GEFS',
+            '--fcst_hrs', '6',
+            '--members', '1', '10',
+            '--max_workers', '8',
+        )
+
+    def test_hrrr_lbcs_from_hpss(self):
+        self.benchmark(
+            'HRRR LBCS, hpss', 5,
+            '--anl_or_fcst', 'fcst',
+            '--data_stores', 'hpss',
+            '--external_model', 'HRRR',
+            '--fcst_hrs', '3', '24', '3',
+        )
+
+    def test_hrrr_lbcs_from_aws(self):
+        self.benchmark(
+            'HRRR LBCS, aws', 3,
+            '--anl_or_fcst', 'fcst',
+            '--data_stores', 'aws',
+            '--external_model', 'HRRR',
+            '--fcst_hrs', '3', '24', '3',
+            '--max_workers', '8',
+        )
+
+
+class HTTPTransportTesting(unittest.TestCase):
+
+    ''' Tests for the Python download backend against a local stand-in
+    server. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        self.output = os.path.join(self.tmp_dir.name, 'output')
+        os.makedirs(self.served)
+        os.makedirs(self.output)
+
+        self.content = os.urandom(3 * 1024 * 1024 + 17)
+        with open(os.path.join(self.served, 'gfs.t00z.atmanl.nc'), 'wb') as fn:
+            fn.write(self.content)
+
+        self.pool = retrieve_data.HTTPConnectionPool()
+        self.addCleanup(self.pool.close)
+
+    def local_content(self):
+        ''' Return the content of the downloaded file '''
+        with open(os.path.join(self.output, 'gfs.t00z.atmanl.nc'), 'rb') as fn:
+            return fn.read()
+
+    def test_download(self):
+
+        ''' A download reports its bytes and lands intact. '''
+
+        with StandInServer(self.served) as server:
+            transfer = self.pool.download(
+                f'{server.url}/gfs.t00z.atmanl.nc', self.output)
+
+        self.assertEqual(transfer.nbytes, len(self.content))
+        self.assertGreater(transfer.seconds, 0)
+        self.assertEqual(self.local_content(), self.content)
+
+    def test_resume_partial_file(self):
+
+        ''' A partial file is completed with a Range request. '''
+
+        with open(os.path.join(self.output, 'gfs.t00z.atmanl.nc'), 'wb') as fn:
+            fn.write(self.content[:1000])
+
+        with StandInServer(self.served) as server:
+            transfer = self.pool.download(
+                f'{server.url}/gfs.t00z.atmanl.nc', self.output)
+
+        self.assertEqual(server.ranges, ['bytes=1000-'])
+        self.assertEqual(transfer.nbytes, len(self.content) - 1000)
+        self.assertEqual(self.local_content(), self.content)
+
+    def test_complete_file_is_not_fetched_again(self):
+
+        ''' A file that is already complete is left alone. '''
+
+        with open(os.path.join(self.output, 'gfs.t00z.atmanl.nc'), 'wb') as fn:
+            fn.write(self.content)
+
+        with StandInServer(self.served) as server:
+            transfer = self.pool.download(
+                f'{server.url}/gfs.t00z.atmanl.nc', self.output)
+
+        self.assertEqual(transfer.nbytes, 0)
+        self.assertEqual(self.local_content(), self.content)
+
+    def test_missing_file(self):
+
+        ''' A missing file is unavailable and leaves nothing on disk. '''
+
+        with StandInServer(self.served) as server:
+            transfer = self.pool.download(
+                f'{server.url}/gfs.t00z.sfcanl.nc', self.output)
+
+        self.assertIsNone(transfer)
+        self.assertEqual(os.listdir(self.output), [])
+
+    def test_connection_reuse(self):
+
+        ''' Sequential downloads share one connection. '''
+
+        local_file = os.path.join(self.output, 'gfs.t00z.atmanl.nc')
+        with StandInServer(self.served) as server:
+            for _ in range(3):
+                if os.path.exists(local_file):
+                    os.remove(local_file)
+                self.pool.download(f'{server.url}/gfs.t00z.atmanl.nc', self.output)
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(self.pool.transfers), 3)
+
+
+class MultipartDownloadTesting(unittest.TestCase):
+
+    ''' Tests and a benchmark for downloading a large file in several
+    byte ranges at the same time, from a local stand-in server that sends
+    each stream at 4 MB/s. Files of 1 MB or more count as large. '''
+
+    file_size = 4 * 1024**2 + 123
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+        threshold = mock.patch.object(retrieve_data, 'HTTP_MULTIPART_MIN_BYTES', 1024**2)
+        threshold.start()
+        self.addCleanup(threshold.stop)
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        os.makedirs(self.served)
+        self.content = os.urandom(self.file_size)
+        with open(os.path.join(self.served, 'gdas.t12z.atmanl.nc'), 'wb') as fn:
+            fn.write(self.content)
+        with open(os.path.join(self.served, 'small.nc'), 'wb') as fn:
+            fn.write(self.content[:1000])
+        self.target = os.path.join(self.tmp_dir.name, 'out')
+        os.makedirs(self.target)
+
+    def download(self, server, parts, file_name='gdas.t12z.atmanl.nc'):
+        start = time.perf_counter()
+        transfer = retrieve_data.get_http_pool().download(
+            f'{server.url}/{file_name}', self.target, parts=parts)
+        return transfer, time.perf_counter() - start
+
+    def check_file(self, file_name='gdas.t12z.atmanl.nc'):
+        with open(os.path.join(self.target, file_name), 'rb') as fn:
+            self.assertEqual(fn.read(), self.content[:os.path.getsize(
+                os.path.join(self.served, file_name))])
+        self.assertEqual(sorted(os.listdir(self.target)), [file_name])
+
+    def test_multipart_download(self):
+
+        ''' A large file is fetched in 4 parts at the same time, as
+        separate byte ranges, and reassembled in order. '''
+
+        with StandInServer(self.served, stream_rate=4 * 1024**2) as server:
+            transfer, _ = self.download(server, parts=4)
+        self.check_file()
+        self.assertEqual(transfer.nbytes, self.file_size)
+
+        # The first part comes from the first request, the others in
+        # ranges
+        part_size = -(-self.file_size // 4)
+        self.assertEqual(sorted(server.ranges), [
+            f'bytes={first}-{min(first + part_size, self.file_size) - 1}'
+            for first in (part_size, 2 * part_size, 3 * part_size)
+        ])
+        self.assertEqual(len(server.requests), 4)
+        self.assertGreater(server.max_active, 1)
+
+    @benchmark
+    def test_multipart_throughput(self):
+
+        ''' A large file downloads several times faster in 4 parts than
+        in a single stream. '''
+
+        with StandInServer(self.served, stream_rate=4 * 1024**2) as server:
+            _, single = self.download(server, parts=1)
+            self.check_file()
+            self.assertEqual(server.ranges, [])
+            os.remove(os.path.join(self.target, 'gdas.t12z.atmanl.nc'))
+
+            _, multipart = self.download(server, parts=4)
+            self.check_file()
+
+        print(f'\nlarge file: single stream {single:.2f} s, '
+              f'4 parts {multipart:.2f} s')
+        self.assertLess(multipart, single / 2)
+
+    def test_small_file(self):
+
+        ''' Files under the threshold are downloaded in a single
+        stream. '''
+
+        with StandInServer(self.served) as server:
+            self.download(server, parts=4, file_name='small.nc')
+        self.check_file('small.nc')
+        self.assertEqual(server.ranges, [])
+
+    def test_failed_part_is_resumed(self):
+
+        ''' A range that is cut off is resumed from where it stopped,
+        without retrieving the other ranges again. '''
+
+        with StandInServer(self.served, cut_ranges=1) as server:
+            transfer, _ = self.download(server, parts=4)
+        self.check_file()
+        self.assertEqual(transfer.nbytes, self.file_size)
+        # Three ranges, and the rest of the one that was cut off
+        self.assertEqual(len(server.ranges), 4)
+        part_size = -(-self.file_size // 4)
+        firsts = [int(byte_range[6:].split('-')[0]) for byte_range in server.ranges]
+        self.assertEqual(len([first for first in firsts if first % part_size]), 1)
+
+    def test_interrupted_download_is_resumed(self):
+
+        ''' A later run retrieves only the ranges an earlier one left
+        unfinished. '''
+
+        part_size = -(-self.file_size // 4)
+        file_path = os.path.join(self.target, 'gdas.t12z.atmanl.nc')
+        received = [part_size, part_size, 1000, self.file_size - 3 * part_size]
+        with open(f'{file_path}.part', 'wb') as fn:
+            fn.write(self.content[:2 * part_size + 1000])
+            fn.truncate(self.file_size)
+            fn.seek(3 * part_size)
+            fn.write(self.content[3 * part_size:])
+        with open(f'{file_path}.part.json', 'w') as fn:
+            json.dump({'size': self.file_size, 'received': received}, fn)
+
+        with StandInServer(self.served) as server:
+            transfer, _ = self.download(server, parts=4)
+        self.check_file()
+        self.assertEqual(server.ranges, [f'bytes={2 * part_size + 1000}-{3 * part_size - 1}'])
+        self.assertEqual(transfer.nbytes, part_size - 1000)
+
+
+class GRIB2SubsetTesting(unittest.TestCase):
+
+    ''' Tests for downloading GRIB2 records selected from a .idx
+    inventory, from a local stand-in server that serves byte ranges. '''
+
+    records = [
+        ('PRMSL', 'mean sea level', 1000),
+        ('TMP', '500 mb', 2000),
+        ('TMP', '850 mb', 3000),
+        ('UGRD', '500 mb', 4000),
+        ('VGRD', '500 mb', 5000),
+        ('TMP', 'surface', 6000),
+        ('HGT', 'surface', 7000),
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        data_dir = os.path.join(self.tmp_dir.name, 'served', 'gfs.20220625', '12')
+        os.makedirs(data_dir)
+        self.messages = {}
+        for fcst_hr in (3, 6):
+            file_name = f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'
+            self.messages[file_name] = write_grib2_like(
+                os.path.join(data_dir, file_name), self.records)
+
+    def retrieve(self, url, **store_specs):
+
+        ''' Run retrieve_data.main with the stand-in config, and return
+        the output path. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        write_stand_in_config(
+            config,
+            url=f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+            file_names=['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}'],
+            **store_specs,
+        )
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        retrieve_data.main([
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062512',
+            '--data_stores', 'nomads',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '3', '6', '3',
+            '--output_path', output_path,
+            '--file_type', 'grib2',
+        ])
+        return output_path
+
+    def test_byte_ranges(self):
+
+        ''' Selected records are merged into contiguous byte ranges, and
+        the last record runs to the end of the file. '''
+
+        index = '\n'.join([
+            '1:0:d=2022062512:PRMSL:mean sea level:anl:',
+            '2:100:d=2022062512:TMP:500 mb:anl:',
+            '3:250:d=2022062512:TMP:850 mb:anl:',
+            '4.1:400:d=2022062512:UGRD:500 mb:anl:',
+            '4.2:400:d=2022062512:VGRD:500 mb:anl:',
+            '5:600:d=2022062512:TMP:surface:anl:',
+        ])
+        records = retrieve_data.parse_grib2_index(index)
+
+        self.assertEqual(
+            retrieve_data.grib2_byte_ranges(records, variables=['TMP']),
+            [(100, 399), (600, None)],
+        )
+        self.assertEqual(
+            retrieve_data.grib2_byte_ranges(records, levels=['500 mb']),
+            [(100, 249), (400, 599)],
+        )
+        self.assertEqual(
+            retrieve_data.grib2_byte_ranges(
+                records, variables=['[UV]GRD'], levels=['500 mb']),
+            [(400, 599)],
+        )
+        self.assertEqual(
+            retrieve_data.grib2_byte_ranges(records),
+            [(0, None)],
+        )
+
+    def test_subset_download(self):
+
+        ''' Only the matching messages are downloaded, and they are
+        concatenated in order into a GRIB2 file. '''
+
+        served = os.path.join(self.tmp_dir.name, 'served')
+        with StandInServer(served) as server:
+            output_path = self.retrieve(
+                server.url,
+                variables=['TMP', 'HGT'],
+                levels=['500 mb', 'surface'],
+            )
+
+        for file_name, messages in self.messages.items():
+            with open(os.path.join(output_path, file_name), 'rb') as grib_file:
+                subset = grib_file.read()
+            self.assertEqual(subset, messages[1] + messages[5] + messages[6])
+            self.assertLess(len(subset), len(b''.join(messages)))
+
+        # One merged range per file for TMP 500 mb, one for the surface
+        # records at the end of the file.
+        self.assertEqual(len(server.ranges), 4)
+
+    def test_no_inventory(self):
+
+        ''' Without an inventory the whole file is downloaded. '''
+
+        served = os.path.join(self.tmp_dir.name, 'served')
+        for idx_file in glob.glob(os.path.join(served, '*', '*', '*.idx')):
+            os.remove(idx_file)
+
+        with StandInServer(served) as server:
+            output_path = self.retrieve(server.url, variables=['TMP'])
+
+        for file_name, messages in self.messages.items():
+            with open(os.path.join(output_path, file_name), 'rb') as grib_file:
+                self.assertEqual(grib_file.read(), b''.join(messages))
+
+
+class CacheTesting(unittest.TestCase):
+
+    ''' Tests for the cache of retrieved files shared across experiments '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        data_dir = os.path.join(self.served, 'gfs.20220625', '12')
+        os.makedirs(data_dir)
+        for fcst_hr in (3, 6, 9):
+            file_name = f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'
+            with open(os.path.join(data_dir, file_name), 'wb') as fn:
+                fn.write(os.urandom(1024))
+
+    def retrieve(self, url):
+
+        ''' Run retrieve_data.main with the stand-in config and the
+        cache, and return the output path. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        write_stand_in_config(
+            config,
+            url=f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+            file_names=['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}'],
+        )
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        retrieve_data.main([
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062512',
+            '--data_stores', 'nomads',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '3', '9', '3',
+            '--output_path', output_path,
+            '--file_type', 'grib2',
+            '--cache_dir', self.cache_dir,
+        ])
+        return output_path
+
+    def test_second_experiment_uses_cache(self):
+
+        ''' A second experiment links the files from the cache without
+        asking the server for them. '''
+
+        with StandInServer(self.served) as server:
+            first = self.retrieve(server.url)
+            requests = len(server.requests)
+            second = self.retrieve(server.url)
+
+        self.assertEqual(requests, 3)
+        self.assertEqual(len(server.requests), requests)
+        for file_name in data_files(first):
+            self.assertTrue(os.path.samefile(
+                os.path.join(first, file_name),
+                os.path.join(second, file_name),
+            ))
+        self.assertEqual(len(data_files(second)), 3)
+
+    def test_concurrent_fetch_retrieves_once(self):
+
+        ''' Tasks asking for the same file at the same time retrieve it
+        only once. '''
+
+        cache = retrieve_data.FileCache(self.cache_dir, 'FV3GFS', 'aws')
+        calls = []
+
+        def retrieve(target_path):
+            calls.append(target_path)
+            time.sleep(0.2)
+            with open(os.path.join(target_path, 'gfs.t12z.atmanl.nc'), 'w') as fn:
+                fn.write('data')
+            return True
+
+        targets = [tempfile.mkdtemp(dir=self.tmp_dir.name) for _ in range(4)]
+        threads = [
+            threading.Thread(target=cache.fetch, args=(
+                'https://host/gfs.t12z.atmanl.nc', target,
+                functools.partial(retrieve, target)))
+            for target in targets
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        for target in targets:
+            with open(os.path.join(target, 'gfs.t12z.atmanl.nc')) as fn:
+                self.assertEqual(fn.read(), 'data')
+
+    def test_lru_eviction(self):
+
+        ''' The least recently used entries are evicted to stay under the
+        size limit. '''
+
+        cache = retrieve_data.FileCache(
+            self.cache_dir, 'FV3GFS', 'aws', max_bytes=2500)
+        local = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        sources = [f'https://host/file{num}' for num in range(3)]
+        for age, source in enumerate(sources):
+            local_file = os.path.join(local, os.path.basename(source))
+            with open(local_file, 'wb') as fn:
+                fn.write(os.urandom(1000))
+            cache.put(source, local_file)
+            entry = cache.entry_path(source)
+            os.utime(entry, (time.time() - 100 + age, time.time() - 100 + age))
+
+        # Use the oldest one so the middle one is evicted instead
+        self.assertTrue(cache.get(sources[0], tempfile.mkdtemp(dir=self.tmp_dir.name)))
+        cache.evict()
+
+        self.assertTrue(os.path.exists(cache.entry_path(sources[0])))
+        self.assertFalse(os.path.exists(cache.entry_path(sources[1])))
+        self.assertTrue(os.path.exists(cache.entry_path(sources[2])))
+
+    def test_shared_by_users(self):
+
+        ''' The cache directories are writable by the group, the lock and
+        last use files by everyone, and a hardlinked entry leaves the
+        mode of the retrieved file alone. '''
+
+        cache = retrieve_data.FileCache(self.cache_dir, 'FV3GFS', 'aws')
+        source = 'https://host/gfs.t12z.atmanl.nc'
+        target = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        local_file = os.path.join(target, 'gfs.t12z.atmanl.nc')
+        with open(local_file, 'w') as fn:
+            fn.write('data')
+        os.chmod(local_file, 0o644)
+
+        umask = os.umask(0o077)
+        try:
+            with cache.lock(source):
+                cache.put(source, local_file)
+            self.assertTrue(cache.get(source, tempfile.mkdtemp(dir=self.tmp_dir.name)))
+        finally:
+            os.umask(umask)
+
+        entry_dir = os.path.dirname(cache.entry_path(source))
+        for path in (self.cache_dir, cache.namespace, entry_dir):
+            self.assertEqual(os.stat(path).st_mode & 0o7777, 0o2775)
+        for name in ('.lock', '.used'):
+            self.assertEqual(
+                os.stat(os.path.join(entry_dir, name)).st_mode & 0o777, 0o666)
+        self.assertEqual(os.stat(local_file).st_mode & 0o777, 0o644)
+
+    def test_copies_outlive_eviction(self):
+
+        ''' Across file systems, entries are copied rather than
+        symlinked, so evicting them leaves the staged files in place,
+        and an evicted entry is a cache miss. '''
+
+        cache = retrieve_data.FileCache(
+            self.cache_dir, 'FV3GFS', 'aws', max_bytes=1)
+        source = 'https://host/gfs.t12z.atmanl.nc'
+        local = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        local_file = os.path.join(local, 'gfs.t12z.atmanl.nc')
+        with open(local_file, 'w') as fn:
+            fn.write('data')
+        target = tempfile.mkdtemp(dir=self.tmp_dir.name)
+
+        cross_device = OSError(18, 'Invalid cross-device link')
+        with mock.patch('os.link', side_effect=cross_device):
+            cache.put(source, local_file)
+            self.assertTrue(cache.get(source, target))
+        cache.evict()
+
+        staged = os.path.join(target, 'gfs.t12z.atmanl.nc')
+        self.assertFalse(os.path.islink(staged))
+        with open(staged) as fn:
+            self.assertEqual(fn.read(), 'data')
+        self.assertFalse(os.path.exists(cache.entry_path(source)))
+        self.assertFalse(cache.get(source, tempfile.mkdtemp(dir=self.tmp_dir.name)))
+
+
+class ManifestTesting(unittest.TestCase):
+
+    ''' Tests for the manifest of retrieved files that lets a rerun skip
+    the files that are already in place. '''
+
+    records = [('TMP', '500 mb', 1000), ('HGT', 'surface', 2000)]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        data_dir = os.path.join(self.served, 'gfs.20220625', '12')
+        os.makedirs(data_dir)
+        for fcst_hr in (3, 6, 9):
+            write_grib2_like(
+                os.path.join(data_dir, f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'),
+                self.records,
+            )
+        self.output_path = os.path.join(self.tmp_dir.name, 'out')
+
+    def retrieve(self, url, *extra_args):
+
+        ''' Run retrieve_data.main with the stand-in config into the same
+        output path every time. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        write_stand_in_config(
+            config,
+            url=f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+            file_names=['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}'],
+        )
+        retrieve_data.main([
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062512',
+            '--data_stores', 'nomads',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '3', '9', '3',
+            '--output_path', self.output_path,
+            '--file_type', 'grib2',
+            *extra_args,
+        ])
+
+    def entries(self):
+        manifest_fp = os.path.join(self.output_path, retrieve_data.MANIFEST_FN)
+        with open(manifest_fp) as manifest_file:
+            return json.load(manifest_file)['files']
+
+    def test_rerun_skips_files(self):
+
+        ''' A rerun into the same output path asks the server for nothing,
+        and the manifest records where each file came from. '''
+
+        with StandInServer(self.served) as server:
+            self.retrieve(server.url)
+            requests = len(server.requests)
+            self.retrieve(server.url)
+
+        self.assertEqual(requests, 3)
+        self.assertEqual(len(server.requests), requests)
+
+        entries = self.entries()
+        self.assertEqual(sorted(entries), data_files(self.output_path))
+        entry = entries['gfs.t12z.pgrb2.0p25.f003']
+        self.assertEqual(entry['data_store'], 'nomads')
+        self.assertTrue(entry['source'].endswith(
+            '/gfs.20220625/12/gfs.t12z.pgrb2.0p25.f003'))
+        self.assertNotIn('sha256', entry)
+
+    def test_damaged_files_are_retrieved(self):
+
+        ''' A truncated GRIB file, and one that changed since it was
+        recorded, are retrieved again. The others are skipped. '''
+
+        with StandInServer(self.served) as server:
+            self.retrieve(server.url)
+
+            truncated = os.path.join(self.output_path, 'gfs.t12z.pgrb2.0p25.f003')
+            stat = os.stat(truncated)
+            with open(truncated, 'r+b') as grib_file:
+                grib_file.seek(-4, os.SEEK_END)
+                grib_file.write(b'\0\0\0\0')
+            # Keep the recorded size and time so only the format check
+            # can tell
+            os.utime(truncated, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            changed = os.path.join(self.output_path, 'gfs.t12z.pgrb2.0p25.f006')
+            with open(changed, 'ab') as grib_file:
+                grib_file.write(b'more')
+
+            server.requests.clear()
+            self.retrieve(server.url)
+
+        self.assertEqual(sorted(os.path.basename(path) for path in server.requests), [
+            'gfs.t12z.pgrb2.0p25.f003',
+            'gfs.t12z.pgrb2.0p25.f006',
+        ])
+        self.assertTrue(retrieve_data.check_file_format(truncated))
+
+    def test_checksum(self):
+
+        ''' With --checksum a file that kept its size and time but not its
+        content is retrieved again. '''
+
+        with StandInServer(self.served) as server:
+            self.retrieve(server.url, '--checksum')
+            entry = self.entries()['gfs.t12z.pgrb2.0p25.f009']
+
+            file_path = os.path.join(self.output_path, 'gfs.t12z.pgrb2.0p25.f009')
+            stat = os.stat(file_path)
+            with open(file_path, 'r+b') as grib_file:
+                grib_file.seek(100)
+                grib_file.write(b'flipped')
+            os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            server.requests.clear()
+            self.retrieve(server.url, '--checksum')
+
+        self.assertEqual(entry['sha256'], self.entries()['gfs.t12z.pgrb2.0p25.f009']['sha256'])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(retrieve_data.sha256sum(file_path), entry['sha256'])
+
+    def test_file_formats(self):
+
+        ''' GRIB files need their end marker, netCDF files their
+        signature, and other files some content. '''
+
+        def check(file_name, content):
+            file_path = os.path.join(self.tmp_dir.name, file_name)
+            with open(file_path, 'wb') as fn:
+                fn.write(content)
+            return retrieve_data.check_file_format(file_path)
+
+        self.assertTrue(check('gfs.t12z.pgrb2.0p25.f000', b'GRIB\0\0\0\x02' + b'7777'))
+        self.assertFalse(check('gfs.t12z.pgrb2.0p25.f000', b'GRIB\0\0\0\x02data'))
+        self.assertTrue(check('gfs.t12z.atmf000.nc', b'\x89HDF\r\n\x1a\ndata'))
+        self.assertTrue(check('gfs.t12z.atmf000.nc', b'CDF\x02data'))
+        self.assertFalse(check('gfs.t12z.atmf000.nc', b'<html>Not Found'))
+        self.assertTrue(check('gfs.t12z.atmf000.nemsio', b'data'))
+        self.assertFalse(check('gfs.t12z.atmf000.nemsio', b''))
+
+
+class RaceTesting(unittest.TestCase):
+
+    ''' Tests for racing data stores against each other instead of trying
+    them strictly in order. Two stand-in servers serve the same files,
+    the "aws" one much slower than the "nomads" one. '''
+
+    records = [('TMP', '500 mb', 100000), ('HGT', 'surface', 100000)]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        data_dir = os.path.join(self.served, 'gfs.20220625', '12')
+        os.makedirs(data_dir)
+        for fcst_hr in (3, 6, 9):
+            write_grib2_like(
+                os.path.join(data_dir, f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'),
+                self.records,
+            )
+
+    def retrieve(self, urls, *extra_args):
+
+        ''' Run retrieve_data.main with a download data store at each of
+        a dict of urls, tried in the order given, and return the output
+        path. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        with open(config, 'w') as config_file:
+            yaml.dump({'FV3GFS': {
+                data_store: {
+                    'protocol': 'download',
+                    'url': f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+                    'file_names': {'grib2': {'fcst': [
+                        'gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}']}},
+                }
+                for data_store, url in urls.items()
+            }}, config_file)
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        retrieve_data.main([
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062512',
+            '--data_stores', *urls,
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '3', '9', '3',
+            '--output_path', output_path,
+            '--file_type', 'grib2',
+            '--summary_file', 'data_summary.sh',
+            *extra_args,
+        ])
+        return output_path
+
+    def data_src(self, output_path):
+        with open(os.path.join(output_path, 'data_summary.sh')) as summary:
+            return [line for line in summary if line.startswith('DATA_SRC=')]
+
+    def test_fastest_store_wins(self):
+
+        ''' The files come from the faster data store even though the
+        slower one is listed first, and the winner is in the summary. '''
+
+        with StandInServer(self.served, delay=0.3) as slow, \
+                StandInServer(self.served) as fast:
+            output_path = self.retrieve(
+                {'aws': slow.url, 'nomads': fast.url}, '--race')
+
+        self.assertEqual(self.data_src(output_path), ['DATA_SRC=nomads\n'])
+        self.assertEqual(len(data_files(output_path)), 4)
+        # The slower store was probed but not retrieved from
+        self.assertLessEqual(len(slow.requests), 3)
+        self.assertGreater(len(fast.requests), 3)
+
+    def test_without_race(self):
+
+        ''' Without --race the data stores are tried in order. '''
+
+        with StandInServer(self.served, delay=0.05) as slow, \
+                StandInServer(self.served) as fast:
+            output_path = self.retrieve({'aws': slow.url, 'nomads': fast.url})
+
+        self.assertEqual(self.data_src(output_path), ['DATA_SRC=aws\n'])
+        self.assertEqual(fast.requests, [])
+
+    def test_store_missing_files_loses(self):
+
+        ''' A data store without all of the files loses the race, however
+        fast it answers. '''
+
+        os.remove(os.path.join(
+            self.served, 'gfs.20220625', '12', 'gfs.t12z.pgrb2.0p25.f009'))
+        other = os.path.join(self.tmp_dir.name, 'other')
+        data_dir = os.path.join(other, 'gfs.20220625', '12')
+        os.makedirs(data_dir)
+        for fcst_hr in (3, 6, 9):
+            write_grib2_like(
+                os.path.join(data_dir, f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'),
+                self.records,
+            )
+
+        with StandInServer(self.served) as partial, \
+                StandInServer(other, delay=0.1) as complete:
+            output_path = self.retrieve(
+                {'aws': partial.url, 'nomads': complete.url}, '--race', '2')
+
+        self.assertEqual(self.data_src(output_path), ['DATA_SRC=nomads\n'])
+
+    def test_race_is_called_early(self):
+
+        ''' The race ends once an estimate beats the time the other probes
+        have taken, without waiting for them. '''
+
+        def probe(cla, known_data_info, data_store, cancel):
+            if cancel.wait(delays[data_store]):
+                cancelled[data_store].set()
+                raise retrieve_data.ProbeCancelled(data_store)
+            return estimates[data_store]
+
+        delays = {'hpss': 60.0, 'aws': 0.1, 'nomads': 0.2}
+        estimates = {'hpss': 30.0, 'aws': None, 'nomads': 0.3}
+        cancelled = {data_store: threading.Event() for data_store in delays}
+        with mock.patch.object(retrieve_data, 'probe_data_store', probe):
+            ranked = retrieve_data.race_data_stores(
+                argparse.Namespace(), {}, ['hpss', 'aws', 'nomads'])
+
+        self.assertEqual(ranked, ['nomads', 'hpss', 'aws'])
+        # The slow probe was told to give up rather than left running
+        self.assertTrue(cancelled['hpss'].wait(10))
+        self.assertFalse(cancelled['nomads'].is_set())
+
+    def test_probe(self):
+
+        ''' A probe reads only the sample it asks for, and finds the size
+        of the file from the Content-Range. '''
+
+        url_path = 'gfs.20220625/12/gfs.t12z.pgrb2.0p25.f003'
+        size = os.path.getsize(os.path.join(self.served, url_path))
+        pool = retrieve_data.HTTPConnectionPool()
+        with StandInServer(self.served) as server:
+            sampled = pool.probe(f'{server.url}/{url_path}', sample_bytes=1000)
+            head = pool.probe(f'{server.url}/{url_path}')
+            missing = pool.probe(f'{server.url}/{url_path}.missing')
+        pool.close()
+
+        self.assertEqual(sampled[:2], (size, 1000))
+        self.assertEqual(head[:2], (size, 0))
+        self.assertIsNone(missing)
+
+
+class FetchAPITesting(unittest.TestCase):
+
+    ''' Tests for retrieving files in-process with RetrievalPlan and
+    fetch, from a local stand-in server. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        for cycle in ('2022062500', '2022062512'):
+            data_dir = os.path.join(self.served, f'gfs.{cycle[:8]}', cycle[8:])
+            os.makedirs(data_dir)
+            for fcst_hr in (3, 6):
+                write_grib2_like(
+                    os.path.join(data_dir, f'gfs.t{cycle[8:]}z.pgrb2.0p25.f{fcst_hr:03d}'),
+                    [('TMP', '500 mb', 1000)],
+                )
+
+    def plan(self, url, cycle_dates, output_path, **kwargs):
+        config = {'FV3GFS': {'nomads': {
+            'protocol': 'download',
+            'url': f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+            'file_names': {'grib2': {'fcst': ['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}']}},
+        }}}
+        return retrieve_data.RetrievalPlan(
+            external_model='FV3GFS',
+            cycle_dates=cycle_dates,
+            fcst_hrs=[3, 6, 3],
+            output_path=output_path,
+            data_stores=kwargs.pop('data_stores', ['nomads']),
+            config=config,
+            file_type='grib2',
+            **kwargs,
+        )
+
+    def test_concurrent_fetches(self):
+
+        ''' Plans fetched at the same time in one event loop each get
+        their own files, and progress events stream in as files land. '''
+
+        async def fetch_all(plans):
+            return await asyncio.gather(*[
+                retrieve_data.fetch(plan, progress=events.append)
+                for plan in plans
+            ])
+
+        events = []
+        with StandInServer(self.served, delay=0.05) as server:
+            plans = [
+                self.plan(server.url, cycle,
+                          os.path.join(self.tmp_dir.name, 'out', cycle))
+                for cycle in ('2022062500', '2022062512')
+            ]
+            results = asyncio.run(fetch_all(plans))
+
+        self.assertEqual(results, [
+            {dt.datetime(2022, 6, 25, 0): 'nomads'},
+            {dt.datetime(2022, 6, 25, 12): 'nomads'},
+        ])
+        retrieved = sorted(
+            os.path.relpath(event.path, self.tmp_dir.name)
+            for event in events if event.kind == 'retrieved'
+        )
+        self.assertEqual(retrieved, [
+            'out/2022062500/gfs.t00z.pgrb2.0p25.f003',
+            'out/2022062500/gfs.t00z.pgrb2.0p25.f006',
+            'out/2022062512/gfs.t12z.pgrb2.0p25.f003',
+            'out/2022062512/gfs.t12z.pgrb2.0p25.f006',
+        ])
+        complete = [event for event in events if event.kind == 'complete']
+        self.assertEqual(len(complete), 2)
+        for event in complete:
+            self.assertEqual(
+                event.path,
+                os.path.join(self.tmp_dir.name, 'out', f'{event.cycle_date:%Y%m%d%H}'),
+            )
+
+        # A second fetch of the same plan skips the files
+        events.clear()
+        asyncio.run(fetch_all(plans[:1]))
+        self.assertEqual(
+            [event.kind for event in events],
+            ['data_store', 'skipped', 'skipped', 'complete'],
+        )
+
+    def test_plan_is_independent_of_cwd(self):
+
+        ''' A relative output path is resolved when the plan is made. '''
+
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.tmp_dir.name)
+        with StandInServer(self.served) as server:
+            plan = self.plan(server.url, '2022062512', 'staged')
+            os.chdir(cwd)
+            asyncio.run(retrieve_data.fetch(plan))
+
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(data_files(os.path.join(self.tmp_dir.name, 'staged')), [
+            'gfs.t12z.pgrb2.0p25.f003',
+            'gfs.t12z.pgrb2.0p25.f006',
+        ])
+
+    def test_files_unavailable(self):
+
+        ''' Missing files raise an error that says which cycles are
+        missing files and where the others came from. '''
+
+        os.remove(os.path.join(
+            self.served, 'gfs.20220625', '00', 'gfs.t00z.pgrb2.0p25.f006'))
+        with StandInServer(self.served) as server:
+            plan = self.plan(server.url, ['2022062500', '2022062512', '12'],
+                             os.path.join(self.tmp_dir.name, '{yyyymmddhh}'))
+            with self.assertRaises(retrieve_data.FilesUnavailableError) as error:
+                asyncio.run(retrieve_data.fetch(plan))
+
+        self.assertEqual(list(error.exception.unavailable), [dt.datetime(2022, 6, 25, 0)])
+        self.assertEqual(error.exception.retrieved, {dt.datetime(2022, 6, 25, 12): 'nomads'})
+        # The plan itself is left as it was made
+        self.assertEqual(len(plan.cycle_dates), 2)
+
+    def test_structured_errors(self):
+
+        ''' Errors in the plan and unknown data stores raise
+        RetrievalErrors instead of exiting. '''
+
+        output_path = os.path.join(self.tmp_dir.name, 'out')
+        with self.assertRaises(retrieve_data.PlanError):
+            self.plan('http://localhost', '2022062512', output_path,
+                      data_stores=['disk'])
+        with self.assertRaises(retrieve_data.PlanError):
+            self.plan('http://localhost', ['2022062500', '2022062512'], output_path)
+
+        plan = self.plan('http://localhost', '2022062512', output_path,
+                         data_stores=['aws'])
+        with self.assertRaises(retrieve_data.DataStoreError) as error:
+            asyncio.run(retrieve_data.fetch(plan))
+        self.assertEqual(str(error.exception), 'No information is available for aws.')
+        self.assertIsInstance(error.exception, retrieve_data.RetrievalError)
+
+
+def fill_every_call(template_str, cycle_date, **kwargs):
+
+    ''' Fill a template the way fill_template did before templates were
+    compiled, building the values of every field on every call. '''
+
+    values = dict(retrieve_data.date_fields.__wrapped__(cycle_date),
+                  ens_group=None, fcst_hr=0, mem='')
+    values.update(kwargs)
+    return template_str.format(**values)
+
+
+class FollowTesting(unittest.TestCase):
+
+    ''' Tests for delivering the forecast hours of a cycle as they are
+    published, from a local stand-in server. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        self.data_dir = os.path.join(self.served, 'gfs.20220625', '12')
+        os.makedirs(self.data_dir)
+        self.output_path = os.path.join(self.tmp_dir.name, 'out')
+        self.publish(3)
+
+    def publish(self, fcst_hr):
+        ''' Publish the file of a forecast hour, atomically '''
+        file_name = f'gfs.t12z.pgrb2.0p25.f{fcst_hr:03d}'
+        tmp_path = os.path.join(self.served, file_name)
+        write_grib2_like(tmp_path, [('TMP', '500 mb', 1000)])
+        os.replace(tmp_path, os.path.join(self.data_dir, file_name))
+        os.replace(f'{tmp_path}.idx', os.path.join(self.data_dir, f'{file_name}.idx'))
+
+    def plan(self, url, **kwargs):
+        config = {'FV3GFS': {'nomads': {
+            'protocol': 'download',
+            'url': f'{url}/gfs.{{yyyymmdd}}/{{hh}}',
+            'file_names': {'grib2': {'fcst': ['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}']}},
+        }}}
+        return retrieve_data.RetrievalPlan(
+            'FV3GFS', '2022062512', [3, 9, 3], self.output_path, ['nomads'],
+            config=config,
+            file_type='grib2',
+            follow=True,
+            poll_interval=0.1,
+            summary_file='extrn_mdl_var_defns.sh',
+            **kwargs,
+        )
+
+    def marker(self, fcst_hr):
+        return os.path.join(
+            self.output_path, retrieve_data.READY_FN.format(fcst_hr=fcst_hr))
+
+    def test_hours_are_delivered_as_published(self):
+
+        ''' Each forecast hour is ready as soon as it is published, and
+        the summary file is written once all of them are. Each hour is
+        only published once the one before it is ready, which it never
+        is if the retrieval waits for all of them. '''
+
+        events = []
+        timeline = []
+        hours = {self.marker(fcst_hr): fcst_hr for fcst_hr in (3, 6, 9)}
+        delivered = {fcst_hr: threading.Event() for fcst_hr in (3, 6)}
+
+        def progress(event):
+            events.append(event)
+            if event.kind == 'ready':
+                timeline.append(('ready', hours[event.path]))
+                if hours[event.path] in delivered:
+                    delivered[hours[event.path]].set()
+
+        def publish_after_delivery():
+            for previous, fcst_hr in ((3, 6), (6, 9)):
+                if not delivered[previous].wait(30):
+                    return
+                timeline.append(('published', fcst_hr))
+                self.publish(fcst_hr)
+
+        with StandInServer(self.served) as server:
+            publisher = threading.Thread(target=publish_after_delivery)
+            publisher.start()
+            result = retrieve_data.retrieve(
+                self.plan(server.url, follow_timeout=30), progress)
+            publisher.join()
+
+        self.assertEqual(result, {dt.datetime(2022, 6, 25, 12): 'nomads'})
+        self.assertEqual(timeline, [
+            ('ready', 3),
+            ('published', 6),
+            ('ready', 6),
+            ('published', 9),
+            ('ready', 9),
+        ])
+        with open(self.marker(6)) as marker:
+            self.assertEqual(marker.read(), 'gfs.t12z.pgrb2.0p25.f006\n')
+
+        self.assertEqual(data_files(self.output_path), [
+            'extrn_mdl_var_defns.sh',
+            'gfs.t12z.pgrb2.0p25.f003',
+            'gfs.t12z.pgrb2.0p25.f006',
+            'gfs.t12z.pgrb2.0p25.f009',
+        ])
+        self.assertEqual([event.kind for event in events].count('retrieved'), 3)
+        self.assertEqual(events[-1].kind, 'complete')
+
+    def test_timeout(self):
+
+        ''' Hours that are not published in time make the retrieval fail,
+        after fewer polls than the poll interval allows, and without
+        writing the summary file. '''
+
+        self.publish(9)
+        with StandInServer(self.served) as server:
+            with self.assertRaises(retrieve_data.FilesUnavailableError):
+                retrieve_data.retrieve(self.plan(server.url, follow_timeout=1.5))
+
+        self.assertTrue(os.path.exists(self.marker(3)))
+        self.assertFalse(os.path.exists(self.marker(6)))
+        self.assertEqual(data_files(self.output_path), ['gfs.t12z.pgrb2.0p25.f003'])
+
+        # Hours are published in order, so later hours are not asked
+        # for while an earlier one is missing, and the polls back off
+        polls = [path for path in server.requests if path.endswith('f006')]
+        self.assertLess(len(polls), 1.5 / 0.1 / 2)
+        self.assertFalse([path for path in server.requests if path.endswith('f009')])
+
+
+class TemplateTesting(unittest.TestCase):
+
+    ''' Tests for compiled file templates '''
+
+    cycle_dates = [dt.datetime(2022, 6, 25, 12), dt.datetime(2022, 6, 25, 13)]
+
+    def test_fields(self):
+
+        ''' Only the fields a template uses are recorded. '''
+
+        template = retrieve_data.FileTemplate('./gfs.{yyyymmdd}/{hh}/gfs.t{hh}z.f{fcst_hr:03d}')
+        self.assertEqual(template.fields, {'yyyymmdd', 'hh', 'fcst_hr'})
+        self.assertTrue(template.uses_date)
+        self.assertFalse(retrieve_data.FileTemplate('mem{mem:03d}').uses_date)
+        self.assertIs(retrieve_data.compile_template('a{hh}'),
+                      retrieve_data.compile_template('a{hh}'))
+
+    def test_fill(self):
+
+        ''' The date fields are worked out from the cycle date. '''
+
+        self.assertEqual(
+            retrieve_data.fill_template(
+                '{bin6}/{hh_even}/{jjj}/{yy}{mm}{dd}/mem{mem:03d}/f{fcst_hr:02d}/{ens_group}',
+                self.cycle_dates[1], fcst_hr=6, mem=3, ens_group=1),
+            '12-17/12/176/220625/mem003/f06/1',
+        )
+
+    def test_expand_matches_fill(self):
+
+        ''' Expanding every template in data_locations.yml over a matrix
+        gives the same strings as filling them one at a time. '''
+
+        def templates(node):
+            if isinstance(node, dict):
+                node = list(node.values())
+            if isinstance(node, list):
+                for item in node:
+                    yield from templates(item)
+            elif isinstance(node, str) and '{' in node:
+                yield node
+
+        with open(os.path.join(os.path.dirname(__file__), 'templates',
+                               'data_locations.yml')) as config_file:
+            config = yaml.safe_load(config_file)
+
+        fcst_hrs, mems, ens_groups = [0, 3, 6], [1, 2, 11], [1, 2]
+        for template_str in set(templates(config)):
+            expanded = retrieve_data.compile_template(template_str).expand(
+                self.cycle_dates, fcst_hrs, mems, ens_groups)
+            self.assertEqual(
+                len(expanded),
+                len(self.cycle_dates) * len(fcst_hrs) * len(mems) * len(ens_groups),
+            )
+            for (cycle_date, fcst_hr, mem, ens_group), filled in expanded.items():
+                self.assertEqual(filled, fill_every_call(
+                    template_str, cycle_date, fcst_hr=fcst_hr, mem=mem,
+                    ens_group=ens_group))
+
+
+@benchmark
+class TemplateBenchmark(unittest.TestCase):
+
+    ''' Compare filling the file templates of a 30 member ensemble with
+    61 hourly forecasts one call at a time, as before templates were
+    compiled, with expanding them as a matrix. Skipped unless
+    RETRIEVE_DATA_BENCHMARK is set. '''
+
+    cycle_dates = [dt.datetime(2022, 6, 25, 12)]
+    fcst_hrs = list(range(61))
+    mems = list(range(1, 31))
+    templates = [
+        '/lfs/h1/ops/prod/com/gefs/v12.3/gefs.{yyyymmdd}/{hh}/atmos/pgrb2sp25',
+        'gep{mem:02d}.t{hh}z.pgrb2s.0p25.f{fcst_hr:03d}',
+        'gep{mem:02d}.t{hh}z.pgrb2b.0p25.f{fcst_hr:03d}',
+        'gefs.t{hh}z.pgrb2a.0p50.f{fcst_hr:03d}',
+        './enkfgdas.{yyyymmdd}/{hh}/atmos/mem{mem:03d}/gdas.t{hh}z.atmf{fcst_hr:03d}.nc',
+    ]
+
+    def test_expand(self):
+        start = time.perf_counter()
+        every_call = [
+            fill_every_call(template, cycle_date, fcst_hr=fcst_hr, mem=mem)
+            for template in self.templates
+            for cycle_date in self.cycle_dates
+            for fcst_hr in self.fcst_hrs
+            for mem in self.mems
+        ]
+        every_call_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled = [
+            retrieve_data.fill_template(template, cycle_date, fcst_hr=fcst_hr, mem=mem)
+            for template in self.templates
+            for cycle_date in self.cycle_dates
+            for fcst_hr in self.fcst_hrs
+            for mem in self.mems
+        ]
+        compiled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expanded = [
+            filled
+            for template in self.templates
+            for filled in retrieve_data.compile_template(template).expand(
+                self.cycle_dates, self.fcst_hrs, self.mems).values()
+        ]
+        expand_time = time.perf_counter() - start
+
+        print(f'\n{len(expanded)} template fills: every call {every_call_time * 1e3:.1f} ms, '
+              f'compiled {compiled_time * 1e3:.1f} ms, expanded {expand_time * 1e3:.1f} ms')
+        self.assertEqual(expanded, every_call)
+        self.assertEqual(compiled, every_call)
+        self.assertLess(expand_time, every_call_time / 2)
+
+
+class HPSSProbeTesting(unittest.TestCase):
+
+    ''' Tests for checking archive files on HPSS in one hsi session,
+    using a fake hsi on PATH. '''
+
+    paths = [
+        '/NCEPPROD/hpssprod/runhistory/rh{yyyy}/{yyyymm}/{yyyymmdd}',
+        '/NCEPPROD/hpssprod/runhistory/rh{yyyy}/{yyyymm}/{yyyymmdd}',
+    ]
+    file_names = [
+        ['gpfs_gfs.{yyyymmdd}_{hh}.enkf_grp{ens_group}.tar'],
+        ['com_gfs.{yyyymmdd}_{hh}.enkf_grp{ens_group}.tar'],
+    ]
+    cycle_date = retrieve_data.to_datetime('2022062512')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+
+        self.hpss = FakeHPSS(self.tmp_dir.name)
+        day = '/NCEPPROD/hpssprod/runhistory/rh2022/202206/20220625'
+        for ens_group in (1, 2, 3):
+            self.hpss.add(f'{day}/com_gfs.20220625_12.enkf_grp{ens_group}.tar')
+
+    def test_single_session(self):
+
+        ''' All candidate archives are checked with one hsi call. '''
+
+        with self.hpss:
+            existing, which = retrieve_data.find_archive_files(
+                self.paths, self.file_names, self.cycle_date, ens_group=1)
+
+        self.assertEqual(which, 1)
+        self.assertEqual(list(existing.values()), [
+            '/NCEPPROD/hpssprod/runhistory/rh2022/202206/20220625/'
+            'com_gfs.20220625_12.enkf_grp1.tar'
+        ])
+        self.assertEqual(len(self.hpss.calls()), 1)
+
+    def test_results_reused_across_ens_groups(self):
+
+        ''' Once all ensemble groups are probed, finding the archives
+        of each group needs no further hsi calls. '''
+
+        with self.hpss:
+            retrieve_data.hsi_probe([
+                file_path
+                for ens_group in (1, 2, 3)
+                for item in retrieve_data.archive_candidates(
+                    self.paths, self.file_names, self.cycle_date, ens_group)
+                for file_path in item
+            ])
+            found = [
+                retrieve_data.find_archive_files(
+                    self.paths, self.file_names, self.cycle_date, ens_group)[1]
+                for ens_group in (1, 2, 3)
+            ]
+
+        self.assertEqual(found, [1, 1, 1])
+        self.assertEqual(len(self.hpss.calls()), 1)
+
+    def test_nothing_found(self):
+
+        ''' Missing archives are reported as such. '''
+
+        with self.hpss:
+            existing, which = retrieve_data.find_archive_files(
+                self.paths, self.file_names, self.cycle_date, ens_group=4)
+
+        self.assertFalse(existing)
+        self.assertEqual(which, 0)
+
+    def test_cancelled_session_is_killed(self):
+
+        ''' A slow hsi session is killed once its probe is cancelled, and
+        while it runs, paths checked before can still be looked up. '''
+
+        hpss = FakeHPSS(self.tmp_dir.name, hsi_delay=60)
+        day = '/NCEPPROD/hpssprod/runhistory/rh2022/202206/20220625'
+        known = f'{day}/com_gfs.20220625_12.enkf_grp1.tar'
+        retrieve_data._HSI_EXISTS[known] = True
+        retrieve_data._HSI_STAT[known] = ('0', '0')
+        cancel = threading.Event()
+
+        with hpss, ThreadPoolExecutor() as executor:
+            probe = executor.submit(
+                retrieve_data.hsi_probe, [f'{day}/missing.tar'], cancel)
+            while not hpss.hsi_pids():
+                time.sleep(0.01)
+            stat = executor.submit(retrieve_data.hsi_stat, known)
+            self.assertEqual(stat.result(timeout=10), ('0', '0'))
+
+            cancel.set()
+            with self.assertRaises(retrieve_data.ProbeCancelled):
+                probe.result(timeout=10)
+
+        # Killed, though it may linger as a zombie where nothing reaps
+        # orphans
+        stat = f'/proc/{hpss.hsi_pids()[0]}/stat'
+        if os.path.exists(stat):
+            with open(stat) as stat_file:
+                self.assertEqual(stat_file.read().rpartition(')')[2].split()[0], 'Z')
+        self.assertNotIn(f'{day}/missing.tar', retrieve_data._HSI_EXISTS)
+
+
+class HTARExtractionTesting(unittest.TestCase):
+
+    ''' Tests for extracting ensemble members from several archives with
+    a fake htar on PATH. Each htar call takes 0.3 s. '''
+
+    day = '/NCEPPROD/5year/hpssprod/runhistory/rh2022/202206/20220625'
+    members = [1, 2, 11, 21]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+
+        self.hpss = FakeHPSS(self.tmp_dir.name, delay=0.3)
+        self.config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        config = {
+            'GDAS': {
+                'hpss': {
+                    'protocol': 'htar',
+                    'archive_path': [self.day],
+                    'archive_internal_dir': ['./enkfgdas.{yyyymmdd}/{hh}/mem{mem:03d}'],
+                    'archive_file_names': {
+                        'netcdf': {'fcst': [[
+                            'enkfgdas.{yyyymmdd}_{hh}.grp{ens_group}a.tar',
+                            'enkfgdas.{yyyymmdd}_{hh}.grp{ens_group}b.tar',
+                        ]]},
+                    },
+                    'file_names': {
+                        'netcdf': {'fcst': [
+                            'gdas.t{hh}z.atmf{fcst_hr:03d}.nc',
+                            'gdas.t{hh}z.sfcf{fcst_hr:03d}.nc',
+                        ]},
+                    },
+                },
+            },
+        }
+        with open(self.config, 'w') as config_file:
+            yaml.dump(config, config_file)
+
+    def add_archives(self, missing=(), signature=b''):
+
+        ''' Add the archives of each ensemble group. The atm files are in
+        the "a" archives and the sfc files in the "b" archives. Each file
+        starts with signature. '''
+
+        for ens_group in (1, 2, 3):
+            archives = {'a': {}, 'b': {}}
+            for mem in range(10 * ens_group - 9, 10 * ens_group + 1):
+                for kind, archive in (('atm', 'a'), ('sfc', 'b')):
+                    for fcst_hr in (6, 9):
+                        file_name = f'gdas.t12z.{kind}f{fcst_hr:03d}.nc'
+                        if (mem, file_name) in missing:
+                            continue
+                        path = f'./enkfgdas.20220625/12/mem{mem:03d}/{file_name}'
+                        archives[archive][path] = signature + f'{mem} {file_name}'.encode()
+            for archive, members in archives.items():
+                self.hpss.add_tar(
+                    f'{self.day}/enkfgdas.20220625_12.grp{ens_group}{archive}.tar',
+                    members,
+                )
+
+    def retrieve(self, *extra_args):
+
+        ''' Run retrieve_data.main with the fake HPSS and return the
+        output path template and the time it took. '''
+
+        output_path = os.path.join(self.tmp_dir.name, 'out', 'mem{mem:03d}')
+        start = time.perf_counter()
+        with self.hpss:
+            retrieve_data.main([
+                '--anl_or_fcst', 'fcst',
+                '--config', self.config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'hpss',
+                '--external_model', 'GDAS',
+                '--fcst_hrs', '6', '9', '3',
+                '--output_path', output_path,
+                '--file_type', 'netcdf',
+                '--members', *[str(mem) for mem in self.members],
+                *extra_args,
+            ])
+        return output_path, time.perf_counter() - start
+
+    def check_output(self, output_path):
+        for mem in self.members:
+            mem_path = output_path.format(mem=mem)
+            self.assertEqual(data_files(mem_path), [
+                'gdas.t12z.atmf006.nc',
+                'gdas.t12z.atmf009.nc',
+                'gdas.t12z.sfcf006.nc',
+                'gdas.t12z.sfcf009.nc',
+            ])
+            with open(os.path.join(mem_path, 'gdas.t12z.sfcf009.nc')) as fn:
+                self.assertEqual(fn.read(), f'{mem} gdas.t12z.sfcf009.nc')
+
+    def test_concurrent_extraction(self):
+
+        ''' Ensemble groups and archives are extracted at the same time
+        when enough HPSS sessions are allowed. '''
+
+        self.add_archives()
+        serial_path, _ = self.retrieve(
+            '--max_hpss_sessions', '1',
+            '--index_dir', os.path.join(self.tmp_dir.name, 'index1'),
+        )
+        self.check_output(serial_path)
+        serial_sessions = self.hpss.max_htar_sessions()
+        concurrent_path, _ = self.retrieve(
+            '--max_hpss_sessions', '8',
+            '--index_dir', os.path.join(self.tmp_dir.name, 'index8'),
+        )
+        self.check_output(concurrent_path)
+        concurrent_sessions = self.hpss.max_htar_sessions()
+
+        # 3 groups of 2 archives, each listed and extracted from once per
+        # run
+        calls = self.hpss.calls('htar')
+        self.assertEqual(len([call for call in calls if call.startswith('-tf')]), 12)
+        self.assertEqual(len(calls), 24)
+        self.assertEqual(serial_sessions, 1)
+        self.assertGreater(concurrent_sessions, 1)
+        self.assertLessEqual(concurrent_sessions, 8)
+
+    def test_work_dirs_are_removed(self):
+
+        ''' Extractions leave only the requested files behind. '''
+
+        self.add_archives()
+        output_path, _ = self.retrieve('--max_hpss_sessions', '8')
+
+        for mem in self.members:
+            self.assertFalse(glob.glob(
+                os.path.join(output_path.format(mem=mem), '.extract_*')))
+
+    def test_missing_file_in_one_group(self):
+
+        ''' A file missing from every archive of one group makes the
+        retrieval fail, even though the other groups have all of theirs. '''
+
+        self.add_archives(missing={(11, 'gdas.t12z.sfcf009.nc')})
+        with self.assertRaises(SystemExit):
+            self.retrieve('--max_hpss_sessions', '8')
+
+    def test_cache(self):
+
+        ''' Files extracted once are linked from the cache afterwards. '''
+
+        self.add_archives()
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.retrieve('--cache_dir', cache_dir)
+        calls = len(self.hpss.calls('htar'))
+        output_path, _ = self.retrieve('--cache_dir', cache_dir)
+
+        self.check_output(output_path)
+        self.assertEqual(len(self.hpss.calls('htar')), calls)
+
+    def test_rerun_skips_extracted_files(self):
+
+        ''' A rerun extracts only the files missing from the output
+        path. '''
+
+        self.add_archives(signature=b'CDF\x01')
+        output_path, _ = self.retrieve('--max_hpss_sessions', '8')
+        calls = len(self.hpss.calls('htar'))
+        os.remove(os.path.join(output_path.format(mem=11), 'gdas.t12z.sfcf006.nc'))
+        self.retrieve('--max_hpss_sessions', '8')
+
+        # Only the archive of the second group holding the file is opened
+        # again
+        rerun = self.hpss.calls('htar')[calls:]
+        self.assertEqual(len(rerun), 1)
+        self.assertIn('enkfgdas.20220625_12.grp2b.tar', rerun[0])
+        self.assertIn('mem011/gdas.t12z.sfcf006.nc', rerun[0])
+        manifest_fp = os.path.join(output_path.format(mem=11), retrieve_data.MANIFEST_FN)
+        with open(manifest_fp) as manifest_file:
+            entry = json.load(manifest_file)['files']['gdas.t12z.sfcf006.nc']
+        self.assertEqual(entry['data_store'], 'hpss')
+        self.assertTrue(entry['source'].endswith(
+            'enkfgdas.20220625_12.grp2b.tar:./enkfgdas.20220625/12/mem011/gdas.t12z.sfcf006.nc'))
+
+
+    def new_task(self):
+
+        ''' Forget the archives probed so far, like a new task would. '''
+
+        retrieve_data._HSI_EXISTS.clear()
+        retrieve_data._HSI_STAT.clear()
+
+    def test_index_is_shared_across_tasks(self):
+
+        ''' Archives are listed once, and each is only asked for the
+        files it holds. A later task into another output path uses the
+        listings without listing the archives again. '''
+
+        self.add_archives()
+        self.retrieve('--max_hpss_sessions', '8')
+        calls = self.hpss.calls('htar')
+        self.assertEqual(len([call for call in calls if call.startswith('-tf')]), 6)
+        for call in calls:
+            if '.grp1a.tar' in call or '.grp2a.tar' in call:
+                self.assertNotIn('sfcf', call)
+            if '.grp1b.tar' in call or '.grp2b.tar' in call:
+                self.assertNotIn('atmf', call)
+
+        self.new_task()
+        output_path = os.path.join(self.tmp_dir.name, 'other', 'mem{mem:03d}')
+        with self.hpss:
+            retrieve_data.retrieve(retrieve_data.RetrievalPlan(
+                'GDAS', '2022062512', [6, 9, 3], output_path, ['hpss'],
+                config=self.config,
+                file_type='netcdf',
+                members=self.members,
+                max_hpss_sessions=8,
+            ))
+        self.check_output(output_path)
+        rerun = self.hpss.calls('htar')[len(calls):]
+        self.assertEqual(len(rerun), 6)
+        self.assertFalse([call for call in rerun if call.startswith('-tf')])
+
+    def test_changed_archive_is_listed_again(self):
+
+        ''' A listing is not used once its archive has been rewritten. '''
+
+        self.add_archives(signature=b'CDF\x01')
+        self.retrieve()
+        calls = len(self.hpss.calls('htar'))
+
+        self.hpss.add_tar(
+            f'{self.day}/enkfgdas.20220625_12.grp2b.tar',
+            {
+                f'./enkfgdas.20220625/12/mem{mem:03d}/gdas.t12z.sfcf{fcst_hr:03d}.nc':
+                f'CDF\x01{mem} gdas.t12z.sfcf{fcst_hr:03d}.nc (rewritten)'.encode()
+                for mem in range(11, 21)
+                for fcst_hr in (6, 9)
+            },
+        )
+        self.new_task()
+        os.remove(os.path.join(self.tmp_dir.name, 'out', 'mem011', 'gdas.t12z.sfcf006.nc'))
+        output_path, _ = self.retrieve()
+
+        rerun = self.hpss.calls('htar')[calls:]
+        self.assertEqual(rerun[0], f'-tf {self.day}/enkfgdas.20220625_12.grp2b.tar')
+        self.assertEqual(len(rerun), 2)
+        with open(os.path.join(output_path.format(mem=11), 'gdas.t12z.sfcf006.nc')) as fn:
+            self.assertEqual(fn.read(), 'CDF\x0111 gdas.t12z.sfcf006.nc (rewritten)')
+
+    def test_index_picks_internal_dir(self):
+
+        ''' Only the internal directory that holds the files is
+        extracted from, in a single call per archive. '''
+
+        with open(self.config) as config_file:
+            config = yaml.safe_load(config_file)
+        config['GDAS']['hpss']['archive_internal_dir'].insert(
+            0, './gdas.{yyyymmdd}/{hh}/mem{mem:03d}')
+        with open(self.config, 'w') as config_file:
+            yaml.dump(config, config_file)
+
+        self.add_archives()
+        output_path, _ = self.retrieve('--max_hpss_sessions', '8')
+        self.check_output(output_path)
+
+        calls = [call for call in self.hpss.calls('htar') if call.startswith('-xvf')]
+        self.assertEqual(len(calls), 6)
+        for call in calls:
+            self.assertNotIn('./gdas.', call)
+
+
+class ZipRangeTesting(unittest.TestCase):
+
+    ''' Tests for extracting members of zip archives with byte range
+    requests, from local zip fixtures. Each archive holds 18 forecast
+    hours of 200 kB each, stored or deflated. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        retrieve_data.get_http_pool().close()
+
+        self.served = os.path.join(self.tmp_dir.name, 'served', 'rap')
+        os.makedirs(self.served)
+        self.output_path = os.path.join(self.tmp_dir.name, 'out', '{yyyymmddhh}')
+        self.contents = {}
+        for cycle in ('2022062500', '2022062512'):
+            self.make_zip(os.path.join(self.served, f'rap.{cycle}.zip'), cycle)
+
+    def make_zip(self, path, cycle):
+        ''' Write the zip archive of a cycle and remember its members '''
+        rng = random.Random(cycle)
+        with zipfile.ZipFile(path, 'w') as archive:
+            for fcst_hr in range(18):
+                member = f'./rap/{cycle[8:]}/rap.t{cycle[8:]}z.wrfprsf{fcst_hr:02d}.grib2'
+                content = rng.randbytes(100_000)
+                content += f'{cycle} f{fcst_hr:02d} '.encode() * 8_000
+                archive.writestr(
+                    member, content,
+                    zipfile.ZIP_DEFLATED if fcst_hr % 2 else zipfile.ZIP_STORED)
+                self.contents[cycle, fcst_hr] = content
+
+    def plan(self, url, **store_specs):
+        config = {'RAP': {'aws': {
+            'protocol': 'download',
+            'url': f'{url}/rap',
+            'archive_format': 'zip',
+            'archive_file_names': {'fcst': ['rap.{yyyymmdd}{hh}.zip']},
+            'archive_internal_dir': ['./rap_wrong/{hh}', './rap/{hh}'],
+            'file_names': {'fcst': ['rap.t{hh}z.wrfprsf{fcst_hr:02d}.grib2']},
+            **store_specs,
+        }}}
+        return retrieve_data.RetrievalPlan(
+            'RAP', ['2022062500', '2022062512', '12'], [3, 9, 3],
+            self.output_path, ['aws'],
+            config=config,
+            max_workers=2,
+        )
+
+    def check_output(self):
+        for cycle in ('2022062500', '2022062512'):
+            output_path = self.output_path.format(yyyymmddhh=cycle)
+            self.assertEqual(data_files(output_path), [
+                f'rap.t{cycle[8:]}z.wrfprsf{fcst_hr:02d}.grib2' for fcst_hr in (3, 6, 9)
+            ])
+            for fcst_hr in (3, 6, 9):
+                file_name = f'rap.t{cycle[8:]}z.wrfprsf{fcst_hr:02d}.grib2'
+                with open(os.path.join(output_path, file_name), 'rb') as fn:
+                    self.assertEqual(fn.read(), self.contents[cycle, fcst_hr])
+
+    def test_range_reader(self):
+
+        ''' Opening an archive reads its end, and each member is read
+        with a single request. A reader that is sent the whole archive
+        reads it only once. '''
+
+        with open(os.path.join(self.served, 'rap.2022062512.zip'), 'rb') as fn:
+            data = fn.read()
+        spans = []
+
+        def read_range(first, last):
+            spans.append((first, last))
+            return first, data[first:last + 1]
+
+        reader = retrieve_data.RangeReader(read_range, len(data))
+        reader.prefetch(len(data) - retrieve_data.ZIP_TAIL_BYTES, len(data) - 1)
+        with zipfile.ZipFile(reader) as archive:
+            missing = retrieve_data.extract_zip_members(archive, {
+                './rap/12/rap.t12z.wrfprsf05.grib2': self.tmp_dir.name,
+                './rap/12/rap.t12z.wrfprsf06.grib2': self.tmp_dir.name,
+                './rap/12/rap.t12z.wrfprsf99.grib2': self.tmp_dir.name,
+            })
+
+        self.assertEqual(missing, {'./rap/12/rap.t12z.wrfprsf99.grib2'})
+        for fcst_hr in (5, 6):
+            with open(os.path.join(self.tmp_dir.name, f'rap.t12z.wrfprsf{fcst_hr:02d}.grib2'), 'rb') as fn:
+                self.assertEqual(fn.read(), self.contents['2022062512', fcst_hr])
+        self.assertEqual(reader.requests, 3)
+        read = sum(last - first + 1 for first, last in spans)
+        self.assertLess(read, len(data) / 5)
+
+        whole = retrieve_data.RangeReader(lambda first, last: (0, data), len(data))
+        with zipfile.ZipFile(whole) as archive:
+            self.assertFalse(retrieve_data.extract_zip_members(archive, {
+                './rap/12/rap.t12z.wrfprsf07.grib2': self.tmp_dir.name,
+                './rap/12/rap.t12z.wrfprsf08.grib2': self.tmp_dir.name,
+            }))
+        self.assertEqual(whole.requests, 1)
+
+    def test_download_zip_store(self):
+
+        ''' Members are found under the right internal directory and
+        downloaded with byte ranges only. A rerun skips them. '''
+
+        with StandInServer(os.path.dirname(self.served)) as server:
+            plan = self.plan(server.url)
+            self.assertEqual(retrieve_data.retrieve(plan), {
+                dt.datetime(2022, 6, 25, 0): 'aws',
+                dt.datetime(2022, 6, 25, 12): 'aws',
+            })
+            self.check_output()
+
+            # A HEAD request, the end of the archive, and a range for each
+            # member, for each cycle
+            self.assertEqual(len(server.requests), 2 * (1 + 1 + 3))
+            self.assertEqual(len(server.ranges), 2 * (1 + 3))
+            size = os.path.getsize(os.path.join(self.served, 'rap.2022062512.zip'))
+            read = 0
+            for byte_range in server.ranges:
+                first, last = byte_range.split('=')[1].split('-')
+                read += min(int(last), size - 1) - int(first) + 1
+            self.assertLess(read, 2 * size / 4)
+
+            events = []
+            retrieve_data.retrieve(plan, events.append)
+            self.assertEqual(len(server.requests), 10)
+            self.assertEqual(
+                [event.kind for event in events].count('skipped'), 6)
+
+    def test_missing_member(self):
+
+        ''' A member missing from an archive makes its cycle
+        unavailable. '''
+
+        os.remove(os.path.join(self.served, 'rap.2022062500.zip'))
+        self.make_zip(os.path.join(self.served, 'rap.2022062500.zip'), '2022062412')
+        with StandInServer(os.path.dirname(self.served)) as server:
+            with self.assertRaises(retrieve_data.FilesUnavailableError) as raised:
+                retrieve_data.retrieve(self.plan(server.url))
+
+        self.assertEqual(list(raised.exception.unavailable), [dt.datetime(2022, 6, 25, 0)])
+        self.assertEqual(raised.exception.retrieved, {dt.datetime(2022, 6, 25, 12): 'aws'})
+
+
+class BatchRetrievalTesting(unittest.TestCase):
+
+    ''' Tests for retrieving several cycles in a single run. '''
+
+    cycles = ['2022062500', '2022062506', '2022062512', '2022062518']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for probed in (retrieve_data._HSI_EXISTS, retrieve_data._HSI_STAT):
+            cache = mock.patch.dict(probed, clear=True)
+            cache.start()
+            self.addCleanup(cache.stop)
+        retrieve_data.get_http_pool().close()
+        self.output_path = os.path.join(self.tmp_dir.name, 'out', '{yyyymmddhh}')
+
+    def retrieve(self, config, data_store, *extra_args):
+
+        ''' Run retrieve_data.main for all the cycles of a day. '''
+
+        retrieve_data.main([
+            '--anl_or_fcst', 'fcst',
+            '--config', config,
+            '--cycle_dates', '2022062500', '2022062518', '6',
+            '--data_stores', data_store,
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '3', '6', '3',
+            '--output_path', self.output_path,
+            '--file_type', 'grib2',
+            '--summary_file', 'extrn_mdl_var_defns.sh',
+            *extra_args,
+        ])
+
+    def check_output(self, data_src):
+        for cycle in self.cycles:
+            output_path = self.output_path.format(yyyymmddhh=cycle)
+            self.assertEqual(data_files(output_path), [
+                'extrn_mdl_var_defns.sh',
+                f'gfs.t{cycle[-2:]}z.pgrb2.0p25.f003',
+                f'gfs.t{cycle[-2:]}z.pgrb2.0p25.f006',
+            ])
+            with open(os.path.join(output_path, 'extrn_mdl_var_defns.sh')) as fn:
+                summary = fn.read()
+            self.assertIn(f'DATA_SRC={data_src}', summary)
+            self.assertIn(f'EXTRN_MDL_CDATE={cycle}', summary)
+            self.assertIn(f'EXTRN_MDL_STAGING_DIR={output_path}', summary)
+
+    def test_cycle_date_lists(self):
+        to_datetime = retrieve_data.to_datetime
+        self.assertEqual(
+            retrieve_data.arg_list_to_dates(['2022062500', '2022062518', '6']),
+            [to_datetime(cycle) for cycle in self.cycles],
+        )
+        self.assertEqual(
+            len(retrieve_data.arg_list_to_dates(['2022062500', '2022062518'])),
+            19,
+        )
+        self.assertEqual(
+            retrieve_data.arg_list_to_dates(self.cycles),
+            [to_datetime(cycle) for cycle in self.cycles],
+        )
+
+    def test_output_path_needs_cycle_template(self):
+        self.output_path = os.path.join(self.tmp_dir.name, 'out')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            self.retrieve(os.devnull, 'nomads')
+
+    def test_download_cycles(self):
+
+        ''' Files for all cycles are downloaded over one connection. '''
+
+        served = os.path.join(self.tmp_dir.name, 'served')
+        for cycle in self.cycles:
+            data_dir = os.path.join(served, f'gfs.{cycle[:8]}', cycle[-2:])
+            os.makedirs(data_dir, exist_ok=True)
+            for fcst_hr in (3, 6):
+                file_name = f'gfs.t{cycle[-2:]}z.pgrb2.0p25.f{fcst_hr:03d}'
+                with open(os.path.join(data_dir, file_name), 'wb') as fn:
+                    fn.write(os.urandom(1024))
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        with StandInServer(served) as server:
+            write_stand_in_config(
+                config,
+                url=f'{server.url}/gfs.{{yyyymmdd}}/{{hh}}',
+                file_names=['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}'],
+            )
+            self.retrieve(config, 'nomads', '--max_workers', '4')
+
+        self.check_output('nomads')
+        self.assertEqual(len(server.requests), 8)
+
+    def test_hpss_cycles_share_archive(self):
+
+        ''' Cycles held in the same archive are extracted with a single
+        htar call, after a single hsi call to find the archives and a
+        single htar call to list the archive. '''
+
+        day = '/NCEPPROD/hpssprod/runhistory/rh2022/202206/20220625'
+        hpss = FakeHPSS(self.tmp_dir.name)
+        hpss.add_tar(f'{day}/gfs.20220625.pgrb2.tar', {
+            f'./gfs.20220625/{cycle[-2:]}/gfs.t{cycle[-2:]}z.pgrb2.0p25.f{fcst_hr:03d}':
+                cycle.encode()
+            for cycle in self.cycles
+            for fcst_hr in (3, 6)
+        })
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        with open(config, 'w') as config_file:
+            yaml.dump({'FV3GFS': {'hpss': {
+                'protocol': 'htar',
+                'archive_path': ['/NCEPPROD/hpssprod/runhistory/rh{yyyy}/{yyyymm}/{yyyymmdd}'],
+                'archive_internal_dir': ['./gfs.{yyyymmdd}/{hh}'],
+                'archive_file_names': {'grib2': {'fcst': ['gfs.{yyyymmdd}.pgrb2.tar']}},
+                'file_names': {'grib2': {'fcst': ['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}']}},
+            }}}, config_file)
+
+        with hpss:
+            self.retrieve(config, 'hpss')
+
+        self.check_output('hpss')
+        self.assertEqual(len(hpss.calls('hsi')), 1)
+        self.assertEqual([call.split()[0] for call in hpss.calls('htar')],
+                         ['-tf', '-xvf'])
+
+    def test_missing_cycle_falls_back(self):
+
+        ''' Only the cycles missing from the first data store are looked
+        for in the next one, and each summary file names the store that
+        provided its cycle. '''
+
+        served = os.path.join(self.tmp_dir.name, 'served')
+        for cycle in self.cycles:
+            for store in ('first', 'second'):
+                if store == 'first' and cycle == '2022062506':
+                    continue
+                data_dir = os.path.join(served, store, cycle)
+                os.makedirs(data_dir, exist_ok=True)
+                for fcst_hr in (3, 6):
+                    file_name = f'gfs.t{cycle[-2:]}z.pgrb2.0p25.f{fcst_hr:03d}'
+                    with open(os.path.join(data_dir, file_name), 'wb') as fn:
+                        fn.write(os.urandom(16))
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        with StandInServer(served) as server:
+            file_names = {'grib2': {'fcst': ['gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}']}}
+            with open(config, 'w') as config_file:
+                yaml.dump({'FV3GFS': {
+                    store: {
+                        'protocol': 'download',
+                        'url': f'{server.url}/{store}/{{yyyymmddhh}}',
+                        'file_names': file_names,
+                    }
+                    for store in ('first', 'second')
+                }}, config_file)
+            retrieve_data.main([
+                '--anl_or_fcst', 'fcst',
+                '--config', config,
+                '--cycle_dates', *self.cycles,
+                '--data_stores', 'first', 'second',
+                '--external_model', 'FV3GFS',
+                '--fcst_hrs', '3', '6', '3',
+                '--output_path', self.output_path,
+                '--file_type', 'grib2',
+                '--summary_file', 'extrn_mdl_var_defns.sh',
+            ])
+
+        second = [path for path in server.requests if '/second/' in path]
+        self.assertEqual(len(second), 2)
+        summary = os.path.join(
+            self.output_path.format(yyyymmddhh='2022062506'),
+            'extrn_mdl_var_defns.sh')
+        with open(summary) as fn:
+            self.assertIn('DATA_SRC=second', fn.read())
+
+
+class DiskLinkModeTesting(unittest.TestCase):
+
+    ''' Tests for placing files from the disk data store in the output
+    path with each link mode. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.source_dir = os.path.join(self.tmp_dir.name, 'staged', '2022062512')
+        self.output_path = os.path.join(self.tmp_dir.name, 'out')
+        os.makedirs(self.source_dir)
+        os.makedirs(self.output_path)
+        self.source = os.path.join(self.source_dir, 'gfs.t12z.atmanl.nc')
+        with open(self.source, 'wb') as fn:
+            fn.write(os.urandom(1024))
+
+    def place(self, link_mode):
+        self.assertTrue(
+            retrieve_data.copy_file(self.source, self.output_path, link_mode))
+        file_path = os.path.join(self.output_path, 'gfs.t12z.atmanl.nc')
+        with open(file_path, 'rb') as fn, open(self.source, 'rb') as source:
+            self.assertEqual(fn.read(), source.read())
+        return file_path
+
+    def test_copy(self):
+        file_path = self.place('copy')
+        self.assertFalse(os.path.samefile(file_path, self.source))
+
+    def test_hardlink(self):
+        file_path = self.place('hardlink')
+        self.assertFalse(os.path.islink(file_path))
+        self.assertTrue(os.path.samefile(file_path, self.source))
+
+    def test_symlink(self):
+        file_path = self.place('symlink')
+        self.assertEqual(os.readlink(file_path), self.source)
+
+    def test_reflink_or_copy(self):
+
+        ''' reflink falls back to a copy on file systems without
+        copy-on-write support. '''
+
+        file_path = self.place('reflink')
+        self.assertFalse(os.path.islink(file_path))
+        self.assertFalse(os.path.samefile(file_path, self.source))
+
+    def test_auto(self):
+        file_path = self.place('auto')
+        self.assertFalse(os.path.islink(file_path))
+
+    def test_hardlink_falls_back_to_copy(self):
+        with mock.patch('os.link', side_effect=OSError(18, 'Invalid cross-device link')):
+            file_path = self.place('hardlink')
+        self.assertFalse(os.path.samefile(file_path, self.source))
+
+    def test_replace_existing_file(self):
+
+        ''' A file left by an earlier attempt is replaced, even when it is
+        a link to the source. '''
+
+        self.place('symlink')
+        file_path = self.place('copy')
+        self.assertFalse(os.path.islink(file_path))
+        self.assertEqual(os.listdir(self.output_path), ['gfs.t12z.atmanl.nc'])
+
+    def test_missing_file(self):
+        self.assertFalse(retrieve_data.copy_file(
+            os.path.join(self.source_dir, 'missing.nc'), self.output_path, 'auto'))
+        self.assertEqual(os.listdir(self.output_path), [])
+
+    def test_disk_data_store(self):
+
+        ''' The disk data store links the files and writes the summary
+        file that points at them. '''
+
+        retrieve_data.main([
+            '--anl_or_fcst', 'anl',
+            '--config', os.path.join(
+                os.path.dirname(__file__), 'templates', 'data_locations.yml'),
+            '--cycle_date', '2022062512',
+            '--data_stores', 'disk',
+            '--external_model', 'FV3GFS',
+            '--fcst_hrs', '0',
+            '--output_path', self.output_path,
+            '--input_file_path', os.path.join(self.tmp_dir.name, 'staged', '{yyyymmddhh}'),
+            '--file_templates', 'gfs.t{hh}z.atmanl.nc',
+            '--summary_file', 'extrn_mdl_var_defns.sh',
+            '--link_mode', 'hardlink',
+        ])
+
+        file_path = os.path.join(self.output_path, 'gfs.t12z.atmanl.nc')
+        self.assertTrue(os.path.samefile(file_path, self.source))
+        with open(os.path.join(self.output_path, 'extrn_mdl_var_defns.sh')) as fn:
+            summary = fn.read()
+        self.assertIn('DATA_SRC=disk', summary)
+        self.assertIn('EXTRN_MDL_FNS=( gfs.t12z.atmanl.nc )', summary)
+
+    @benchmark
+    def test_link_benchmark(self):
+
+        ''' Compare the time to stage a 64 MB file with each mode. '''
+
+        with open(self.source, 'wb') as fn:
+            fn.write(os.urandom(64 * 1024 * 1024))
+
+        timings = {}
+        for link_mode in ('copy', 'hardlink', 'symlink', 'auto'):
+            output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+            start = time.perf_counter()
+            retrieve_data.copy_file(self.source, output_path, link_mode)
+            timings[link_mode] = time.perf_counter() - start
+
+        print('\nstaging 64 MB: ' + ', '.join(
+            f'{mode} {seconds * 1000:.1f} ms' for mode, seconds in timings.items()))
+        self.assertLess(timings['hardlink'], timings['copy'])
+
+
+@mock.patch('retrieve_data.HTTP_BACKOFF_BASE', 0.05)
+class ThrottleTesting(unittest.TestCase):
+
+    ''' Tests for pacing requests to each host, and backing off when a
+    data store throttles requests. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.pool = retrieve_data.HTTPConnectionPool()
+        self.addCleanup(self.pool.close)
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        os.makedirs(self.served)
+        for num in range(10):
+            with open(os.path.join(self.served, f'file{num}'), 'wb') as fn:
+                fn.write(os.urandom(1024))
+
+    def test_token_bucket(self):
+
+        ''' Requests beyond the burst are paced at the rate limit. '''
+
+        throttle = retrieve_data.HostThrottle(rate=20, burst=2)
+        start = time.perf_counter()
+        for _ in range(10):
+            throttle.acquire()
+        elapsed = time.perf_counter() - start
+
+        self.assertGreater(elapsed, 8 / 20 * 0.9)
+        self.assertEqual(throttle.stats['requests'], 10)
+        self.assertEqual(throttle.stats['waits'], 8)
+
+    def test_backoff_grows_and_resets(self):
+        throttle = retrieve_data.HostThrottle(max_backoff=0.3)
+        delays = [throttle.backoff() for _ in range(4)]
+        self.assertTrue(0.025 <= delays[0] <= 0.05)
+        self.assertTrue(0.05 <= delays[1] <= 0.1)
+        self.assertTrue(0.15 <= delays[3] <= 0.3)
+        throttle.succeeded()
+        self.assertLessEqual(throttle.backoff(), 0.05)
+
+    def test_backoff_on_429(self):
+
+        ''' A throttled download backs off and then succeeds, honoring
+        Retry-After. '''
+
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        with StandInServer(self.served, throttle_first=2, retry_after=0) as server:
+            start = time.perf_counter()
+            transfer = self.pool.download(f'{server.url}/file0', output_path)
+            elapsed = time.perf_counter() - start
+            stats = self.pool.throttle_stats()[server.url.split('//')[1]]
+
+        self.assertIsNotNone(transfer)
+        self.assertEqual(server.throttled, 2)
+        self.assertEqual(stats['backoffs'], 2)
+        self.assertEqual(stats['requests'], 3)
+        self.assertGreater(elapsed, 0.025 + 0.05)
+
+    def test_no_backoff_for_missing_files(self):
+        with StandInServer(self.served) as server:
+            self.assertIsNone(self.pool.download(
+                f'{server.url}/missing', self.tmp_dir.name))
+            stats = self.pool.throttle_stats()[server.url.split('//')[1]]
+        self.assertEqual(stats['backoffs'], 0)
+
+    def test_redirect_is_paced(self):
+
+        ''' A request redirected to another host, e.g. a mirror, waits for
+        the rate limit of that host as well. '''
+
+        with StandInServer(self.served) as mirror, \
+                StandInServer(self.tmp_dir.name, redirect_to=mirror.url) as front:
+            self.pool.limit_hosts([mirror.url], requests_per_second=20)
+            for num in range(4):
+                self.assertIsNotNone(self.pool.read(f'{front.url}/file{num}'))
+            stats = self.pool.throttle_stats()
+
+        self.assertEqual(len(mirror.requests), 4)
+        self.assertEqual(stats[front.url.split('//')[1]]['requests'], 4)
+        self.assertEqual(stats[mirror.url.split('//')[1]]['requests'], 4)
+        self.assertEqual(stats[mirror.url.split('//')[1]]['waits'], 3)
+
+    def retrieve(self, server, **store_specs):
+
+        ''' Retrieve all ten files at once from the server with
+        retrieve_data.main, and return the throttling stats of the
+        server's host. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        output_path = tempfile.mkdtemp(dir=self.tmp_dir.name)
+        pool = retrieve_data.HTTPConnectionPool()
+        self.addCleanup(pool.close)
+        write_stand_in_config(
+            config,
+            url=server.url,
+            file_names=['file{fcst_hr}'],
+            **store_specs,
+        )
+        with mock.patch('retrieve_data._HTTP_POOL', pool):
+            retrieve_data.main([
+                '--anl_or_fcst', 'fcst',
+                '--config', config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'nomads',
+                '--external_model', 'FV3GFS',
+                '--fcst_hrs', '0', '9',
+                '--output_path', output_path,
+                '--file_type', 'grib2',
+                '--max_workers', '10',
+            ])
+        self.assertEqual(len(data_files(output_path)), 10)
+        return pool.throttle_stats()[server.url.split('//')[1]]
+
+    def test_backoff_without_rate_limit(self):
+
+        ''' Without a rate limit, a burst of requests is throttled, and
+        the downloads back off until they get through. '''
+
+        with StandInServer(self.served, max_rate=8) as server:
+            stats = self.retrieve(server)
+
+        self.assertGreater(server.throttled, 0)
+        self.assertEqual(stats['backoffs'], server.throttled)
+
+    def test_rate_limit_from_data_locations(self):
+
+        ''' A rate_limit set for a data store keeps concurrent downloads
+        under the rate the server accepts. '''
+
+        with StandInServer(self.served, max_rate=8) as server:
+            stats = self.retrieve(
+                server, rate_limit={'requests_per_second': 5, 'burst': 1})
+
+        self.assertEqual(server.throttled, 0)
+        self.assertEqual(stats['requests'], 10)
+        self.assertEqual(stats['backoffs'], 0)
+        self.assertGreater(stats['waits'], 0)
+
+
+class ConfigCacheTesting(unittest.TestCase):
+
+    ''' Tests for the cache of parsed config files. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'config_cache')
+        for patcher in (
+                mock.patch.dict(os.environ, {'REGIONAL_WORKFLOW_CONFIG_CACHE': self.cache_dir}),
+                mock.patch.dict(config_parser._CONFIG_CACHE, clear=True),
+                mock.patch('retrieve_data.TELEMETRY', retrieve_data.Telemetry())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        shutil.copy(
+            os.path.join(os.path.dirname(__file__), 'templates', 'data_locations.yml'),
+            self.config)
+
+    def outcomes(self):
+        return {
+            key: value for key, value in
+            retrieve_data.TELEMETRY.totals[('config', self.config)].items()
+            if not key.endswith('_seconds')
+        }
+
+    def test_parsed_once(self):
+
+        ''' A config file is parsed once, then loaded from memory, and
+        from disk by other processes, until its content changes. Each
+        load returns its own copy. '''
+
+        with open(self.config) as fn:
+            expected = yaml.safe_load(fn)
+
+        cfg = retrieve_data.config_exists(self.config)
+        self.assertEqual(cfg, expected)
+        cfg['FV3GFS'].clear()
+        self.assertEqual(retrieve_data.config_exists(self.config), expected)
+
+        config_parser._CONFIG_CACHE.clear()
+        self.assertEqual(retrieve_data.config_exists(self.config), expected)
+        self.assertEqual(
+            self.outcomes(), {'parsed': 1, 'memory_hits': 1, 'disk_hits': 1})
+
+        with open(self.config, 'a') as fn:
+            fn.write('EXTRA:\n  hpss: {}\n')
+        self.assertIn('EXTRA', retrieve_data.config_exists(self.config))
+        self.assertEqual(self.outcomes()['parsed'], 2)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_memory_only(self):
+
+        ''' Without a cache directory setting, results are only kept in
+        memory. '''
+
+        with mock.patch.dict(os.environ):
+            del os.environ['REGIONAL_WORKFLOW_CONFIG_CACHE']
+            for _ in range(2):
+                retrieve_data.config_exists(self.config)
+        self.assertEqual(self.outcomes(), {'parsed': 1, 'memory_hits': 1})
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_writable_entry_is_ignored(self):
+
+        ''' Entries are stored as JSON, and one that others could have
+        written is parsed again instead of being used. '''
+
+        retrieve_data.config_exists(self.config)
+        entry, = glob.glob(os.path.join(self.cache_dir, '*.json'))
+        with open(entry) as fn:
+            cached = json.load(fn)
+        cached['FV3GFS'] = 'tampered'
+        with open(entry, 'w') as fn:
+            json.dump(cached, fn)
+        os.chmod(entry, 0o666)
+
+        config_parser._CONFIG_CACHE.clear()
+        cfg = retrieve_data.config_exists(self.config)
+        self.assertNotEqual(cfg['FV3GFS'], 'tampered')
+        self.assertEqual(self.outcomes(), {'parsed': 2})
+
+
+class TelemetryTesting(unittest.TestCase):
+
+    ''' Tests for the events and statistics recorded for each
+    retrieval. '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.telemetry = retrieve_data.Telemetry()
+        patcher = mock.patch('retrieve_data.TELEMETRY', self.telemetry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.telemetry.close)
+
+        self.served = os.path.join(self.tmp_dir.name, 'served')
+        os.makedirs(self.served)
+        for num in range(3):
+            with open(os.path.join(self.served, f'file{num}'), 'wb') as fn:
+                fn.write(os.urandom(1024))
+        self.log_file = os.path.join(self.tmp_dir.name, 'telemetry.jsonl')
+
+    def retrieve(self, server):
+
+        ''' Retrieve the three files from the server with
+        retrieve_data.main, with telemetry, statistics and a cache, and
+        return what it printed. '''
+
+        config = os.path.join(self.tmp_dir.name, 'data_locations.yml')
+        write_stand_in_config(config, url=server.url, file_names=['file{fcst_hr}'])
+        pool = retrieve_data.HTTPConnectionPool()
+        self.addCleanup(pool.close)
+        stdout = io.StringIO()
+        with mock.patch('retrieve_data._HTTP_POOL', pool), \
+                contextlib.redirect_stdout(stdout):
+            retrieve_data.main([
+                '--anl_or_fcst', 'fcst',
+                '--config', config,
+                '--cycle_date', '2022062512',
+                '--data_stores', 'nomads',
+                '--external_model', 'FV3GFS',
+                '--fcst_hrs', '0', '2',
+                '--output_path', tempfile.mkdtemp(dir=self.tmp_dir.name),
+                '--file_type', 'grib2',
+                '--cache_dir', os.path.join(self.tmp_dir.name, 'cache'),
+                '--telemetry', self.log_file,
+                '--stats',
+            ])
+        return stdout.getvalue()
+
+    def events(self, name):
+
+        ''' Return the events of a kind in the telemetry file. '''
+
+        with open(self.log_file) as fn:
+            events = [json.loads(line) for line in fn]
+        return [event for event in events if event['event'] == name]
+
+    def test_events_of_a_retrieval(self):
+
+        ''' Each file, transfer, retry and cycle is logged with its
+        bytes and timing, and the statistics are printed at exit. '''
+
+        with StandInServer(self.served, throttle_first=2, retry_after=0) as server:
+            printed = self.retrieve(server)
+        host = server.url.split('//')[1]
+
+        files = self.events('file')
+        self.assertEqual(len(files), 3)
+        for event in files:
+            self.assertEqual(event['data_store'], 'nomads')
+            self.assertEqual(event['outcome'], 'retrieved')
+            self.assertEqual(event['bytes'], 1024)
+            self.assertGreater(event['seconds'], 0)
+
+        transfers = self.events('transfer')
+        self.assertEqual(len(transfers), 3)
+        self.assertEqual(sum(event['backoffs'] for event in transfers), 2)
+        self.assertTrue(all(event['host'] == host for event in transfers))
+
+        retries = self.events('retry')
+        self.assertEqual(len(retries), 2)
+        self.assertTrue(all(event['backoff_seconds'] > 0 for event in retries))
+
+        self.assertEqual(
+            [event['cycle_date'] for event in self.events('cycle')],
+            ['2022-06-25 12:00:00'],
+        )
+        self.assertEqual(len(self.events('location')), 1)
+        self.assertEqual(self.events('throttle')[0]['backoffs'], 2)
+
+        self.assertIn('data store nomads: ', printed)
+        self.assertIn('files_retrieved=3 ', printed)
+        self.assertIn('files_retrieved_MB=0.0 ', printed)
+        self.assertIn(f'host {host}: retries=2 ', printed)
+        self.assertIn('transfers=3 ', printed)
+
+    def test_cache_hits_are_counted(self):
+
+        ''' A second retrieval of the same files is served by the cache
+        and counted as cache hits, without transfers. '''
+
+        with StandInServer(self.served) as server:
+            self.retrieve(server)
+            self.telemetry.reset()
+            printed = self.retrieve(server)
+
+        self.assertEqual(len(self.events('cache_hit')), 3)
+        self.assertEqual(len(self.events('transfer')), 3)
+        self.assertIn('cache_hits=3 ', printed)
+        self.assertNotIn('transfers=', printed)
+